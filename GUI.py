@@ -3,16 +3,30 @@ from PyQt5.QtWidgets import *
 from PyQt5.QtGui import *
 from PyQt5.QtCore import *
 from functools import partial
+from contextlib import contextmanager
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from multiprocessing import shared_memory, get_context
 import sys
 import matplotlib
 matplotlib.use("Qt5Agg")  # 声明使用QT5
 matplotlib.rcParams['savefig.dpi'] = 600
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT as NavigationToolbar
+from matplotlib.collections import LineCollection
 import matplotlib.pyplot as plt
 import os
 import re
+import json
+import time
+import struct
+import mmap
+import sqlite3
+import zipfile
 from scipy.interpolate import interp1d
+from scipy.signal import savgol_filter, find_peaks
+from scipy.ndimage import median_filter
+from scipy.optimize import least_squares
 import pickle
 
 """
@@ -40,14 +54,18 @@ class MainWindow(QMainWindow):
 
         global spectrum_widget
         global merged_spec_widget
+        global series_viewer_widget
 
         # create the up widget for image loading and angle selection
         spectrum_widget = Spectrum()
         merged_spec_widget = MergedSpecDisplayManager()
+        series_viewer_widget = SeriesViewer()
 
         # Note that this command needs to be declared outside spectrum_widget, otherwise
         # there is cross declaration problem
         spectrum_widget.show_manager_btn.clicked.connect(merged_spec_widget.show)
+        spectrum_widget.show_series_btn.clicked.connect(series_viewer_widget.show)
+        spectrum_widget.series_merged.connect(series_viewer_widget.set_series)
 
         splitter.addWidget(spectrum_widget)
 
@@ -90,6 +108,7 @@ class MergedSpecDisplayManager(QFrame):
         super().__init__()
         self.initUI()
         self.counter = 0
+        self.campaign = None
         self.setGeometry(150, 100, 250, 50)
 
     def initUI(self):
@@ -111,6 +130,30 @@ class MergedSpecDisplayManager(QFrame):
         self.load_folder_btn.clicked.connect(self.load_mergedSpec_from_folder)
         btn_hbox.addWidget(self.load_folder_btn)
 
+        campaign_hbox = QHBoxLayout()
+        self.campaign_btn = QPushButton("Open campaign")
+        self.campaign_btn.setFixedWidth(100)
+        self.campaign_btn.clicked.connect(self.open_campaign)
+        self.campaign_import_btn = QPushButton("Import folder")
+        self.campaign_import_btn.setFixedWidth(100)
+        self.campaign_import_btn.setEnabled(False)
+        self.campaign_import_btn.clicked.connect(self.import_campaign_folder)
+        self.campaign_sample_le = QLineEdit()
+        self.campaign_sample_le.setPlaceholderText("sample, * for any")
+        self.campaign_temperature_le = QLineEdit()
+        self.campaign_temperature_le.setPlaceholderText("T or Tmin-Tmax")
+        self.campaign_load_btn = QPushButton("Load matches")
+        self.campaign_load_btn.setFixedWidth(100)
+        self.campaign_load_btn.setEnabled(False)
+        self.campaign_load_btn.clicked.connect(self.load_campaign_matches)
+        self.campaign_lb = QLabel("")
+        campaign_hbox.addWidget(self.campaign_btn)
+        campaign_hbox.addWidget(self.campaign_import_btn)
+        campaign_hbox.addWidget(self.campaign_sample_le)
+        campaign_hbox.addWidget(self.campaign_temperature_le)
+        campaign_hbox.addWidget(self.campaign_load_btn)
+        campaign_hbox.addWidget(self.campaign_lb)
+
         color_lb = QLabel("Color")
         color_lb.setFixedHeight(20)
         color_lb.setAlignment(Qt.AlignCenter)
@@ -140,29 +183,14 @@ class MergedSpecDisplayManager(QFrame):
         main_grid.addLayout(self.unload_vbox)
 
         main_vbox.addLayout(btn_hbox)
+        main_vbox.addLayout(campaign_hbox)
         main_vbox.addLayout(main_grid)
 
     def read_refFIT_data(self, path):
-        try:
-            file = np.loadtxt(path).transpose()
-            freq = file[0]
-            reflectance = file[1]
-        except:
-            try:
-                file = np.loadtxt(path, delimiter=",").transpose()
-                freq = file[0]
-                reflectance = file[1]
-            except:
-                try:
-                    file = np.loadtxt(path, delimiter=" ").transpose()
-                    freq = file[0]
-                    reflectance = file[1]
-                except:
-                    return
-        return np.array(reflectance), np.array(freq)
+        return read_refFIT_data(path)
 
     def load_mergedSpec(self):
-        path = QFileDialog.getOpenFileName(self, "Select a file", r"~\PycharmProjects/Transfer Matrix Method", "Text Files (*.txt *.csv *.dat)")[0]
+        path = QFileDialog.getOpenFileName(self, "Select a file", r"~\PycharmProjects/Transfer Matrix Method", SPECTRUM_FILE_FILTER)[0]
         if path != "":
             try:
                 reflectance, freq = self.read_refFIT_data(path)
@@ -173,12 +201,7 @@ class MergedSpecDisplayManager(QFrame):
                 return
 
     def sort_nicely(self, l):
-        """ Sort the given list in the way that humans expect.
-        """
-        convert = lambda text: int(text) if text.isdigit() else text
-        alphanum_key = lambda key: [ convert(c) for c in re.split('([0-9]+)', key) ]
-        l.sort(key=alphanum_key)
-        return l
+        return sort_nicely(l)
 
     def load_mergedSpec_from_folder(self):
         folderpath = QFileDialog.getExistingDirectory(self, 'Select Folder')
@@ -194,6 +217,41 @@ class MergedSpecDisplayManager(QFrame):
                 QMessageBox.warning(self, "Load mergedSpec from folder", "Cannot read files in the selected folder!")
                 return
 
+    def open_campaign(self):
+        folder = QFileDialog.getExistingDirectory(self, "Select the campaign folder")
+        if folder != "":
+            if self.campaign is not None:
+                self.campaign.close()
+            self.campaign = CampaignStore(folder)
+            self.campaign_import_btn.setEnabled(True)
+            self.campaign_load_btn.setEnabled(True)
+            self.campaign_lb.setText("{} spectra".format(len(self.campaign.query())))
+
+    def import_campaign_folder(self):
+        # past text exports are parsed once into the campaign, later loads read them from the store
+        folderpath = QFileDialog.getExistingDirectory(self, 'Select Folder')
+        if folderpath != "":
+            ids = self.campaign.import_folder(folderpath)
+            self.campaign_lb.setText("{} spectra imported, {} in total".format(len(ids), len(self.campaign.query())))
+
+    def load_campaign_matches(self):
+        try:
+            temperature = self.campaign_temperature_le.text().strip()
+            if temperature == "":
+                temperature = None
+            elif re.fullmatch(r"[\d.]+\s*-\s*[\d.]+", temperature):
+                temperature = tuple(float(value) for value in temperature.split("-"))
+            else:
+                temperature = float(temperature)
+        except ValueError:
+            QMessageBox.warning(self, "Load from campaign", "The temperature is a value or a range such as 10-300!")
+            return
+        rows = self.campaign.query(sample=self.campaign_sample_le.text().strip().replace("*", "%") or None, temperature=temperature)
+        for row in rows:
+            reflectance, freq = self.campaign.spectrum(row)
+            self.create_spec(freq, reflectance, row["name"])
+        self.campaign_lb.setText("{} spectra loaded".format(len(rows)))
+
     # use partial to perform lambda functions in exec!
     def create_spec(self, freq, reflectance, name):
         self.counter += 1
@@ -261,12 +319,167 @@ class MergedSpecDisplayManager(QFrame):
         spectrum_widget.axes.legend()
         spectrum_widget.F.draw()
 
+class SeriesViewer(QFrame):
+    # Viewer for long series of merged spectra (e.g. temperature points). Every spectrum is decimated once
+    # on load and the whole series is drawn as one LineCollection (waterfall) or one image (colormap).
+    def __init__(self):
+        super().__init__()
+        self.names = []
+        self.spectra = []
+        self.max_points = 4000
+        self.collection = None
+        self.initUI()
+        self.setGeometry(250, 150, 900, 600)
+
+    def initUI(self):
+        main_vbox = QVBoxLayout()
+        self.setLayout(main_vbox)
+        self.setWindowTitle("Series viewer")
+
+        btn_hbox = QHBoxLayout()
+        self.load_btn = QPushButton("Load series from folder")
+        self.load_btn.setFixedWidth(150)
+        self.load_btn.clicked.connect(self.load_series_from_folder)
+        self.mode_cb = QComboBox()
+        self.mode_cb.addItems(["Waterfall", "Colormap"])
+        self.mode_cb.currentIndexChanged.connect(self.plot_series)
+        spacing_lb = QLabel("spacing")
+        self.spacing_sb = QDoubleSpinBox()
+        self.spacing_sb.setRange(0, 1)
+        self.spacing_sb.setDecimals(3)
+        self.spacing_sb.setSingleStep(0.01)
+        self.spacing_sb.setValue(0.02)
+        self.spacing_sb.valueChanged.connect(self.plot_series)
+        self.count_lb = QLabel("")
+        btn_hbox.addWidget(self.load_btn)
+        btn_hbox.addWidget(self.mode_cb)
+        btn_hbox.addWidget(spacing_lb)
+        btn_hbox.addWidget(self.spacing_sb)
+        btn_hbox.addWidget(self.count_lb)
+
+        self.figure = plt.figure()
+        self.F = FigureCanvas(self.figure)
+        main_vbox.addLayout(btn_hbox)
+        main_vbox.addWidget(NavigationToolbar(self.F, self))
+        main_vbox.addWidget(self.F)
+
+    def load_series_from_folder(self):
+        folderpath = QFileDialog.getExistingDirectory(self, 'Select Folder')
+        if folderpath != "":
+            files = sort_nicely([f for f in os.listdir(folderpath) if is_spectrum_file(f)])
+            with ThreadPoolExecutor(max_workers=max(1, min(8, len(files)))) as pool:
+                data = list(pool.map(lambda f: read_refFIT_data(os.path.join(folderpath, f)), files))
+            names = [f for f, item in zip(files, data) if item is not None]
+            data = [item for item in data if item is not None]
+            if len(data) == 0:
+                QMessageBox.warning(self, "Load series from folder", "Cannot read files in the selected folder!")
+                return
+            self.set_series(names, [item[1] for item in data], [item[0] for item in data])
+
+    def decimate(self, freq, reflectance):
+        # keep the minimum and maximum of each bin so that narrow features survive the decimation
+        order = np.argsort(freq)
+        freq = np.asarray(freq, dtype=float)[order]
+        reflectance = np.asarray(reflectance, dtype=float)[order]
+        index = decimate_index(freq, reflectance, (-np.inf, np.inf), self.max_points)
+        return freq[index], reflectance[index]
+
+    def set_series(self, names, freqs, reflectances):
+        self.names = list(names)
+        self.spectra = [self.decimate(f, R) for f, R in zip(freqs, reflectances)]
+        self.count_lb.setText("{} spectra".format(len(self.spectra)))
+        self.plot_series()
+
+    def series_image(self):
+        # all spectra resampled once onto a shared frequency grid, frequency x series
+        low = min(f[0] for f, R in self.spectra)
+        high = max(f[-1] for f, R in self.spectra)
+        grid = np.linspace(low, high, self.max_points // 2)
+        image = np.vstack([np.interp(grid, f, R, left=np.nan, right=np.nan) for f, R in self.spectra])
+        return grid, image
+
+    def plot_series(self):
+        self.figure.clf()
+        self.axes = self.figure.add_subplot()
+        self.axes.set_xlabel(r'Frequency (cm$^{-1}$)', fontsize=9)
+        self.collection = None
+        if len(self.spectra) > 0:
+            n = len(self.spectra)
+            low = min(f[0] for f, R in self.spectra)
+            high = max(f[-1] for f, R in self.spectra)
+            if self.mode_cb.currentText() == "Waterfall":
+                spacing = self.spacing_sb.value()
+                self.extents = np.array([[np.nanmin(R), np.nanmax(R)] for f, R in self.spectra]) + (np.arange(n) * spacing)[:, None]
+                self.collection = LineCollection([], cmap="viridis", linewidths=0.8)
+                self.collection.set_clim(0, max(n - 1, 1))
+                self.axes.add_collection(self.collection)
+                self.axes.set_xlim([low, high])
+                self.axes.set_ylim([np.min(self.extents[:, 0]), np.max(self.extents[:, 1])])
+                self.axes.set_ylabel("Reflectance (shifted)", fontsize=9)
+                self.update_visible()
+                self.axes.callbacks.connect("xlim_changed", self.update_visible)
+                self.axes.callbacks.connect("ylim_changed", self.update_visible)
+                self.figure.colorbar(self.collection, ax=self.axes, label="Series index")
+            else:
+                grid, image = self.series_image()
+                im = self.axes.imshow(image, aspect="auto", origin="lower", interpolation="nearest", cmap="viridis", extent=[grid[0], grid[-1], -0.5, n - 0.5])
+                self.axes.set_ylabel("Series index", fontsize=9)
+                self.figure.colorbar(im, ax=self.axes, label="Reflectance")
+        self.F.draw_idle()
+
+    def update_visible(self, axes=None):
+        # only the spectra and frequency windows inside the current view are handed to the collection
+        if self.collection is None:
+            return
+        x0, x1 = self.axes.get_xlim()
+        y0, y1 = self.axes.get_ylim()
+        spacing = self.spacing_sb.value()
+        segments = []
+        index = []
+        for k, (f, R) in enumerate(self.spectra):
+            if self.extents[k][1] < y0 or self.extents[k][0] > y1:
+                continue
+            i0 = max(np.searchsorted(f, x0) - 1, 0)
+            i1 = np.searchsorted(f, x1) + 1
+            if i1 - i0 < 2:
+                continue
+            segments.append(np.column_stack([f[i0:i1], R[i0:i1] + k * spacing]))
+            index.append(k)
+        self.collection.set_segments(segments)
+        self.collection.set_array(np.array(index, dtype=float))
+
 class Spectrum(QFrame):
+    # names, merged frequency grid of each sample and merged reflectance of each sample
+    series_merged = pyqtSignal(list, object, object)
+
     def __init__(self):
         super().__init__()
         self.reflectance = [[], [], [], [], []]
         self.freq = [[], [], [], [], []]
         self.range = [[], [], [], [], []]
+        # per band drawing cache (range, reflectance, window, freq, base, buffer) and the last drawn (offset, multiplier)
+        self.display = [None, None, None, None, None]
+        self.display_scale = [(0, 1), (0, 1), (0, 1), (0, 1), (0, 1)]
+        self.display_points = 4000
+        # last sweep as (grid, merged, mean, std, lower, upper) and its shaded band on the plot
+        self.sweep = None
+        self.sweep_fill = None
+        self.extrapolation_curves = []
+        self.pipeline = MergePipeline()
+        # bumped whenever a band gets new data, the pipeline keys the loaded bands on it
+        self.band_version = [0, 0, 0, 0, 0]
+        # measured band arrays and the (method, window, parameter) filter of each band; self.reflectance holds the filtered result
+        self.unfiltered = [None, None, None, None, None]
+        self.band_filters = [None, None, None, None, None]
+        self.filter_cache = {}
+        self.filter_raw_curve = None
+        # per breakpoint (reflectance a, reflectance b, overlap resampled by overlap_grid) and the inset drawing it
+        self.overlap_cache = [None, None, None, None]
+        self.overlap_axes = None
+        self.overlap_level = None
+        self.overlap_lines = [None, None, None, None]
+        # Drude-Lorentz gap fits as (neighbour data the fit was made from, parameters) per band
+        self.gap_fits = [None, None, None, None, None]
         self.offset = np.zeros(5)
         self.multiplier = np.ones(5)
         self.is_auto_fill = [[], [], [], [], []]
@@ -275,11 +488,35 @@ class Spectrum(QFrame):
         self.break_line = [None, None, None, None]
         self.R_curve_color = ["#FF0000", "#FFA500", "#228B22", "#0000FF", "#8A2BE2"]
         self.break_line_color = ["#FF0000", "#FFA500", "#228B22", "#0000FF"]
-        Ag = self.loadpickle("Ag_Epsilon_Reflectance_400-35000cm-1.pickle")
-        self.Ag_refl = interp1d(Ag["Yang2015PRB"].freq, Ag["Yang2015PRB"].R)
-        Au = self.loadpickle("Au_Eps_Reflectance_Olmon2012PRB.pickle")
-        self.Au_refl = interp1d(Au.freq, Au.R)
+        self.band_names = ["EEIR", "FIR", "MIR", "NIR", "VIS"]
+        # typical log-centre frequency (cm-1) and filename pattern of each band, used by the folder import
+        self.band_centers = [30, 200, 1800, 7000, 16000]
+        self.band_patterns = [r"thz|eeir|tds", r"fir|far", r"mir|mid", r"nir|near", r"vis|uv"]
+        # undo/redo history, each entry is a (breakpoints, offsets, multipliers) tuple
+        self.undo_stack = []
+        self.redo_stack = []
+        self.max_history = 200
+        self.holding_history = False
+        self.holding_draw = False
+        self.series = None
+        # (names, freq, reflectance) of the last merged series, the last Drude-Lorentz fit of the merged spectrum and its curve
+        self.series_spectra = None
+        self.fit_params = None
+        self.fit_curve = None
+        # reference single beam file of each band, parsed and resampled once for every sample loaded against it
+        self.single_beam_references = [None, None, None, None, None]
+        self.single_beams = SingleBeamCache()
+        self.campaign = None
+        self.watcher = None
+        self.watch_folder = ""
+        self.watch_stamps = {}
+        # reflectance is held at this precision; scaling, auto-fill and export accumulate in float64
+        self.storage_dtype = np.float64
+        self.references = read_reference_engine()
         self.initUI()
+        self.profiler = StageProfiler(self.show_profile)
+        self.profiler.instrument(self, ["setSliderPos", "setSbPos", "merge_graph", "scale_graph", "renew_graph", "remake_auto_fill_data"])
+        self.profiler.instrument(self.F, ["draw"])
 
     def initUI(self):
         # create main grid to organize layout
@@ -296,27 +533,88 @@ class Spectrum(QFrame):
         save_hbox = QHBoxLayout()
         self.ref_cb = QComboBox()
         self.ref_cb.addItems(["no reference", "Au", "Ag"])
+        self.ref_angle_sb = QDoubleSpinBox()
+        self.ref_angle_sb.setRange(0, 89.9)
+        self.ref_angle_sb.setDecimals(1)
+        self.ref_angle_sb.setSuffix(" deg")
+        self.ref_angle_sb.setToolTip("angle of incidence on the reference mirror")
+        self.ref_polarization_cb = QComboBox()
+        self.ref_polarization_cb.addItems(["s-pol", "p-pol", "unpolarized"])
+        self.ref_material_btn = QPushButton("Load mirror")
+        self.ref_material_btn.setFixedHeight(30)
+        self.ref_material_btn.clicked.connect(self.load_reference_material)
+        self.precision_cb = QComboBox()
+        self.precision_cb.addItems(["float64 storage", "float32 storage"])
+        self.precision_cb.currentIndexChanged.connect(self.set_storage_dtype)
         self.save_spec_cb = QCheckBox("Save spectrum")
         self.save_spec_cb.setChecked(True)
         self.save_params_cb = QCheckBox("Save params")
         self.save_params_cb.setChecked(True)
+        self.save_session_cb = QCheckBox("Save session")
+        self.save_session_cb.setChecked(False)
+        self.save_campaign_cb = QCheckBox("Store in campaign")
+        self.save_campaign_cb.setChecked(False)
+        self.save_campaign_cb.setToolTip("appends the merged spectrum and its parameters to a campaign folder")
         self.save_btn = QPushButton("Save selected items")
         self.save_btn.setFixedHeight(30)
         self.save_btn.clicked.connect(self.save_items)
+        self.merge_series_btn = QPushButton("Merge sample series")
+        self.merge_series_btn.setFixedHeight(30)
+        self.merge_series_btn.clicked.connect(self.merge_series)
         save_hbox.addWidget(self.ref_cb)
+        save_hbox.addWidget(self.ref_angle_sb)
+        save_hbox.addWidget(self.ref_polarization_cb)
+        save_hbox.addWidget(self.ref_material_btn)
+        save_hbox.addWidget(self.precision_cb)
         save_hbox.addWidget(self.save_spec_cb)
         save_hbox.addWidget(self.save_params_cb)
+        save_hbox.addWidget(self.save_session_cb)
+        save_hbox.addWidget(self.save_campaign_cb)
         save_hbox.addWidget(self.save_btn)
+        save_hbox.addWidget(self.merge_series_btn)
         main_grid.addLayout(save_hbox, 0, 0, 1, 2, Qt.AlignCenter)
 
         load_hbox = QHBoxLayout()
         self.show_manager_btn = QPushButton("Show merged spectrum manager")
         self.show_manager_btn.setFixedHeight(30)
+        self.show_series_btn = QPushButton("Show series viewer")
+        self.show_series_btn.setFixedHeight(30)
         self.load_params_btn = QPushButton("Load params")
         self.load_params_btn.setFixedHeight(30)
         self.load_params_btn.clicked.connect(self.load_params)
+        self.load_session_btn = QPushButton("Load session")
+        self.load_session_btn.setFixedHeight(30)
+        self.load_session_btn.clicked.connect(self.load_session)
+        self.load_folder_btn = QPushButton("Load data folder")
+        self.load_folder_btn.setFixedHeight(30)
+        self.load_folder_btn.clicked.connect(self.load_reflectance_folder)
+        self.watch_btn = QPushButton("Watch folder")
+        self.watch_btn.setFixedHeight(30)
+        self.watch_btn.clicked.connect(self.toggle_watch)
+        self.watch_export_cb = QCheckBox("Export on change")
+        self.watch_timer = QTimer(self)
+        self.watch_timer.setSingleShot(True)
+        self.watch_timer.setInterval(500)
+        self.watch_timer.timeout.connect(self.scan_watch_folder)
+        self.undo_btn = QPushButton("Undo")
+        self.undo_btn.setFixedHeight(30)
+        self.undo_btn.setEnabled(False)
+        self.undo_btn.clicked.connect(self.undo)
+        self.redo_btn = QPushButton("Redo")
+        self.redo_btn.setFixedHeight(30)
+        self.redo_btn.setEnabled(False)
+        self.redo_btn.clicked.connect(self.redo)
+        QShortcut(QKeySequence.Undo, self, self.undo)
+        QShortcut(QKeySequence.Redo, self, self.redo)
         load_hbox.addWidget(self.show_manager_btn)
+        load_hbox.addWidget(self.show_series_btn)
+        load_hbox.addWidget(self.load_folder_btn)
+        load_hbox.addWidget(self.watch_btn)
+        load_hbox.addWidget(self.watch_export_cb)
         load_hbox.addWidget(self.load_params_btn)
+        load_hbox.addWidget(self.load_session_btn)
+        load_hbox.addWidget(self.undo_btn)
+        load_hbox.addWidget(self.redo_btn)
         main_grid.addLayout(load_hbox, 0, 3, 1, 2, Qt.AlignCenter)
 
         self.slider_hb = QHBoxLayout()
@@ -630,7 +928,7 @@ class Spectrum(QFrame):
         self.FIR_reset_btn.clicked.connect(lambda: self.reset(1))
         self.FIR_autoFill_cb = QCheckBox("")
         self.FIR_autoFill_combobox = QComboBox()
-        self.FIR_autoFill_combobox.addItems(["1st order fill", "2nd order fill", "3rd order fill"])
+        self.FIR_autoFill_combobox.addItems(["1st order fill", "2nd order fill", "3rd order fill", "Drude-Lorentz fill"])
         self.FIR_autoFill_cb.stateChanged.connect(lambda: self.auto_fill(1, self.FIR_autoFill_cb.isChecked(), self.FIR_autoFill_combobox.currentIndex()))
         self.FIR_autoFill_combobox.currentIndexChanged.connect(lambda: self.auto_fill(1, self.FIR_autoFill_cb.isChecked(), self.FIR_autoFill_combobox.currentIndex()))
         self.FIR_R_lb = QLabel(u'\u274c')
@@ -711,7 +1009,7 @@ class Spectrum(QFrame):
         self.MIR_reset_btn.clicked.connect(lambda: self.reset(2))
         self.MIR_autoFill_cb = QCheckBox("")
         self.MIR_autoFill_combobox = QComboBox()
-        self.MIR_autoFill_combobox.addItems(["1st order fill", "2nd order fill", "3rd order fill"])
+        self.MIR_autoFill_combobox.addItems(["1st order fill", "2nd order fill", "3rd order fill", "Drude-Lorentz fill"])
         self.MIR_autoFill_cb.stateChanged.connect(lambda: self.auto_fill(2, self.MIR_autoFill_cb.isChecked(), self.MIR_autoFill_combobox.currentIndex()))
         self.MIR_autoFill_combobox.currentIndexChanged.connect(lambda: self.auto_fill(2, self.MIR_autoFill_cb.isChecked(), self.MIR_autoFill_combobox.currentIndex()))
         self.MIR_R_lb = QLabel(u'\u274c')
@@ -792,7 +1090,7 @@ class Spectrum(QFrame):
         self.NIR_reset_btn.clicked.connect(lambda: self.reset(3))
         self.NIR_autoFill_cb = QCheckBox("")
         self.NIR_autoFill_combobox = QComboBox()
-        self.NIR_autoFill_combobox.addItems(["1st order fill", "2nd order fill", "3rd order fill"])
+        self.NIR_autoFill_combobox.addItems(["1st order fill", "2nd order fill", "3rd order fill", "Drude-Lorentz fill"])
         self.NIR_autoFill_cb.stateChanged.connect(lambda: self.auto_fill(3, self.NIR_autoFill_cb.isChecked(), self.NIR_autoFill_combobox.currentIndex()))
         self.NIR_autoFill_combobox.currentIndexChanged.connect(lambda: self.auto_fill(3, self.NIR_autoFill_cb.isChecked(), self.NIR_autoFill_combobox.currentIndex()))
         self.NIR_R_lb = QLabel(u'\u274c')
@@ -891,6 +1189,255 @@ class Spectrum(QFrame):
         VIS_hb.addLayout(VIS_vb)
         main_grid.addLayout(VIS_hb, 3, 4, 1, 1, Qt.AlignCenter)
 
+        profile_hbox = QHBoxLayout()
+        self.profile_cb = QCheckBox("Profile")
+        self.profile_cb.stateChanged.connect(lambda: self.profiler.set_enabled(self.profile_cb.isChecked()))
+        self.profile_lb = QLabel("")
+        self.save_trace_btn = QPushButton("Save trace")
+        self.save_trace_btn.setFixedWidth(80)
+        self.save_trace_btn.clicked.connect(self.save_trace)
+        profile_hbox.addWidget(self.profile_cb)
+        profile_hbox.addWidget(self.profile_lb, 1)
+        profile_hbox.addWidget(self.save_trace_btn)
+        main_grid.addLayout(profile_hbox, 4, 0, 1, 5)
+
+        sweep_hbox = QHBoxLayout()
+        self.sweep_mode_cb = QComboBox()
+        self.sweep_mode_cb.addItems(["Monte-Carlo", "Grid"])
+        self.sweep_count_sb = QSpinBox()
+        self.sweep_count_sb.setRange(1, 100000)
+        self.sweep_count_sb.setValue(500)
+        self.sweep_count_sb.setToolTip("number of Monte-Carlo draws, or grid steps per parameter")
+        self.sweep_breakpoint_sb = QDoubleSpinBox()
+        self.sweep_breakpoint_sb.setRange(0, 50)
+        self.sweep_breakpoint_sb.setValue(2)
+        self.sweep_breakpoint_sb.setSuffix(" % breakpoint")
+        self.sweep_offset_sb = QDoubleSpinBox()
+        self.sweep_offset_sb.setDecimals(3)
+        self.sweep_offset_sb.setRange(0, 1)
+        self.sweep_offset_sb.setSingleStep(0.005)
+        self.sweep_offset_sb.setValue(0.01)
+        self.sweep_offset_sb.setSuffix(" offset")
+        self.sweep_multiplier_sb = QDoubleSpinBox()
+        self.sweep_multiplier_sb.setRange(0, 50)
+        self.sweep_multiplier_sb.setValue(1)
+        self.sweep_multiplier_sb.setSuffix(" % multiplier")
+        self.sweep_btn = QPushButton("Run sweep")
+        self.sweep_btn.setFixedWidth(80)
+        self.sweep_btn.clicked.connect(self.run_sweep)
+        self.save_sweep_btn = QPushButton("Save sweep")
+        self.save_sweep_btn.setFixedWidth(80)
+        self.save_sweep_btn.setEnabled(False)
+        self.save_sweep_btn.clicked.connect(self.save_sweep)
+        self.clear_sweep_btn = QPushButton("Clear sweep")
+        self.clear_sweep_btn.setFixedWidth(80)
+        self.clear_sweep_btn.clicked.connect(self.clear_sweep)
+        self.sweep_lb = QLabel("")
+        sweep_hbox.addWidget(QLabel("Sweep"))
+        sweep_hbox.addWidget(self.sweep_mode_cb)
+        sweep_hbox.addWidget(self.sweep_count_sb)
+        sweep_hbox.addWidget(self.sweep_breakpoint_sb)
+        sweep_hbox.addWidget(self.sweep_offset_sb)
+        sweep_hbox.addWidget(self.sweep_multiplier_sb)
+        sweep_hbox.addWidget(self.sweep_btn)
+        sweep_hbox.addWidget(self.save_sweep_btn)
+        sweep_hbox.addWidget(self.clear_sweep_btn)
+        sweep_hbox.addWidget(self.sweep_lb, 1)
+        main_grid.addLayout(sweep_hbox, 5, 0, 1, 5)
+
+        extrapolation_hbox = QHBoxLayout()
+        self.low_end_cb = QComboBox()
+        self.low_end_cb.addItems(["no low end", "constant", "Hagen-Rubens"])
+        self.low_limit_sb = QDoubleSpinBox()
+        self.low_limit_sb.setRange(0.01, 10000)
+        self.low_limit_sb.setValue(1)
+        self.low_limit_sb.setPrefix("from ")
+        self.low_limit_sb.setSuffix(" cm-1")
+        self.high_end_cb = QComboBox()
+        self.high_end_cb.addItems(["no high end", "power law"])
+        self.high_power_sb = QDoubleSpinBox()
+        self.high_power_sb.setRange(0, 4)
+        self.high_power_sb.setSingleStep(0.5)
+        self.high_power_sb.setValue(2)
+        self.high_power_sb.setPrefix("w^-")
+        self.free_electron_sb = QDoubleSpinBox()
+        self.free_electron_sb.setDecimals(0)
+        self.free_electron_sb.setRange(1000, 10000000)
+        self.free_electron_sb.setValue(200000)
+        self.free_electron_sb.setPrefix("w^-4 from ")
+        self.free_electron_sb.setSuffix(" cm-1")
+        self.high_limit_sb = QDoubleSpinBox()
+        self.high_limit_sb.setDecimals(0)
+        self.high_limit_sb.setRange(1000, 100000000)
+        self.high_limit_sb.setValue(1000000)
+        self.high_limit_sb.setPrefix("to ")
+        self.high_limit_sb.setSuffix(" cm-1")
+        self.extrapolation_points_sb = QSpinBox()
+        self.extrapolation_points_sb.setRange(10, 100000)
+        self.extrapolation_points_sb.setValue(200)
+        self.extrapolation_points_sb.setSuffix(" points")
+        self.extrapolation_fit_sb = QSpinBox()
+        self.extrapolation_fit_sb.setRange(1, 1000)
+        self.extrapolation_fit_sb.setValue(10)
+        self.extrapolation_fit_sb.setPrefix("fit ")
+        self.preview_extrapolation_cb = QCheckBox("Preview")
+        self.preview_extrapolation_cb.stateChanged.connect(self.preview_extrapolation)
+        self.export_extrapolation_cb = QCheckBox("Extrapolate on export")
+        for widget in [self.low_end_cb, self.high_end_cb]:
+            widget.currentIndexChanged.connect(lambda: self.draw())
+        for widget in [self.low_limit_sb, self.high_power_sb, self.free_electron_sb, self.high_limit_sb, self.extrapolation_points_sb, self.extrapolation_fit_sb]:
+            widget.valueChanged.connect(lambda: self.draw())
+        extrapolation_hbox.addWidget(QLabel("Extrapolate"))
+        extrapolation_hbox.addWidget(self.low_end_cb)
+        extrapolation_hbox.addWidget(self.low_limit_sb)
+        extrapolation_hbox.addWidget(self.high_end_cb)
+        extrapolation_hbox.addWidget(self.high_power_sb)
+        extrapolation_hbox.addWidget(self.free_electron_sb)
+        extrapolation_hbox.addWidget(self.high_limit_sb)
+        extrapolation_hbox.addWidget(self.extrapolation_points_sb)
+        extrapolation_hbox.addWidget(self.extrapolation_fit_sb)
+        extrapolation_hbox.addWidget(self.preview_extrapolation_cb)
+        extrapolation_hbox.addWidget(self.export_extrapolation_cb)
+        extrapolation_hbox.addStretch(1)
+        main_grid.addLayout(extrapolation_hbox, 6, 0, 1, 5)
+
+        filter_hbox = QHBoxLayout()
+        self.filter_band_cb = QComboBox()
+        self.filter_band_cb.addItems(self.band_names)
+        self.filter_band_cb.currentIndexChanged.connect(self.show_band_filter)
+        self.filter_method_cb = QComboBox()
+        self.filter_method_cb.addItems(["no filter", "Savitzky-Golay", "FFT low-pass", "median despike"])
+        self.filter_window_sb = QSpinBox()
+        self.filter_window_sb.setRange(3, 100001)
+        self.filter_window_sb.setSingleStep(2)
+        self.filter_window_sb.setValue(11)
+        self.filter_window_sb.setPrefix("window ")
+        self.filter_param_sb = QDoubleSpinBox()
+        self.filter_param_sb.setDecimals(3)
+        self.filter_param_sb.setRange(0.001, 100)
+        self.filter_param_sb.setValue(3)
+        self.filter_compare_cb = QCheckBox("Show unfiltered")
+        self.filter_compare_cb.stateChanged.connect(lambda: self.draw_unfiltered())
+        self.filter_method_cb.currentIndexChanged.connect(lambda: self.set_band_filter())
+        self.filter_window_sb.valueChanged.connect(lambda: self.set_band_filter())
+        self.filter_param_sb.valueChanged.connect(lambda: self.set_band_filter())
+        filter_hbox.addWidget(QLabel("Filter"))
+        filter_hbox.addWidget(self.filter_band_cb)
+        filter_hbox.addWidget(self.filter_method_cb)
+        filter_hbox.addWidget(self.filter_window_sb)
+        filter_hbox.addWidget(self.filter_param_sb)
+        filter_hbox.addWidget(self.filter_compare_cb)
+        self.overlap_cb = QCheckBox("Overlap diagnostics")
+        self.overlap_cb.stateChanged.connect(lambda: self.draw())
+        self.overlap_mode_cb = QComboBox()
+        self.overlap_mode_cb.addItems(["ratio", "difference"])
+        self.overlap_mode_cb.currentIndexChanged.connect(lambda: self.draw())
+        self.overlap_lb = QLabel("")
+        filter_hbox.addSpacing(20)
+        filter_hbox.addWidget(self.overlap_cb)
+        filter_hbox.addWidget(self.overlap_mode_cb)
+        filter_hbox.addWidget(self.overlap_lb)
+        filter_hbox.addStretch(1)
+        main_grid.addLayout(filter_hbox, 7, 0, 1, 5)
+
+        fit_hbox = QHBoxLayout()
+        self.fit_oscillators_sb = QSpinBox()
+        self.fit_oscillators_sb.setRange(1, 30)
+        self.fit_oscillators_sb.setValue(4)
+        self.fit_oscillators_sb.setSuffix(" oscillators")
+        self.fit_points_sb = QSpinBox()
+        self.fit_points_sb.setRange(50, 100000)
+        self.fit_points_sb.setValue(1000)
+        self.fit_points_sb.setSuffix(" points")
+        self.fit_points_sb.setToolTip("the fit uses up to this many frequencies spread on a log scale")
+        self.fit_kk_cb = QCheckBox("Fit KK epsilon")
+        self.fit_kk_cb.setToolTip("fit the Kramers-Kronig epsilon, with the ends continued as set in the extrapolation row")
+        self.fit_btn = QPushButton("Fit merged")
+        self.fit_btn.setFixedWidth(80)
+        self.fit_btn.clicked.connect(self.fit_merged)
+        self.fit_series_btn = QPushButton("Fit series")
+        self.fit_series_btn.setFixedWidth(80)
+        self.fit_series_btn.setEnabled(False)
+        self.fit_series_btn.clicked.connect(self.fit_series)
+        self.clear_fit_btn = QPushButton("Clear fit")
+        self.clear_fit_btn.setFixedWidth(80)
+        self.clear_fit_btn.clicked.connect(self.clear_fit)
+        self.fit_lb = QLabel("")
+        fit_hbox.addWidget(QLabel("Drude-Lorentz"))
+        fit_hbox.addWidget(self.fit_oscillators_sb)
+        fit_hbox.addWidget(self.fit_points_sb)
+        fit_hbox.addWidget(self.fit_kk_cb)
+        fit_hbox.addWidget(self.fit_btn)
+        fit_hbox.addWidget(self.fit_series_btn)
+        fit_hbox.addWidget(self.clear_fit_btn)
+        fit_hbox.addWidget(self.fit_lb)
+        fit_hbox.addStretch(1)
+        main_grid.addLayout(fit_hbox, 8, 0, 1, 5)
+
+        single_beam_hbox = QHBoxLayout()
+        self.single_beam_cb = QCheckBox("Ratio single beams")
+        self.single_beam_cb.setToolTip("loaded files are sample single beams divided by the reference single beam of their band")
+        self.single_beam_band_cb = QComboBox()
+        self.single_beam_band_cb.addItems(self.band_names)
+        self.single_beam_ref_btn = QPushButton("Set reference")
+        self.single_beam_ref_btn.setFixedWidth(90)
+        self.single_beam_ref_btn.clicked.connect(lambda: self.set_single_beam_reference())
+        self.single_beam_clear_btn = QPushButton("Clear")
+        self.single_beam_clear_btn.setFixedWidth(60)
+        self.single_beam_clear_btn.clicked.connect(lambda: self.set_single_beam_reference(""))
+        self.single_beam_average_cb = QCheckBox("Average scans")
+        self.single_beam_average_cb.setChecked(True)
+        self.single_beam_average_cb.setToolTip("repeated scans in further columns are averaged, otherwise the first scan is used")
+        self.single_beam_lb = QLabel("")
+        single_beam_hbox.addWidget(self.single_beam_cb)
+        single_beam_hbox.addWidget(self.single_beam_band_cb)
+        single_beam_hbox.addWidget(self.single_beam_ref_btn)
+        single_beam_hbox.addWidget(self.single_beam_clear_btn)
+        single_beam_hbox.addWidget(self.single_beam_average_cb)
+        single_beam_hbox.addWidget(self.single_beam_lb)
+        single_beam_hbox.addStretch(1)
+        main_grid.addLayout(single_beam_hbox, 9, 0, 1, 5)
+
+        interferogram_hbox = QHBoxLayout()
+        self.interferogram_apodization_cb = QComboBox()
+        self.interferogram_apodization_cb.addItems(APODIZATIONS)
+        self.interferogram_apodization_cb.setCurrentText("Blackman-Harris 3-term")
+        self.interferogram_zero_fill_cb = QComboBox()
+        self.interferogram_zero_fill_cb.addItems(["zero fill 1", "zero fill 2", "zero fill 4", "zero fill 8"])
+        self.interferogram_zero_fill_cb.setCurrentIndex(1)
+        self.interferogram_phase_sb = QSpinBox()
+        self.interferogram_phase_sb.setRange(0, 65536)
+        self.interferogram_phase_sb.setValue(256)
+        self.interferogram_phase_sb.setPrefix("phase points ")
+        self.interferogram_phase_sb.setToolTip("points before the centre burst used for the Mertz phase correction, 0 for a power spectrum")
+        self.interferogram_laser_sb = QDoubleSpinBox()
+        self.interferogram_laser_sb.setRange(1, 100000)
+        self.interferogram_laser_sb.setValue(15798.0)
+        self.interferogram_laser_sb.setPrefix("laser ")
+        self.interferogram_laser_sb.setToolTip("laser wavenumber for files that do not state it")
+        self.interferogram_band_cb = QComboBox()
+        self.interferogram_band_cb.addItems(self.band_names)
+        self.interferogram_btn = QPushButton("Co-add scans")
+        self.interferogram_btn.setFixedWidth(90)
+        self.interferogram_btn.clicked.connect(lambda: self.load_interferograms())
+        self.interferogram_lb = QLabel("")
+        interferogram_hbox.addWidget(QLabel("Interferograms"))
+        interferogram_hbox.addWidget(self.interferogram_apodization_cb)
+        interferogram_hbox.addWidget(self.interferogram_zero_fill_cb)
+        interferogram_hbox.addWidget(self.interferogram_phase_sb)
+        interferogram_hbox.addWidget(self.interferogram_laser_sb)
+        interferogram_hbox.addWidget(self.interferogram_band_cb)
+        interferogram_hbox.addWidget(self.interferogram_btn)
+        interferogram_hbox.addWidget(self.interferogram_lb)
+        interferogram_hbox.addStretch(1)
+        main_grid.addLayout(interferogram_hbox, 10, 0, 1, 5)
+
+        # a slider drag is recorded as a single history entry when the slider is released
+        for sld in self.history_sliders():
+            sld.sliderReleased.connect(self.commit_state)
+            sld.sliderReleased.connect(self.refit_gap_fills)
+        self.last_state = self.get_merge_state()
+
         self.initialize_graph()
 
     def loadpickle(self, fname):
@@ -1031,6 +1578,7 @@ class Spectrum(QFrame):
                 self.merge_graph(id, self.breakPoint4_sld.value(), self.breakPoint3_sb.value(), None)
                 self.scale_graph(3, self.NIR_offset_sb.value(), self.NIR_multiplier_sb.value())
                 self.scale_graph(4, self.VIS_offset_sb.value(), self.VIS_multiplier_sb.value())
+        self.commit_state()
 
     def setSbPos(self, id, type):
         if type == "offset":
@@ -1108,6 +1656,7 @@ class Spectrum(QFrame):
                 self.merge_graph(id, self.breakPoint4_sb.value(), self.breakPoint3_sb.value(), None)
                 self.scale_graph(3, self.NIR_offset_sb.value(), self.NIR_multiplier_sb.value())
                 self.scale_graph(4, self.VIS_offset_sb.value(), self.VIS_multiplier_sb.value())
+        self.commit_state()
 
     def reset(self, code):
         if code == 0:
@@ -1150,29 +1699,166 @@ class Spectrum(QFrame):
             self.VIS_multiplier_sb.setValue(1)
             self.multiplier[4] = 1
             self.scale_graph(4, self.VIS_offset_sb.value(), self.VIS_multiplier_sb.value())
+        self.commit_state()
 
-    def read_refFIT_data(self, path):
-        try:
-            file = np.loadtxt(path).transpose()
-            freq = file[0]
-            reflectance = file[1]
-        except:
+    def history_sliders(self):
+        sliders = [getattr(self, "breakPoint{}_sld".format(i+1)) for i in range(4)]
+        for name in self.band_names:
+            sliders.append(getattr(self, "{}_offset_sld".format(name)))
+            sliders.append(getattr(self, "{}_multiplier_sld".format(name)))
+        return sliders
+
+    def get_merge_state(self):
+        breakpoints = tuple(getattr(self, "breakPoint{}_sb".format(i+1)).value() for i in range(4))
+        # rounded to the spin box precision so that slider quantization does not create spurious entries
+        return (breakpoints, tuple(round(float(v), 4) for v in self.offset), tuple(round(float(v), 4) for v in self.multiplier))
+
+    def commit_state(self):
+        if self.holding_history or any(sld.isSliderDown() for sld in self.history_sliders()):
+            return
+        state = self.get_merge_state()
+        if state != self.last_state:
+            self.undo_stack.append(self.last_state)
+            del self.undo_stack[:-self.max_history]
+            self.redo_stack = []
+            self.last_state = state
+        self.update_history_btns()
+
+    def clear_history(self):
+        self.undo_stack = []
+        self.redo_stack = []
+        self.last_state = self.get_merge_state()
+        self.update_history_btns()
+
+    def update_history_btns(self):
+        self.undo_btn.setEnabled(len(self.undo_stack) > 0)
+        self.redo_btn.setEnabled(len(self.redo_stack) > 0)
+
+    def undo(self):
+        if len(self.undo_stack) > 0:
+            self.redo_stack.append(self.last_state)
+            self.restore_state(self.undo_stack.pop())
+            self.update_history_btns()
+
+    def redo(self):
+        if len(self.redo_stack) > 0:
+            self.undo_stack.append(self.last_state)
+            self.restore_state(self.redo_stack.pop())
+            self.update_history_btns()
+
+    def restore_state(self, state):
+        # only re-merge the breakpoints and re-scale the bands that differ from the current state
+        breakpoints, offset, multiplier = state
+        old_breakpoints, old_offset, old_multiplier = self.get_merge_state()
+        self.holding_history = True
+        for i in range(4):
+            sb = getattr(self, "breakPoint{}_sb".format(i+1))
+            sld = getattr(self, "breakPoint{}_sld".format(i+1))
+            sb.blockSignals(True)
+            sld.blockSignals(True)
+            sb.setValue(breakpoints[i])
+            sld.setValue(breakpoints[i])
+            sb.blockSignals(False)
+            sld.blockSignals(False)
+        for i, name in enumerate(self.band_names):
+            for type, value in (("offset", offset[i]), ("multiplier", multiplier[i])):
+                sb = getattr(self, "{}_{}_sb".format(name, type))
+                sld = getattr(self, "{}_{}_sld".format(name, type))
+                sb.blockSignals(True)
+                sld.blockSignals(True)
+                sb.setValue(value)
+                sld.setValue(value)
+                sb.blockSignals(False)
+                sld.blockSignals(False)
+        self.offset = np.array(offset)
+        self.multiplier = np.array(multiplier)
+        rescale = set()
+        for i in range(4):
+            if breakpoints[i] != old_breakpoints[i] and self.break_line[i] is not None:
+                left = breakpoints[i-1] if i > 0 else None
+                right = breakpoints[i+1] if i < 3 else None
+                self.merge_graph(str(i+1), breakpoints[i], left, right)
+                rescale.update([i, i+1])
+        for i in range(5):
+            if offset[i] != old_offset[i] or multiplier[i] != old_multiplier[i]:
+                rescale.add(i)
+        for i in sorted(rescale):
+            self.scale_graph(i, self.offset[i], self.multiplier[i])
+        self.holding_history = False
+        self.last_state = self.get_merge_state()
+
+    def read_refFIT_data(self, path, code=None):
+        # in single beam mode the file is a sample single beam, divided by the reference of its band (classified
+        # from the file when code is None); returns None when that band has no reference
+        if not self.single_beam_cb.isChecked():
+            return read_refFIT_data(path, self.interferogram_settings())
+        data = read_single_beam(path, self.single_beam_average_cb.isChecked(), self.interferogram_settings())
+        if data is None:
+            return None
+        freq, beam = data
+        if code is None:
+            code = self.classify_band(os.path.basename(path), freq)[0]
+        if self.single_beam_references[code] is None:
+            return None
+        return ratio_single_beam(freq, beam, self.single_beams.on_grid(self.single_beam_references[code], freq, self.interferogram_settings()))
+
+    def set_single_beam_reference(self, path=None):
+        code = self.single_beam_band_cb.currentIndex()
+        if path is None:
+            path = QFileDialog.getOpenFileName(self, "Select the reference single beam", r"~\PycharmProjects/Transfer Matrix Method", SPECTRUM_FILE_FILTER)[0]
+            if path == "":
+                return
             try:
-                file = np.loadtxt(path, delimiter=",").transpose()
-                freq = file[0]
-                reflectance = file[1]
-            except:
-                try:
-                    file = np.loadtxt(path, delimiter=" ").transpose()
-                    freq = file[0]
-                    reflectance = file[1]
-                except:
-                    return
-        return np.array(reflectance), np.array(freq)
+                self.single_beams.load(path, self.interferogram_settings())
+            except ValueError as e:
+                QMessageBox.warning(self, "Single beam reference", str(e))
+                return
+        self.single_beam_references[code] = None if path == "" else path
+        self.single_beam_lb.setText(", ".join("{} {}".format(self.band_names[i], os.path.basename(ref)) for i, ref in enumerate(self.single_beam_references) if ref is not None))
+
+    def interferogram_settings(self):
+        # transform_interferograms settings of the interferogram row; the laser applies to files that do not state it
+        return {"apodization_name": self.interferogram_apodization_cb.currentText(),
+                "zero_fill": 2 ** self.interferogram_zero_fill_cb.currentIndex(),
+                "phase_points": self.interferogram_phase_sb.value(),
+                "laser": self.interferogram_laser_sb.value()}
+
+    def load_interferograms(self):
+        # co-adds the scans of the selected interferogram files into one sample single beam and loads its ratio to
+        # the single beam reference of the band, or to the co-added reference interferograms stored in OPUS files
+        code = self.interferogram_band_cb.currentIndex()
+        paths = QFileDialog.getOpenFileNames(self, "Select interferograms", r"~\PycharmProjects/Transfer Matrix Method",
+                                             "Interferograms (*.0 *.1 *.2 *.3 *.4 *.5 *.6 *.7 *.8 *.9 *.npy *.txt *.csv *.dat) ;; All Files (*)")[0]
+        if len(paths) == 0:
+            return
+        start = time.perf_counter()
+        settings = self.interferogram_settings()
+        try:
+            data = [read_interferograms(path) for path in paths]
+            if len(set(scans.shape[1] for scans, laser in data)) > 1:
+                raise ValueError("The interferograms have different lengths")
+            if data[0][1] is not None:
+                settings["laser"] = data[0][1]
+            freq, sample = transform_interferograms(np.concatenate([scans for scans, laser in data]), **settings)
+            if self.single_beam_references[code] is not None:
+                reference = self.single_beams.on_grid(self.single_beam_references[code], freq, self.interferogram_settings())
+            else:
+                reference = transform_interferograms(np.concatenate([read_interferograms(path, "Rf")[0] for path in paths]), **settings)[1]
+        except (ValueError, KeyError, OSError, struct.error) as e:
+            message = str(e) if isinstance(e, ValueError) else "Set a single beam reference for {} or select OPUS files with reference interferograms".format(self.band_names[code])
+            QMessageBox.warning(self, "Co-add interferograms", message)
+            return
+        reflectance, freq = ratio_single_beam(freq, sample, reference)
+        scans = sum(len(scans) for scans, laser in data)
+        self.update_band(code, "{} ({} scans)".format(os.path.basename(paths[0]), scans), reflectance, freq)
+        self.interferogram_lb.setText("{} scans of {} co-added in {:.2f} s".format(scans, self.band_names[code], time.perf_counter() - start))
+
+    def is_single_beam_reference(self, path):
+        return self.single_beam_cb.isChecked() and any(ref is not None and os.path.abspath(ref) == os.path.abspath(path) for ref in self.single_beam_references)
 
     def load_reflectance(self, code):
         try:
-            path = QFileDialog.getOpenFileName(self, "Select a file", r"~\PycharmProjects/Transfer Matrix Method", "Text Files (*.txt *.csv *.dat)")[0]
+            path = QFileDialog.getOpenFileName(self, "Select a file", r"~\PycharmProjects/Transfer Matrix Method", SPECTRUM_FILE_FILTER)[0]
             filename = os.path.basename(path)
             if path == "":
                 if code == 0:
@@ -1197,6 +1883,11 @@ class Spectrum(QFrame):
                 self.freq[code] = []
                 self.range[code] = []
             else:
+                data = self.read_refFIT_data(path, code)
+                if data is None and self.single_beam_cb.isChecked() and self.single_beam_references[code] is None:
+                    QMessageBox.warning(self, "Load reflectance", "Please set a single beam reference for {} first!".format(self.band_names[code]))
+                    return
+                reflectance, freq = data
                 if code == 0:
                     self.EEIR_R_lb.setText(u'\u2705')
                     self.EEIR_path_lb.setText(filename)
@@ -1214,16 +1905,220 @@ class Spectrum(QFrame):
                 elif code == 4:
                     self.VIS_R_lb.setText(u'\u2705')
                     self.VIS_path_lb.setText(filename)
-                reflectance, freq = self.read_refFIT_data(path)
-                self.reflectance[code] = reflectance
+                self.reflectance[code] = self.filtered(code, reflectance)
                 self.freq[code] = freq
             self.renew_graph()
             self.reset(code)
+            self.clear_history()
         except:
             QMessageBox.warning(self, "Load reflectance", "You are not selecting a correct file!")
             return
 
+    def classify_band(self, filename, freq):
+        # the band whose typical centre is closest on a log scale, and the band named in the file name (or None)
+        center = np.sqrt(max(np.min(freq), 1) * np.max(freq))
+        span_code = int(np.argmin([abs(np.log(center / c)) for c in self.band_centers]))
+        name_code = None
+        for code, pattern in enumerate(self.band_patterns):
+            if re.search(r"(?<![a-z])({})(?![a-z])".format(pattern), filename.lower()):
+                name_code = code
+                break
+        return span_code, name_code
+
+    def read_band_folder(self, folderpath):
+        # returns (filename, (reflectance, freq)) or None for each band, and the files that could not be placed
+        files = [f for f in sorted(os.listdir(folderpath)) if is_spectrum_file(f) and not self.is_single_beam_reference(os.path.join(folderpath, f))]
+        with ThreadPoolExecutor(max_workers=max(1, min(8, len(files)))) as pool:
+            data = list(pool.map(lambda f: self.read_refFIT_data(os.path.join(folderpath, f)), files))
+        candidates = [[] for _ in range(5)]
+        for f, item in zip(files, data):
+            if item is not None and len(item[1]) > 1:
+                span_code, name_code = self.classify_band(f, item[1])
+                candidates[span_code].append((f, item, name_code))
+        # frequency span decides, the file name settles files that land in the same band
+        assigned = [None] * 5
+        skipped = []
+        for code in range(5):
+            for f, item, name_code in candidates[code]:
+                if assigned[code] is None and (len(candidates[code]) == 1 or name_code == code):
+                    assigned[code] = (f, item)
+                elif name_code is not None and len(candidates[name_code]) == 0 and assigned[name_code] is None:
+                    assigned[name_code] = (f, item)
+                else:
+                    skipped.append(f)
+        return assigned, skipped
+
+    def load_reflectance_folder(self):
+        folderpath = QFileDialog.getExistingDirectory(self, 'Select Folder')
+        if folderpath != "":
+            assigned, skipped = self.read_band_folder(folderpath)
+            if all(a is None for a in assigned):
+                QMessageBox.warning(self, "Load data folder", "Cannot read files in the selected folder!")
+                return
+            self.set_bands(assigned)
+            if len(skipped) > 0:
+                QMessageBox.warning(self, "Load data folder", "Could not assign a band to:\n" + "\n".join(skipped))
+
+    def set_bands(self, assigned):
+        # replace every band at once, assigned holds (filename, (reflectance, freq)) or None per band
+        with self.batch_update():
+            for code, name in enumerate(self.band_names):
+                self.is_auto_fill[code] = []
+                self.range[code] = []
+                if code in [1, 2, 3]:
+                    getattr(self, "{}_autoFill_cb".format(name)).setChecked(False)
+                if assigned[code] is not None:
+                    filename, (reflectance, freq) = assigned[code]
+                    self.reflectance[code] = self.filtered(code, reflectance)
+                    self.freq[code] = freq
+                    getattr(self, "{}_R_lb".format(name)).setText(u'\u2705')
+                    getattr(self, "{}_path_lb".format(name)).setText(filename)
+                else:
+                    self.reflectance[code] = []
+                    self.freq[code] = []
+                    getattr(self, "{}_R_lb".format(name)).setText(u'\u274c')
+                    getattr(self, "{}_path_lb".format(name)).setText("")
+                self.reset(code)
+            self.NIR_autoFill_cb.setEnabled(len(self.freq[3]) == 0)
+            self.renew_graph()
+        self.clear_history()
+
+    def toggle_watch(self):
+        if self.watcher is None:
+            folderpath = QFileDialog.getExistingDirectory(self, 'Select a folder to watch')
+            if folderpath == "":
+                return
+            self.watch_folder = folderpath
+            self.watch_stamps = {}
+            self.watcher = QFileSystemWatcher([folderpath], self)
+            self.watcher.directoryChanged.connect(lambda: self.watch_timer.start())
+            self.watcher.fileChanged.connect(lambda: self.watch_timer.start())
+            self.watch_btn.setText("Stop watching")
+            self.scan_watch_folder()
+        else:
+            self.watch_timer.stop()
+            self.watcher.deleteLater()
+            self.watcher = None
+            self.watch_btn.setText("Watch folder")
+
+    def scan_watch_folder(self):
+        # only files whose modification time or size changed are parsed again
+        if self.watcher is None or not os.path.isdir(self.watch_folder):
+            return
+        files = [f for f in sorted(os.listdir(self.watch_folder)) if is_spectrum_file(f) and not self.is_single_beam_reference(os.path.join(self.watch_folder, f))]
+        changed = []
+        for f in files:
+            path = os.path.join(self.watch_folder, f)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # removed or renamed since the listing, e.g. a temporary file swapped in by the spectrometer
+                continue
+            stamp = (stat.st_mtime, stat.st_size)
+            if self.watch_stamps.get(path) != stamp:
+                if time.time() - stat.st_mtime < 1:
+                    # the spectrometer may still be writing, look again shortly
+                    self.watch_timer.start()
+                    continue
+                changed.append((f, path, stamp))
+        if len(changed) == 0:
+            return
+        new_paths = [path for f, path, stamp in changed if path not in self.watcher.files()]
+        if len(new_paths) > 0:
+            self.watcher.addPaths(new_paths)
+        with ThreadPoolExecutor(max_workers=max(1, min(8, len(changed)))) as pool:
+            data = list(pool.map(lambda item: self.read_refFIT_data(item[1]), changed))
+        # when several changed files fall in one band (e.g. on the first scan) the newest one is loaded
+        newest = {}
+        for (f, path, stamp), item in zip(changed, data):
+            self.watch_stamps[path] = stamp
+            if item is not None and len(item[1]) > 1:
+                code = self.classify_band(f, item[1])[0]
+                if code not in newest or stamp[0] >= newest[code][0][0]:
+                    newest[code] = (stamp, f, item)
+        updated = len(newest) > 0
+        for code, (stamp, f, item) in sorted(newest.items()):
+            self.update_band(code, f, item[0], item[1])
+        if updated and self.watch_export_cb.isChecked():
+            os.makedirs(os.path.join(self.watch_folder, "merged"), exist_ok=True)
+            self.write_mergedSpec(os.path.join(self.watch_folder, "merged", "merged_spectrum.txt"))
+
+    def update_band(self, code, filename, reflectance, freq):
+        # replace the data of one band while keeping the breakpoints, offsets and multipliers
+        name = self.band_names[code]
+        getattr(self, "{}_R_lb".format(name)).setText(u'\u2705')
+        getattr(self, "{}_path_lb".format(name)).setText(filename)
+        if len(self.freq[code]) == 0 or len(self.is_auto_fill[code]) > 0:
+            # a new band changes which breakpoints exist, so the graph is renewed as in load_reflectance; the
+            # breakpoints that existed before keep their values, only new ones start in the middle of their overlap
+            breakpoints = self.get_merge_state()[0]
+            kept = [i for i in range(4) if self.break_line[i] is not None]
+            with self.batch_update():
+                if code in [1, 2, 3]:
+                    getattr(self, "{}_autoFill_cb".format(name)).setChecked(False)
+                self.is_auto_fill[code] = []
+                self.reflectance[code] = self.filtered(code, reflectance)
+                self.freq[code] = freq
+                self.NIR_autoFill_cb.setEnabled(len(self.freq[3]) == 0)
+                self.renew_graph()
+                for i in kept:
+                    if self.break_line[i] is not None:
+                        getattr(self, "breakPoint{}_sb".format(i+1)).setValue(breakpoints[i])
+                        getattr(self, "breakPoint{}_sld".format(i+1)).setValue(breakpoints[i])
+            self.clear_history()
+            return
+        self.holding_draw = True
+        try:
+            self.reflectance[code] = self.filtered(code, reflectance)
+            self.freq[code] = freq
+            if code == 4:
+                self.remove_HeNe()
+            breakpoints = self.get_merge_state()[0]
+            merged = False
+            for i in [code-1, code]:
+                if 0 <= i < 4 and len(self.reflectance[i]) > 0 and len(self.reflectance[i+1]) > 0:
+                    self.merge_graph(str(i+1), breakpoints[i], breakpoints[i-1] if i > 0 else None, breakpoints[i+1] if i < 3 else None)
+                    merged = True
+            if not merged:
+                self.range[code] = [self.index_range(self.freq[code] >= 0)]
+            for i in range(max(code-1, 0), min(code+2, 5)):
+                self.scale_graph(i, self.offset[i], self.multiplier[i])
+        finally:
+            self.holding_draw = False
+        self.F.draw()
+
+    def gap_fit_source(self, code):
+        return (self.reflectance[code-1], self.range[code-1], self.offset[code-1], self.multiplier[code-1],
+                self.reflectance[code+1], self.range[code+1], self.offset[code+1], self.multiplier[code+1])
+
+    def gap_fit_stale(self, code):
+        fit = self.gap_fits[code]
+        return fit is None or any(a is not b if isinstance(a, (list, np.ndarray)) else a != b for a, b in zip(fit[0], self.gap_fit_source(code)))
+
+    def refit_gap_fills(self):
+        # Drude-Lorentz gap fills left on their cached fit during a slider drag are refitted once on release
+        stale = [code for code in range(1, 4) if len(self.is_auto_fill[code]) > 0 and self.auto_fill_order[code-1] == 3 and self.gap_fit_stale(code)]
+        for code in stale:
+            self.remake_auto_fill_data(code)
+            if self.R_curve[code] is not None:
+                self.R_curve[code].set_data(*self.display_curve(code, self.offset[code], self.multiplier[code]))
+        if len(stale) > 0:
+            self.draw()
+
     def remake_auto_fill_data(self, code):
+        if self.auto_fill_order[code-1] == 3:
+            # the gap is evaluated from a Drude-Lorentz fit to the cut and scaled neighbours, refitted when they change;
+            # while a slider is dragged the cached fit is evaluated and refit_gap_fills refits on release
+            fit = self.gap_fits[code]
+            if fit is None or (self.gap_fit_stale(code) and not any(sld.isSliderDown() for sld in self.history_sliders())):
+                left = self.band_edge(code-1, slice(None), reference=False)
+                right = self.band_edge(code+1, slice(None), reference=False)
+                fit = (self.gap_fit_source(code), gap_fill_params(left[0], left[1], right[0], right[1]))
+                self.gap_fits[code] = fit
+            freq = np.arange(self.is_auto_fill[code][0][0][-1], self.is_auto_fill[code][0][1][0], self.freq[code-1][-1]-self.freq[code-1][-2])
+            self.freq[code] = freq
+            self.reflectance[code] = self.store(drude_lorentz_reflectance(freq, fit[1]))
+            return
         if self.auto_fill_order[code-1] == 1:
             kind = "quadratic"
         elif self.auto_fill_order[code-1] == 2:
@@ -1235,7 +2130,7 @@ class Spectrum(QFrame):
         # freq = np.arange(self.is_auto_fill[code][0][0], self.is_auto_fill[code][0][1], self.freq[code-1][-1]-self.freq[code-1][-2])
         freq = np.arange(self.is_auto_fill[code][0][0][-1], self.is_auto_fill[code][0][1][0], self.freq[code-1][-1]-self.freq[code-1][-2])
         self.freq[code] = freq
-        self.reflectance[code] = f(freq)
+        self.reflectance[code] = self.store(f(freq))
 
     def auto_fill(self, code, auto, order):
         self.auto_fill_order[code-1] = order
@@ -1275,6 +2170,7 @@ class Spectrum(QFrame):
         self.merge_graph("3", self.breakPoint3_sb.value(), self.breakPoint2_sb.value(), self.breakPoint4_sb.value())
         self.merge_graph("4", self.breakPoint4_sb.value(), self.breakPoint3_sb.value(), None)
         self.reset(code)
+        self.clear_history()
 
     def remove_HeNe(self):
         if self.VIS_removeHeNe_cb.isChecked() and len(self.reflectance[4]) > 0:
@@ -1283,11 +2179,148 @@ class Spectrum(QFrame):
                 if 15785 <= self.freq[4][i] <= 15815:
                     index.append(i)
             func = interp1d([self.freq[4][int(min(index)-1)], self.freq[4][(max(index)+1)]], [self.reflectance[4][int(min(index)-1)], self.reflectance[4][(max(index)+1)]])
+            # a new array, the band may be the measured one kept for the filters
+            reflectance = np.array(self.reflectance[4])
             for i in index:
-                self.reflectance[4][i] = func(self.freq[4][i])
+                reflectance[i] = func(self.freq[4][i])
+            self.reflectance[4] = reflectance
+            self.band_version[4] += 1
+            self.display[4] = None
+            self.overlap_cache[3] = None
             self.scale_graph(4, self.VIS_offset_sb.value(), self.VIS_multiplier_sb.value())
+            self.draw()
+
+    def draw(self):
+        if not self.holding_draw:
+            if self.preview_extrapolation_cb.isChecked():
+                self.update_extrapolation()
+            self.update_overlaps()
             self.F.draw()
 
+    def store(self, reflectance, code=None):
+        # no copy when the array already has the storage precision, e.g. a memory-mapped session;
+        # with a code the array becomes the data of that band
+        if code is not None:
+            self.band_version[code] += 1
+        return np.asarray(reflectance, dtype=self.storage_dtype)
+
+    def set_storage_dtype(self, index):
+        self.storage_dtype = np.float32 if index == 1 else np.float64
+        with self.batch_update():
+            for code in range(5):
+                if len(self.reflectance[code]) > 0 and len(self.is_auto_fill[code]) == 0:
+                    self.reflectance[code] = self.filtered(code, self.reflectance[code] if self.unfiltered[code] is None else self.unfiltered[code])
+            # the visible band is rebuilt from its measured data, so the HeNe line is taken out again
+            self.remove_HeNe()
+            for code in range(1, 4):
+                if len(self.is_auto_fill[code]) > 0:
+                    self.remake_auto_fill_data(code)
+
+    def filtered(self, code, reflectance):
+        # keeps the measured band and returns it through the filter of the band
+        self.unfiltered[code] = self.store(reflectance, code)
+        setting = self.band_filters[code]
+        if setting is None or len(self.unfiltered[code]) == 0:
+            return self.unfiltered[code]
+        # the cached entry holds the measured array, so its id is not reused while the entry lives
+        key = (id(self.unfiltered[code]),) + tuple(setting)
+        if key not in self.filter_cache:
+            if len(self.filter_cache) >= 10:
+                self.filter_cache.pop(next(iter(self.filter_cache)))
+            self.filter_cache[key] = (self.unfiltered[code], self.store(filter_band(self.unfiltered[code], *setting)))
+        return self.filter_cache[key][1]
+
+    def show_band_filter(self):
+        # loads the filter of the selected band into the filter row
+        setting = self.band_filters[self.filter_band_cb.currentIndex()]
+        widgets = [self.filter_method_cb, self.filter_window_sb, self.filter_param_sb]
+        for widget in widgets:
+            widget.blockSignals(True)
+        if setting is None:
+            self.filter_method_cb.setCurrentIndex(0)
+        else:
+            self.filter_method_cb.setCurrentIndex(["savgol", "lowpass", "despike"].index(setting[0]) + 1)
+            self.filter_window_sb.setValue(setting[1])
+            self.filter_param_sb.setValue(setting[2])
+        for widget in widgets:
+            widget.blockSignals(False)
+        self.filter_param_sb.setPrefix(["", "order ", "cutoff ", "threshold "][self.filter_method_cb.currentIndex()])
+        self.draw_unfiltered()
+
+    def set_band_filter(self):
+        code = self.filter_band_cb.currentIndex()
+        method = self.filter_method_cb.currentIndex()
+        self.filter_param_sb.setPrefix(["", "order ", "cutoff ", "threshold "][method])
+        self.band_filters[code] = None if method == 0 else (["savgol", "lowpass", "despike"][method-1], self.filter_window_sb.value(), self.filter_param_sb.value())
+        if len(self.reflectance[code]) == 0 or len(self.is_auto_fill[code]) > 0 or self.unfiltered[code] is None:
+            return
+        # the band is cut, merged and scaled again from its filtered data, auto-filled neighbours follow
+        with self.batch_update():
+            self.reflectance[code] = self.filtered(code, self.unfiltered[code])
+            if code == 4:
+                self.remove_HeNe()
+            for i in [code-1, code+1]:
+                if 0 < i < 4 and len(self.is_auto_fill[i]) > 0:
+                    self.remake_auto_fill_data(i)
+        self.draw_unfiltered()
+
+    def update_overlaps(self):
+        # mismatch of every measured band pair over its overlap, redrawn from the cached resampling on each draw
+        if self.overlap_axes is None:
+            if not self.overlap_cb.isChecked():
+                return
+            self.overlap_axes = self.axes.inset_axes([0.62, 0.06, 0.36, 0.3])
+            self.overlap_axes.tick_params(labelsize=7)
+            self.overlap_axes.set_xscale("log")
+            self.overlap_level = self.overlap_axes.axhline(1, color="#808080", linewidth=0.5)
+        self.overlap_axes.set_visible(self.overlap_cb.isChecked())
+        if not self.overlap_cb.isChecked():
+            return
+        ratio = self.overlap_mode_cb.currentIndex() == 0
+        texts = []
+        for i in range(4):
+            measured = [len(self.reflectance[k]) > 0 and len(self.is_auto_fill[k]) == 0 for k in (i, i+1)]
+            resampled = None
+            if all(measured):
+                cache = self.overlap_cache[i]
+                if cache is None or cache[0] is not self.reflectance[i] or cache[1] is not self.reflectance[i+1]:
+                    cache = (self.reflectance[i], self.reflectance[i+1], overlap_grid(self.freq[i], self.reflectance[i], self.freq[i+1], self.reflectance[i+1]))
+                    self.overlap_cache[i] = cache
+                resampled = cache[2]
+            if resampled is None:
+                if self.overlap_lines[i] is not None:
+                    self.overlap_lines[i].remove()
+                    self.overlap_lines[i] = None
+                continue
+            grid, base_a, base_b = resampled
+            mismatch = overlap_mismatch(base_a, base_b, (self.offset[i], self.multiplier[i]), (self.offset[i+1], self.multiplier[i+1]))
+            if self.overlap_lines[i] is None:
+                self.overlap_lines[i], = self.overlap_axes.plot([], [], color=self.R_curve_color[i+1], linewidth=1)
+            self.overlap_lines[i].set_data(grid, mismatch[0] if ratio else mismatch[1])
+            texts.append("{}/{} rms {:.4f}".format(self.band_names[i+1], self.band_names[i], mismatch[2]))
+        self.overlap_level.set_ydata([1, 1] if ratio else [0, 0])
+        self.overlap_axes.relim()
+        self.overlap_axes.autoscale_view()
+        self.overlap_lb.setText(", ".join(texts))
+
+    def draw_unfiltered(self):
+        if self.filter_raw_curve is not None:
+            self.filter_raw_curve.remove()
+            self.filter_raw_curve = None
+        code = self.filter_band_cb.currentIndex()
+        if self.filter_compare_cb.isChecked() and self.band_filters[code] is not None and self.unfiltered[code] is not None and len(self.reflectance[code]) > 0:
+            freq = self.freq[code]
+            index = decimate_index(freq, self.unfiltered[code], (freq[0], freq[-1]), self.display_points)
+            self.filter_raw_curve, = self.axes.plot(freq[index], self.unfiltered[code][index] * self.multiplier[code] + self.offset[code], color="#A0A0A0", linewidth=0.8, zorder=1)
+        self.draw()
+
+    def index_range(self, mask):
+        # a band cut is one contiguous run of points, which is kept as a slice so that indexing returns a view
+        index = np.flatnonzero(mask)
+        if len(index) == 0 or index[-1] - index[0] + 1 == len(index):
+            return slice(index[0], index[-1] + 1) if len(index) > 0 else slice(0, 0)
+        return index
+
     def initialize_graph(self):
         self.figure.clf()
         self.axes = self.figure.add_subplot()
@@ -1298,6 +2331,8 @@ class Spectrum(QFrame):
         self.axes.set_xlim([0, 25000])
         self.axes2.set_xlabel(r'Energy (eV)', fontsize=9)
         self.axes2.set_xlim([0, 25000/8065.5])
+        self.axes.callbacks.connect("xlim_changed", self.refresh_display)
+        self.axes.callbacks.connect("xlim_changed", self.sync_energy_axis)
         self.F.figure.subplots_adjust(left=0.03,
                         bottom=0.1,
                         right=0.97,
@@ -1329,48 +2364,38 @@ class Spectrum(QFrame):
                 color = self.R_curve_color[i]
                 if i == 0:
                     if self.break_line[i] is None:
-                        self.range[i] = [np.where(self.freq[i] >= 0)]
-                        self.R_curve[i], = self.axes.plot(self.freq[i], self.reflectance[i], color = color, linestyle = '-')
+                        self.range[i] = [self.index_range(self.freq[i] >= 0)]
+                        self.R_curve[i], = self.axes.plot(*self.display_curve(i, self.offset[i], self.multiplier[i]), color = color, linestyle = '-')
                     else:
-                        freq = self.freq[i][np.where(self.freq[i] <= (self.freq[i][-1] + self.freq[i+1][0])/2)]
-                        reflectance = self.reflectance[i][np.where(self.freq[i] <= (self.freq[i][-1] + self.freq[i+1][0])/2)]
-                        self.range[i] = [np.where(self.freq[i] <= (self.freq[i][-1] + self.freq[i+1][0])/2)]
-                        self.R_curve[i], = self.axes.plot(freq, reflectance, color = color, linestyle = '-')
+                        self.range[i] = [self.index_range(self.freq[i] <= (self.freq[i][-1] + self.freq[i+1][0])/2)]
+                        self.R_curve[i], = self.axes.plot(*self.display_curve(i, self.offset[i], self.multiplier[i]), color = color, linestyle = '-')
                 elif i < 4:
                     if self.break_line[i] is None and self.break_line[i-1] is None:
-                        self.range[i] = [np.where(self.freq[i] >= 0)]
-                        self.R_curve[i], = self.axes.plot(self.freq[i], self.reflectance[i], color = color, linestyle = '-')
+                        self.range[i] = [self.index_range(self.freq[i] >= 0)]
+                        self.R_curve[i], = self.axes.plot(*self.display_curve(i, self.offset[i], self.multiplier[i]), color = color, linestyle = '-')
                     elif self.break_line[i-1] is None:
-                        freq = self.freq[i][np.where(self.freq[i] <= (self.freq[i][-1] + self.freq[i+1][0])/2)]
-                        reflectance = self.reflectance[i][np.where(self.freq[i] <= (self.freq[i][-1] + self.freq[i+1][0])/2)]
-                        self.range[i] = [np.where(self.freq[i] <= (self.freq[i][-1] + self.freq[i+1][0])/2)]
-                        self.R_curve[i], = self.axes.plot(freq, reflectance, color = color, linestyle = '-')
+                        self.range[i] = [self.index_range(self.freq[i] <= (self.freq[i][-1] + self.freq[i+1][0])/2)]
+                        self.R_curve[i], = self.axes.plot(*self.display_curve(i, self.offset[i], self.multiplier[i]), color = color, linestyle = '-')
                     elif self.break_line[i] is None:
-                        freq = self.freq[i][np.where(self.freq[i] > (self.freq[i-1][-1] + self.freq[i][0])/2)]
-                        reflectance = self.reflectance[i][np.where(self.freq[i] > (self.freq[i-1][-1] + self.freq[i][0])/2)]
-                        self.range[i] = [np.where(self.freq[i] > (self.freq[i-1][-1] + self.freq[i][0])/2)]
-                        self.R_curve[i], = self.axes.plot(freq, reflectance, color = color, linestyle = '-')
+                        self.range[i] = [self.index_range(self.freq[i] > (self.freq[i-1][-1] + self.freq[i][0])/2)]
+                        self.R_curve[i], = self.axes.plot(*self.display_curve(i, self.offset[i], self.multiplier[i]), color = color, linestyle = '-')
                     else:
-                        freq = self.freq[i][np.where(((self.freq[i-1][-1] + self.freq[i][0])/2 < self.freq[i]) & (self.freq[i] <= (self.freq[i][-1] + self.freq[i+1][0])/2))]
-                        reflectance = self.reflectance[i][np.where(((self.freq[i-1][-1] + self.freq[i][0])/2 < self.freq[i]) & (self.freq[i] <= (self.freq[i][-1] + self.freq[i+1][0])/2))]
-                        self.range[i] = [np.where(((self.freq[i-1][-1] + self.freq[i][0])/2 < self.freq[i]) & (self.freq[i] <= (self.freq[i][-1] + self.freq[i+1][0])/2))]
-                        self.R_curve[i], = self.axes.plot(freq, reflectance, color = color, linestyle = '-')
+                        self.range[i] = [self.index_range(((self.freq[i-1][-1] + self.freq[i][0])/2 < self.freq[i]) & (self.freq[i] <= (self.freq[i][-1] + self.freq[i+1][0])/2))]
+                        self.R_curve[i], = self.axes.plot(*self.display_curve(i, self.offset[i], self.multiplier[i]), color = color, linestyle = '-')
                 else:
                     if self.break_line[i-1] is None:
-                        self.range[i] = [np.where(self.freq[i] >= 0)]
-                        self.R_curve[i], = self.axes.plot(self.freq[i], self.reflectance[i], color = color, linestyle = '-')
+                        self.range[i] = [self.index_range(self.freq[i] >= 0)]
+                        self.R_curve[i], = self.axes.plot(*self.display_curve(i, self.offset[i], self.multiplier[i]), color = color, linestyle = '-')
                     else:
-                        freq = self.freq[i][np.where(self.freq[i] > (self.freq[i-1][-1] + self.freq[i][0])/2)]
-                        reflectance = self.reflectance[i][np.where(self.freq[i] > (self.freq[i-1][-1] + self.freq[i][0])/2)]
-                        self.range[i] = [np.where(self.freq[i] > (self.freq[i-1][-1] + self.freq[i][0])/2)]
-                        self.R_curve[i], = self.axes.plot(freq, reflectance, color = color, linestyle = '-')
+                        self.range[i] = [self.index_range(self.freq[i] > (self.freq[i-1][-1] + self.freq[i][0])/2)]
+                        self.R_curve[i], = self.axes.plot(*self.display_curve(i, self.offset[i], self.multiplier[i]), color = color, linestyle = '-')
         self.scale_graph(0, self.EEIR_offset_sb.value(), self.EEIR_multiplier_sb.value())
         self.scale_graph(1, self.FIR_offset_sb.value(), self.FIR_multiplier_sb.value())
         self.scale_graph(2, self.MIR_offset_sb.value(), self.MIR_multiplier_sb.value())
         self.scale_graph(3, self.NIR_offset_sb.value(), self.NIR_multiplier_sb.value())
         self.scale_graph(4, self.VIS_offset_sb.value(), self.VIS_multiplier_sb.value())
         self.remove_HeNe()
-        self.F.draw()
+        self.draw()
 
     def merge_graph(self, id, x, left, right):
         i = int(id)-1
@@ -1395,56 +2420,146 @@ class Spectrum(QFrame):
             self.break_line[i] = self.axes.axvline(x = x, color = self.break_line_color[i], linestyle = '--')
         if len(self.reflectance[i]) > 0:
             if left is not None and self.break_line[i-1] is not None:
-                freq1 = self.freq[i][np.where((self.freq[i] <= x) & (self.freq[i] > left))]
-                reflectance1 = self.reflectance[i][np.where((self.freq[i] <= x) & (self.freq[i] > left))]
-                self.range[i] = [np.where((self.freq[i] <= x) & (self.freq[i] > left))]
+                self.range[i] = [self.index_range((self.freq[i] <= x) & (self.freq[i] > left))]
             else:
-                freq1 = self.freq[i][np.where(self.freq[i] <= x)]
-                reflectance1 = self.reflectance[i][np.where(self.freq[i] <= x)]
-                self.range[i] = [np.where(self.freq[i] <= x)]
-            self.R_curve[i], = self.axes.plot(freq1, reflectance1, color = self.R_curve_color[i], linestyle = '-')
+                self.range[i] = [self.index_range(self.freq[i] <= x)]
+            self.R_curve[i], = self.axes.plot(*self.display_curve(i, self.offset[i], self.multiplier[i]), color = self.R_curve_color[i], linestyle = '-')
         if len(self.reflectance[i+1]) > 0:
             if right is not None and self.break_line[i+1] is not None:
-                freq2 = self.freq[i+1][np.where((self.freq[i+1] > x) & (self.freq[i+1] <= right))]
-                reflectance2 = self.reflectance[i+1][np.where((self.freq[i+1] > x) & (self.freq[i+1] <= right))]
-                self.range[i+1] = [np.where((self.freq[i+1] > x) & (self.freq[i+1] <= right))]
+                self.range[i+1] = [self.index_range((self.freq[i+1] > x) & (self.freq[i+1] <= right))]
             else:
-                freq2 = self.freq[i+1][np.where(self.freq[i+1] > x)]
-                reflectance2 = self.reflectance[i+1][np.where(self.freq[i+1] > x)]
-                self.range[i+1] = [np.where(self.freq[i+1] > x)]
-            self.R_curve[i+1], = self.axes.plot(freq2, reflectance2, color = self.R_curve_color[i+1], linestyle = '-')
-        self.F.draw()
+                self.range[i+1] = [self.index_range(self.freq[i+1] > x)]
+            self.R_curve[i+1], = self.axes.plot(*self.display_curve(i+1, self.offset[i+1], self.multiplier[i+1]), color = self.R_curve_color[i+1], linestyle = '-')
+        self.draw()
 
     def scale_graph(self, i, offset, multiplier):
+        if len(self.range[i]) == 0:
+            # the band is being replaced and has not been cut yet
+            return
+        # the ranges are slices, so only the scaled result is a new array; auto-fill edges scale just 100 points
         if i > 0 and len(self.is_auto_fill[i-1]) > 0:
             # self.is_auto_fill[i-1][1][1] = (np.array(self.reflectance[i][self.range[i][0]])*multiplier+offset)[0]
-            self.is_auto_fill[i-1][1][1] = (np.array(self.reflectance[i][self.range[i][0]])*multiplier+offset)[:100]
+            self.is_auto_fill[i-1][1][1] = np.asarray(self.reflectance[i][self.range[i][0]][:100], dtype=float)*multiplier+offset
             self.remake_auto_fill_data(i-1)
-            self.R_curve[i-1].set_ydata(np.array(self.reflectance[i-1][self.range[i-1][0]]))
+            if self.R_curve[i-1] is not None:
+                self.R_curve[i-1].set_data(*self.display_curve(i-1, self.offset[i-1], self.multiplier[i-1]))
         if i < 4 and len(self.is_auto_fill[i+1]) > 0:
             # self.is_auto_fill[i+1][1][0] = (np.array(self.reflectance[i][self.range[i][0]])*multiplier+offset)[-1]
-            self.is_auto_fill[i+1][1][0] = (np.array(self.reflectance[i][self.range[i][0]])*multiplier+offset)[-100:]
+            self.is_auto_fill[i+1][1][0] = np.asarray(self.reflectance[i][self.range[i][0]][-100:], dtype=float)*multiplier+offset
             self.remake_auto_fill_data(i+1)
-            self.R_curve[i+1].set_ydata(np.array(self.reflectance[i+1][self.range[i+1][0]]))
+            if self.R_curve[i+1] is not None:
+                self.R_curve[i+1].set_data(*self.display_curve(i+1, self.offset[i+1], self.multiplier[i+1]))
         if self.R_curve[i] is not None:
-            self.R_curve[i].set_ydata(np.array(self.reflectance[i][self.range[i][0]])*multiplier+offset)
-            self.F.draw()
+            self.R_curve[i].set_data(*self.display_curve(i, offset, multiplier))
+            self.draw()
+
+    def display_curve(self, i, offset, multiplier):
+        # The band is drawn from a decimated copy of its base values; the decimation is redone only when the cut,
+        # the band array or the view window change, otherwise the affine transform is written into the same buffer.
+        # The scaled band itself is only built on export.
+        window = tuple(self.axes.get_xlim())
+        cache = self.display[i]
+        if cache is None or cache[0] is not self.range[i] or cache[1] is not self.reflectance[i] or cache[2] != window:
+            freq = self.freq[i][self.range[i][0]]
+            base = self.reflectance[i][self.range[i][0]]
+            index = decimate_index(freq, base, window, self.display_points)
+            cache = (self.range[i], self.reflectance[i], window, freq[index], np.asarray(base[index], dtype=float), np.empty(len(index)))
+            self.display[i] = cache
+        self.display_scale[i] = (offset, multiplier)
+        np.multiply(cache[4], multiplier, out=cache[5])
+        np.add(cache[5], offset, out=cache[5])
+        return cache[3], cache[5]
+
+    def refresh_display(self, axes=None):
+        # zooming and panning pick the points of the new window at full resolution
+        for i in range(5):
+            if self.R_curve[i] is not None and len(self.range[i]) > 0:
+                self.R_curve[i].set_data(*self.display_curve(i, *self.display_scale[i]))
+
+    def sync_energy_axis(self, axes=None):
+        # the energy axis follows the frequency axis, also in the log view of the extrapolation preview
+        self.axes2.set_xscale(self.axes.get_xscale())
+        x0, x1 = self.axes.get_xlim()
+        self.axes2.set_xlim(x0/8065.5, x1/8065.5)
+
+    def band_edge(self, i, part, reference=True):
+        # scaled and reference corrected points of band i inside its cut, as exported
+        freq = self.freq[i][self.range[i][0]][part]
+        reflectance = self.reflectance[i][self.range[i][0]][part].astype(float) * self.multiplier[i] + self.offset[i]
+        reference = self.reference_function() if reference else None
+        if reference is not None:
+            reflectance *= reference(freq)
+        return freq, reflectance
+
+    def extrapolated_ends(self, freq=None, reflectance=None):
+        # low and high ends as (freq, reflectance) pairs or None, fitted to the first and last points of the merged
+        # spectrum; without the merged arrays only the band edges are read, which keeps the live preview cheap
+        fit = self.extrapolation_fit_sb.value()
+        bands = [i for i in range(5) if len(self.reflectance[i]) > 0 and len(self.range[i]) > 0]
+        if len(bands) == 0:
+            return None, None
+        low = high = None
+        if self.low_end_cb.currentIndex() > 0:
+            edge = self.band_edge(bands[0], slice(0, fit)) if freq is None else (freq[:fit], reflectance[:fit])
+            if self.low_limit_sb.value() < edge[0][0]:
+                low = extrapolate_low(edge[0], edge[1], ["constant", "hagen-rubens"][self.low_end_cb.currentIndex()-1],
+                                      self.low_limit_sb.value(), self.extrapolation_points_sb.value())
+        if self.high_end_cb.currentIndex() > 0:
+            edge = self.band_edge(bands[-1], slice(-fit, None)) if freq is None else (freq[-fit:], reflectance[-fit:])
+            if self.high_limit_sb.value() > edge[0][-1]:
+                high = extrapolate_high(edge[0], edge[1], self.high_power_sb.value(), self.free_electron_sb.value(),
+                                        self.high_limit_sb.value(), self.extrapolation_points_sb.value())
+        return low, high
+
+    def update_extrapolation(self):
+        for curve in self.extrapolation_curves:
+            curve.remove()
+        self.extrapolation_curves = []
+        if self.preview_extrapolation_cb.isChecked():
+            for end in self.extrapolated_ends():
+                if end is not None:
+                    self.extrapolation_curves += self.axes.plot(end[0], end[1], color="#000000", linestyle=":")
+
+    def preview_extrapolation(self):
+        # the extrapolated ends span decades, so they are previewed on a log frequency axis
+        if self.preview_extrapolation_cb.isChecked():
+            self.axes.set_xscale("log")
+            self.axes.set_xlim([self.low_limit_sb.value() if self.low_end_cb.currentIndex() > 0 else 1, self.high_limit_sb.value() if self.high_end_cb.currentIndex() > 0 else 25000])
+        else:
+            self.axes.set_xscale("linear")
+            self.axes.set_xlim([0, 25000])
+        self.update_extrapolation()
+        self.draw()
+
+    def pipeline_sources(self):
+        # loaded bands keyed by their version; auto-filled bands are rebuilt by the pipeline from their neighbours
+        return [None if len(self.reflectance[i]) == 0 or len(self.is_auto_fill[i]) > 0 else ((i, self.band_version[i]), self.reflectance[i], self.freq[i])
+                for i in range(5)]
+
+    def merged_spectrum(self):
+        # merged frequency and reflectance in float64 as written on export
+        sources = self.pipeline_sources()
+        if all(source is None for source in sources):
+            return np.array([]), np.array([])
+        return self.pipeline.run(sources, reference_key=self.reference_key(), **self.merge_params())[1]
 
     def save_mergedSpec(self):
         path = QFileDialog.getSaveFileName(self, "Save your file", r"~\PycharmProjects/Transfer Matrix Method/merged_spectrum", "TXT Files (*.txt) ;; CSV Files (*.csv) ;; DAT Files (*.dat)")[0]
         if path != "":
-            file = open(path, 'w')
-            for i in range(len(self.freq)):
-                if len(self.freq[i]) > 0:
-                    reflectance = np.array(self.reflectance[i][self.range[i][0]]) * self.multiplier[i] + self.offset[i]
-                    freq = np.array(self.freq[i][self.range[i][0]])
-                    if self.ref_cb.currentText() == "Au":
-                        reflectance *= self.Au_refl(freq)
-                    elif self.ref_cb.currentText() == "Ag":
-                        reflectance *= self.Ag_refl(freq)
-                    for j in range(len(freq)):
-                        file.write("{}\t{}\n".format(freq[j], reflectance[j]))
-            file.close()
+            self.write_mergedSpec(path)
+
+    def write_mergedSpec(self, path):
+        # exported in float64 whatever the storage precision
+        sources = self.pipeline_sources()
+        text = ""
+        if any(source is not None for source in sources):
+            text = self.pipeline.export(sources, reference_key=self.reference_key(), **self.merge_params())
+            if self.export_extrapolation_cb.isChecked():
+                low, high = self.extrapolated_ends(*self.merged_spectrum())
+                text = (format_spectrum(*low) if low is not None else "") + text + (format_spectrum(*high) if high is not None else "")
+        file = open(path, 'w')
+        file.write(text)
+        file.close()
 
     def save_params(self):
         path = QFileDialog.getSaveFileName(self, "Save your file", r"~\PycharmProjects/Transfer Matrix Method/merging_params", "TXT Files (*.txt) ;; CSV Files (*.csv) ;; DAT Files (*.dat)")[0]
@@ -1466,74 +2581,398 @@ class Spectrum(QFrame):
             self.save_mergedSpec()
         if self.save_params_cb.isChecked():
             self.save_params()
+        if self.save_session_cb.isChecked():
+            self.save_session()
+        if self.save_campaign_cb.isChecked():
+            self.save_campaign()
+
+    def save_campaign(self):
+        # appends the exported spectrum to the campaign store, asking for the campaign folder once per session
+        if self.campaign is None:
+            folder = QFileDialog.getExistingDirectory(self, "Select the campaign folder")
+            if folder == "":
+                return
+            self.campaign = CampaignStore(folder)
+        names = [getattr(self, "{}_path_lb".format(name)).text() for name in self.band_names]
+        default = next((os.path.splitext(name)[0] for name in names if name != ""), "merged_spectrum")
+        name, ok = QInputDialog.getText(self, "Store in campaign", "Name (sample and temperature are read from it, e.g. CuO_300K)", text=default)
+        if not ok or name == "":
+            return
+        freq, reflectance = self.merged_spectrum()
+        if len(freq) == 0:
+            return
+        if self.export_extrapolation_cb.isChecked():
+            low, high = self.extrapolated_ends(freq, reflectance)
+            ends = [end for end in [low, (freq, reflectance), high] if end is not None]
+            freq = np.concatenate([end[0] for end in ends])
+            reflectance = np.concatenate([end[1] for end in ends])
+        breakpoints, offset, multiplier = self.get_merge_state()
+        params = {"breakpoints": breakpoints, "offset": offset, "multiplier": multiplier,
+                  "auto_fill": [[getattr(self, "{}_autoFill_cb".format(band)).isChecked(), self.auto_fill_order[code-1]] for code, band in enumerate(self.band_names) if 0 < code < 4],
+                  "remove_HeNe": self.VIS_removeHeNe_cb.isChecked(), "reference": self.reference_key(), "files": names}
+        self.campaign.add([(name, freq, reflectance, params, None)])
 
     def load_params(self):
         path = QFileDialog.getOpenFileName(self, "Select a file", r"~\PycharmProjects/Transfer Matrix Method/merging_params", "Text Files (*.txt *.csv *.dat)")[0]
         if path != "":
             file = open(path, 'r')
             try:
-                for line_index, line_str in enumerate(file):
-                    line_list = self.split_string_to_data(line_str)
-                    if line_list[0] == "Breakpoint1":
-                        self.breakPoint1_sb.setValue(float(line_list[1]))
-                        self.breakPoint1_sld.setValue(float(line_list[1]))
-                    elif line_list[0] == "Breakpoint2":
-                        self.breakPoint2_sb.setValue(float(line_list[1]))
-                        self.breakPoint2_sld.setValue(float(line_list[1]))
-                    elif line_list[0] == "Breakpoint3":
-                        self.breakPoint3_sb.setValue(float(line_list[1]))
-                        self.breakPoint3_sld.setValue(float(line_list[1]))
-                    elif line_list[0] == "Breakpoint4":
-                        self.breakPoint4_sb.setValue(float(line_list[1]))
-                        self.breakPoint4_sld.setValue(float(line_list[1]))
-                    elif line_list[0] == "EEIR" or line_list[0] == "THz":
-                        self.EEIR_offset_sb.setValue(float(line_list[1]))
-                        self.EEIR_offset_sld.setValue(float(line_list[1]))
-                        self.offset[0] = float(line_list[1])
-                        self.EEIR_multiplier_sb.setValue(float(line_list[2]))
-                        self.EEIR_multiplier_sld.setValue(float(line_list[2]))
-                        self.multiplier[0] = float(line_list[2])
-                    elif line_list[0] == "FIR":
-                        self.FIR_offset_sb.setValue(float(line_list[1]))
-                        self.FIR_offset_sld.setValue(float(line_list[1]))
-                        self.offset[1] = float(line_list[1])
-                        self.FIR_multiplier_sb.setValue(float(line_list[2]))
-                        self.FIR_multiplier_sld.setValue(float(line_list[2]))
-                        self.multiplier[1] = float(line_list[2])
-                    elif line_list[0] == "MIR":
-                        self.MIR_offset_sb.setValue(float(line_list[1]))
-                        self.MIR_offset_sld.setValue(float(line_list[1]))
-                        self.offset[2] = float(line_list[1])
-                        self.MIR_multiplier_sb.setValue(float(line_list[2]))
-                        self.MIR_multiplier_sld.setValue(float(line_list[2]))
-                        self.multiplier[2] = float(line_list[2])
-                    elif line_list[0] == "NIR":
-                        self.NIR_offset_sb.setValue(float(line_list[1]))
-                        self.NIR_offset_sld.setValue(float(line_list[1]))
-                        self.offset[3] = float(line_list[1])
-                        self.NIR_multiplier_sb.setValue(float(line_list[2]))
-                        self.NIR_multiplier_sld.setValue(float(line_list[2]))
-                        self.multiplier[3] = float(line_list[2])
-                    elif line_list[0] == "VIS":
-                        self.VIS_offset_sb.setValue(float(line_list[1]))
-                        self.VIS_offset_sld.setValue(float(line_list[1]))
-                        self.offset[4] = float(line_list[1])
-                        self.VIS_multiplier_sb.setValue(float(line_list[2]))
-                        self.VIS_multiplier_sld.setValue(float(line_list[2]))
-                        self.multiplier[4] = float(line_list[2])
-                self.merge_graph("1", self.breakPoint1_sb.value(), None, self.breakPoint2_sb.value())
-                self.merge_graph("2", self.breakPoint2_sb.value(), self.breakPoint1_sb.value(), self.breakPoint3_sb.value())
-                self.merge_graph("3", self.breakPoint3_sb.value(), self.breakPoint2_sb.value(), self.breakPoint4_sb.value())
-                self.merge_graph("4", self.breakPoint4_sb.value(), self.breakPoint3_sb.value(), None)
-                self.scale_graph(0, self.EEIR_offset_sb.value(), self.EEIR_multiplier_sb.value())
-                self.scale_graph(1, self.FIR_offset_sb.value(), self.FIR_multiplier_sb.value())
-                self.scale_graph(2, self.MIR_offset_sb.value(), self.MIR_multiplier_sb.value())
-                self.scale_graph(3, self.NIR_offset_sb.value(), self.NIR_multiplier_sb.value())
-                self.scale_graph(4, self.VIS_offset_sb.value(), self.VIS_multiplier_sb.value())
-                self.F.draw()
+                # all values are applied with signals held, then merged and drawn once
+                with self.batch_update():
+                    for line_index, line_str in enumerate(file):
+                        line_list = self.split_string_to_data(line_str)
+                        if len(line_list) == 0:
+                            continue
+                        if line_list[0] in ["Breakpoint1", "Breakpoint2", "Breakpoint3", "Breakpoint4"]:
+                            getattr(self, "breakPoint{}_sb".format(line_list[0][-1])).setValue(float(line_list[1]))
+                            getattr(self, "breakPoint{}_sld".format(line_list[0][-1])).setValue(float(line_list[1]))
+                        elif line_list[0] in self.band_names or line_list[0] == "THz":
+                            i = 0 if line_list[0] == "THz" else self.band_names.index(line_list[0])
+                            self.offset[i] = float(line_list[1])
+                            self.multiplier[i] = float(line_list[2])
+                            for type in ("offset", "multiplier"):
+                                getattr(self, "{}_{}_sb".format(self.band_names[i], type)).setValue(getattr(self, type)[i])
+                                getattr(self, "{}_{}_sld".format(self.band_names[i], type)).setValue(getattr(self, type)[i])
             except:
                 QMessageBox.warning(self, "Load params", "You are not selecting a correct file!")
                 return
+            finally:
+                file.close()
+
+    def param_widgets(self):
+        widgets = self.history_sliders()
+        widgets += [getattr(self, "breakPoint{}_sb".format(i+1)) for i in range(4)]
+        for name in self.band_names:
+            widgets.append(getattr(self, "{}_offset_sb".format(name)))
+            widgets.append(getattr(self, "{}_multiplier_sb".format(name)))
+        for name in self.band_names[1:4]:
+            widgets.append(getattr(self, "{}_autoFill_cb".format(name)))
+            widgets.append(getattr(self, "{}_autoFill_combobox".format(name)))
+        widgets += [self.VIS_removeHeNe_cb, self.ref_cb, self.ref_angle_sb, self.ref_polarization_cb]
+        return widgets
+
+    @contextmanager
+    def batch_update(self):
+        # hold widget signals, canvas draws and history entries, then recompute and render exactly once
+        widgets = self.param_widgets()
+        for widget in widgets:
+            widget.blockSignals(True)
+        self.holding_draw = True
+        self.holding_history = True
+        try:
+            yield
+        finally:
+            for widget in widgets:
+                widget.blockSignals(False)
+            try:
+                self.recompute()
+            finally:
+                self.holding_draw = False
+                self.holding_history = False
+            self.F.draw()
+            self.commit_state()
+
+    def recompute(self):
+        breakpoints = [getattr(self, "breakPoint{}_sb".format(i+1)).value() for i in range(4)]
+        for i in range(4):
+            if len(self.reflectance[i]) > 0 and len(self.reflectance[i+1]) > 0:
+                left = breakpoints[i-1] if i > 0 else None
+                right = breakpoints[i+1] if i < 3 else None
+                self.merge_graph(str(i+1), breakpoints[i], left, right)
+        for i in range(5):
+            self.scale_graph(i, self.offset[i], self.multiplier[i])
+
+    def save_session(self):
+        path = QFileDialog.getSaveFileName(self, "Save your file", r"~\PycharmProjects/Transfer Matrix Method/merging_session", "Session Files (*.npz)")[0]
+        if path != "":
+            # auto-filled bands are not stored, they are rebuilt from their neighbours on load
+            arrays = {}
+            for i in range(len(self.freq)):
+                if len(self.freq[i]) > 0 and len(self.is_auto_fill[i]) == 0:
+                    arrays["freq{}".format(i)] = np.asarray(self.freq[i])
+                    arrays["reflectance{}".format(i)] = np.asarray(self.reflectance[i] if self.unfiltered[i] is None else self.unfiltered[i])
+            auto_fill = np.zeros((3, 2), dtype=int)
+            for code in range(1, 4):
+                auto_fill[code-1] = [getattr(self, "{}_autoFill_cb".format(self.band_names[code])).isChecked(), self.auto_fill_order[code-1]]
+            breakpoints, offset, multiplier = self.get_merge_state()
+            np.savez(path,
+                     names=np.array([getattr(self, "{}_path_lb".format(name)).text() for name in self.band_names]),
+                     auto_fill=auto_fill,
+                     remove_HeNe=np.array(self.VIS_removeHeNe_cb.isChecked()),
+                     reference=np.array(self.ref_cb.currentText()),
+                     reference_geometry=np.array([self.ref_angle_sb.value(), self.ref_polarization_cb.currentIndex()]),
+                     breakpoints=np.array(breakpoints),
+                     offset=np.array(offset),
+                     multiplier=np.array(multiplier),
+                     filters=np.array(json.dumps(self.band_filters)),
+                     **arrays)
+
+    def load_npz_mmap(self, path):
+        # np.load ignores mmap_mode for .npz archives, so the uncompressed members are mapped directly.
+        # Copy-on-write mode keeps in-place edits such as remove_HeNe away from the file.
+        arrays = {}
+        with zipfile.ZipFile(path) as archive, open(path, "rb") as fp:
+            for info in archive.infolist():
+                name = info.filename[:-4] if info.filename.endswith(".npy") else info.filename
+                if info.compress_type != zipfile.ZIP_STORED:
+                    with archive.open(info) as member:
+                        arrays[name] = np.lib.format.read_array(member)
+                    continue
+                fp.seek(info.header_offset)
+                local_header = fp.read(30)
+                name_length, extra_length = struct.unpack("<HH", local_header[26:30])
+                start = info.header_offset + 30 + name_length + extra_length
+                fp.seek(start)
+                version = np.lib.format.read_magic(fp)
+                if version == (1, 0):
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(fp)
+                else:
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(fp)
+                if dtype.hasobject or len(shape) == 0 or 0 in shape:
+                    fp.seek(start)
+                    arrays[name] = np.lib.format.read_array(fp)
+                else:
+                    arrays[name] = np.memmap(path, dtype=dtype, mode="c", offset=fp.tell(), shape=shape, order="F" if fortran_order else "C")
+        return arrays
+
+    def load_session(self):
+        path = QFileDialog.getOpenFileName(self, "Select a file", r"~\PycharmProjects/Transfer Matrix Method/merging_session", "Session Files (*.npz)")[0]
+        if path != "":
+            try:
+                session = self.load_npz_mmap(path)
+                self.apply_session(session)
+            except:
+                QMessageBox.warning(self, "Load session", "You are not selecting a correct file!")
+                return
+
+    def apply_session(self, session):
+        with self.batch_update():
+            names = session["names"]
+            self.band_filters = [None if item is None else tuple(item) for item in json.loads(str(session["filters"]))] if "filters" in session else [None] * 5
+            self.show_band_filter()
+            for code, name in enumerate(self.band_names):
+                self.is_auto_fill[code] = []
+                self.range[code] = []
+                if "freq{}".format(code) in session:
+                    self.freq[code] = session["freq{}".format(code)]
+                    self.reflectance[code] = self.filtered(code, session["reflectance{}".format(code)])
+                    getattr(self, "{}_R_lb".format(name)).setText(u'\u2705')
+                    getattr(self, "{}_path_lb".format(name)).setText(str(names[code]))
+                else:
+                    self.freq[code] = []
+                    self.reflectance[code] = []
+                    getattr(self, "{}_R_lb".format(name)).setText(u'\u274c')
+                    getattr(self, "{}_path_lb".format(name)).setText("")
+                self.reset(code)
+            self.NIR_autoFill_cb.setEnabled(len(self.freq[3]) == 0)
+            self.renew_graph()
+            for code in range(1, 4):
+                checked, order = session["auto_fill"][code-1]
+                getattr(self, "{}_autoFill_cb".format(self.band_names[code])).setChecked(bool(checked))
+                getattr(self, "{}_autoFill_combobox".format(self.band_names[code])).setCurrentIndex(int(order))
+                self.auto_fill_order[code-1] = int(order)
+                if checked:
+                    self.auto_fill(code, True, int(order))
+            self.VIS_removeHeNe_cb.setChecked(bool(session["remove_HeNe"]))
+            self.remove_HeNe()
+            self.ref_cb.setCurrentText(str(session["reference"]))
+            if "reference_geometry" in session:
+                self.ref_angle_sb.setValue(float(session["reference_geometry"][0]))
+                self.ref_polarization_cb.setCurrentIndex(int(session["reference_geometry"][1]))
+            for i in range(4):
+                getattr(self, "breakPoint{}_sb".format(i+1)).setValue(float(session["breakpoints"][i]))
+                getattr(self, "breakPoint{}_sld".format(i+1)).setValue(float(session["breakpoints"][i]))
+            for i, name in enumerate(self.band_names):
+                self.offset[i] = float(session["offset"][i])
+                self.multiplier[i] = float(session["multiplier"][i])
+                for type in ("offset", "multiplier"):
+                    getattr(self, "{}_{}_sb".format(name, type)).setValue(getattr(self, type)[i])
+                    getattr(self, "{}_{}_sld".format(name, type)).setValue(getattr(self, type)[i])
+        self.clear_history()
+
+    def reference_function(self):
+        if self.ref_cb.currentIndex() == 0:
+            return None
+        return self.references.function(*self.reference_key())
+
+    def reference_key(self):
+        # mirror material and geometry, which identify the reference correction
+        return self.ref_cb.currentText(), self.ref_angle_sb.value(), ReferenceEngine.polarizations[self.ref_polarization_cb.currentIndex()]
+
+    def load_reference_material(self):
+        path = QFileDialog.getOpenFileName(self, "Open a mirror material: freq, eps1, eps2 columns or one row of Drude-Lorentz parameters", "", "TXT Files (*.txt) ;; CSV Files (*.csv) ;; DAT Files (*.dat)")[0]
+        if path == "":
+            return
+        try:
+            name = self.references.read_material(path)
+        except ValueError as e:
+            QMessageBox.warning(self, "Reference", str(e))
+            return
+        # a reloaded material keeps its name, so merges referenced with the previous version are dropped
+        self.pipeline.clear()
+        if self.ref_cb.findText(name) < 0:
+            self.ref_cb.addItem(name)
+        self.ref_cb.setCurrentText(name)
+
+    def merge_params(self):
+        # current merging parameters in the form taken by merge_bands
+        breakpoints, offset, multiplier = self.get_merge_state()
+        return {"breakpoints": breakpoints,
+                "offset": offset,
+                "multiplier": multiplier,
+                "auto_fill": [getattr(self, "{}_autoFill_cb".format(name)).isChecked() for name in self.band_names[1:4]],
+                "auto_fill_order": list(self.auto_fill_order),
+                "remove_HeNe": self.VIS_removeHeNe_cb.isChecked(),
+                "reference": self.reference_function()}
+
+    def merge_series(self):
+        # every sub-folder of the selected folder is one sample, merged with the current parameters
+        folderpath = QFileDialog.getExistingDirectory(self, 'Select a folder of samples')
+        if folderpath == "":
+            return
+        names = sort_nicely([f for f in os.listdir(folderpath) if os.path.isdir(os.path.join(folderpath, f))])
+        samples = [self.read_band_folder(os.path.join(folderpath, name))[0] for name in names]
+        samples = [[None if item is None else item[1] for item in assigned] for assigned in samples]
+        series = MultiSample(names, samples, self.storage_dtype)
+        if len(series.names) == 0:
+            QMessageBox.warning(self, "Merge sample series", "Cannot read samples in the selected folder!")
+            return
+        for code in range(5):
+            if self.band_filters[code] is not None and len(series.reflectance[code]) > 0:
+                series.reflectance[code] = filter_band(series.reflectance[code], *self.band_filters[code]).astype(self.storage_dtype)
+        savepath = QFileDialog.getExistingDirectory(self, 'Select a folder to save the merged spectra')
+        if savepath == "":
+            return
+        freq, reflectance = series.merge(**self.merge_params())
+        for name, R in zip(series.names, reflectance):
+            np.savetxt(os.path.join(savepath, name + ".txt"), np.transpose([freq, R]), delimiter="\t", fmt="%.10g")
+        self.series = series
+        self.series_spectra = (series.names, freq, reflectance)
+        self.fit_series_btn.setEnabled(True)
+        self.series_merged.emit(series.names, [freq] * len(series.names), reflectance)
+        if len(series.skipped) > 0:
+            QMessageBox.warning(self, "Merge sample series", "Samples with different bands from {} were skipped:\n".format(series.names[0]) + "\n".join(series.skipped))
+
+    def run_sweep(self):
+        params = self.merge_params()
+        # auto-filled bands are rebuilt by the engine from their neighbours
+        freq = [[] if len(self.is_auto_fill[i]) > 0 else self.freq[i] for i in range(5)]
+        reflectance = [[] if len(self.is_auto_fill[i]) > 0 else self.reflectance[i] for i in range(5)]
+        if sum(len(f) > 0 for f in freq) == 0:
+            QMessageBox.warning(self, "Sweep", "Please load reflectance data first!")
+            return
+        present = [len(self.reflectance[i]) > 0 for i in range(5)]
+        spread = (self.sweep_breakpoint_sb.value() / 100, self.sweep_offset_sb.value(), self.sweep_multiplier_sb.value() / 100)
+        try:
+            breakpoints, offset, multiplier = sweep_param_sets(params["breakpoints"], params["offset"], params["multiplier"], spread,
+                                                               self.sweep_count_sb.value(), "grid" if self.sweep_mode_cb.currentIndex() == 1 else "montecarlo",
+                                                               [present[i] and present[i+1] for i in range(4)], present)
+        except ValueError as e:
+            QMessageBox.warning(self, "Sweep", str(e))
+            return
+        grid, merged = self.merged_spectrum()
+        start = time.perf_counter()
+        QApplication.setOverrideCursor(Qt.WaitCursor)
+        try:
+            result = sweep_merge(freq, reflectance, breakpoints, offset, multiplier, grid, params["auto_fill"], params["auto_fill_order"],
+                                 params["remove_HeNe"], params["reference"])
+        finally:
+            QApplication.restoreOverrideCursor()
+        mean, std, lower, upper = sweep_bands(result)
+        self.sweep = (grid, merged, mean, std, lower, upper)
+        self.sweep_lb.setText("{} merges in {:.2f} s, median 95% width {:.4f}".format(len(result), time.perf_counter() - start, np.nanmedian(upper - lower)))
+        self.save_sweep_btn.setEnabled(True)
+        self.plot_sweep()
+
+    def plot_sweep(self):
+        if self.sweep_fill is not None:
+            self.sweep_fill.remove()
+            self.sweep_fill = None
+        if self.sweep is not None:
+            grid, merged, mean, std, lower, upper = self.sweep
+            index = np.union1d(decimate_index(grid, lower, (grid[0], grid[-1]), self.display_points), decimate_index(grid, upper, (grid[0], grid[-1]), self.display_points))
+            self.sweep_fill = self.axes.fill_between(grid[index], lower[index], upper[index], color="#808080", alpha=0.4, linewidth=0)
+        self.draw()
+
+    def clear_sweep(self):
+        self.sweep = None
+        self.save_sweep_btn.setEnabled(False)
+        self.sweep_lb.setText("")
+        self.plot_sweep()
+
+    def save_sweep(self):
+        path = QFileDialog.getSaveFileName(self, "Save your file", r"~\PycharmProjects/Transfer Matrix Method/merged_sweep", "TXT Files (*.txt) ;; CSV Files (*.csv) ;; DAT Files (*.dat)")[0]
+        if path != "":
+            np.savetxt(path, np.transpose(self.sweep), delimiter="\t", fmt="%.10g", header="freq\tmerged\tmean\tstd\tlower95\tupper95")
+
+    def fit_start(self):
+        # the last fit when it has the chosen number of oscillators, otherwise the number of oscillators of a cold start
+        if self.fit_params is not None and len(self.fit_params) == 3 + 3 * self.fit_oscillators_sb.value():
+            return self.fit_params
+        return self.fit_oscillators_sb.value()
+
+    def fit_kk_settings(self):
+        # Kramers-Kronig ends continued like the exported extrapolation, Hagen-Rubens when it is off
+        return dict(low_mode=["hagen-rubens", "constant", "hagen-rubens"][self.low_end_cb.currentIndex()],
+                    high_power=self.high_power_sb.value(), edge=self.extrapolation_fit_sb.value())
+
+    def fit_merged(self):
+        freq, reflectance = self.merged_spectrum()
+        if len(freq) == 0:
+            QMessageBox.warning(self, "Drude-Lorentz fit", "Please load reflectance data first!")
+            return
+        index = fit_grid_index(freq, self.fit_points_sb.value())
+        start = time.perf_counter()
+        QApplication.setOverrideCursor(Qt.WaitCursor)
+        try:
+            epsilon = kramers_kronig_epsilon(freq, reflectance, freq[index], **self.fit_kk_settings()) if self.fit_kk_cb.isChecked() else None
+            fitted, rms = fit_drude_lorentz_chunk(freq[index], reflectance[index][None], self.fit_start(), None if epsilon is None else epsilon[None])
+            self.fit_params = fitted[0]
+        finally:
+            QApplication.restoreOverrideCursor()
+        self.fit_lb.setText("rms {:.4g} in {:.2f} s: ".format(rms[0], time.perf_counter() - start) +
+                            ", ".join("{} {:.4g}".format(name, value) for name, value in zip(drude_lorentz_names(self.fit_oscillators_sb.value()), self.fit_params)))
+        if self.fit_curve is not None:
+            self.fit_curve.remove()
+        self.fit_curve, = self.axes.plot(freq[index], drude_lorentz_reflectance(freq[index], self.fit_params), color="#000000", linestyle="--", linewidth=1)
+        self.draw()
+
+    def fit_series(self):
+        # every merged sample of the last series, warm started along the series from the current fit
+        names, freq, reflectance = self.series_spectra
+        path = QFileDialog.getSaveFileName(self, "Save your file", r"~\PycharmProjects/Transfer Matrix Method/series_fit", "TXT Files (*.txt) ;; CSV Files (*.csv) ;; DAT Files (*.dat)")[0]
+        if path == "":
+            return
+        start = time.perf_counter()
+        QApplication.setOverrideCursor(Qt.WaitCursor)
+        try:
+            params, rms = fit_drude_lorentz_series(freq, reflectance, self.fit_start(), self.fit_kk_cb.isChecked(),
+                                                   self.fit_points_sb.value(), min(8, os.cpu_count() or 1), kk_settings=self.fit_kk_settings())
+        finally:
+            QApplication.restoreOverrideCursor()
+        write_fit_table(path, names, params, rms)
+        self.fit_lb.setText("{} samples in {:.2f} s, worst rms {:.4g}".format(len(names), time.perf_counter() - start, np.max(rms)))
+
+    def clear_fit(self):
+        self.fit_params = None
+        self.fit_lb.setText("")
+        if self.fit_curve is not None:
+            self.fit_curve.remove()
+            self.fit_curve = None
+        self.draw()
+
+    def show_profile(self, name, totals):
+        # totals hold the inclusive time of every instrumented stage during the last interaction
+        text = "{} {:.1f} ms".format(name, totals[name] * 1000)
+        others = ["{} {:.1f}".format(stage, seconds * 1000) for stage, seconds in sorted(totals.items(), key=lambda item: -item[1]) if stage != name]
+        if len(others) > 0:
+            text += "  ({})".format(", ".join(others))
+        self.profile_lb.setText(text)
+
+    def save_trace(self):
+        path = QFileDialog.getSaveFileName(self, "Save your file", r"~\PycharmProjects/Transfer Matrix Method/merging_trace", "Trace Files (*.json)")[0]
+        if path != "":
+            self.profiler.save_trace(path)
 
     def split_string_to_data(self, string):
         string = string.replace('\n', '') # delete tail '\n'
@@ -1551,6 +2990,1293 @@ class Spectrum(QFrame):
         return var_list
 
 
+def read_refFIT_data(path, transform=None):
+    if is_opus_file(path):
+        # the absorbance block, otherwise the ratio of the sample and reference channels stored in the file,
+        # transformed from their interferograms with the transform settings when the file has no single channels
+        try:
+            opus = OpusFile(path)
+            if "AB" in opus.blocks:
+                return opus.spectrum("AB")
+            freq, sample = opus_single_beam(opus, "Sm", transform)
+            return ratio_single_beam(freq, sample, opus_single_beam(opus, "Rf", transform)[1])
+        except (ValueError, KeyError, StopIteration, struct.error):
+            return
+    try:
+        file = np.loadtxt(path).transpose()
+        freq = file[0]
+        reflectance = file[1]
+    except:
+        try:
+            file = np.loadtxt(path, delimiter=",").transpose()
+            freq = file[0]
+            reflectance = file[1]
+        except:
+            try:
+                file = np.loadtxt(path, delimiter=" ").transpose()
+                freq = file[0]
+                reflectance = file[1]
+            except:
+                return
+    return np.array(reflectance), np.array(freq)
+
+
+SPECTRUM_FILE_FILTER = "Spectrum Files (*.txt *.csv *.dat *.0 *.1 *.2 *.3 *.4 *.5 *.6 *.7 *.8 *.9) ;; All Files (*)"
+
+
+def sort_nicely(l):
+    """ Sort the given list in the way that humans expect.
+    """
+    convert = lambda text: int(text) if text.isdigit() else text
+    alphanum_key = lambda key: [ convert(c) for c in re.split('([0-9]+)', key) ]
+    l.sort(key=alphanum_key)
+    return l
+
+
+def is_spectrum_file(name):
+    # text exports and OPUS files, which carry the measurement number as extension (sample.0, sample.1, ...)
+    extension = os.path.splitext(name)[1].lower()
+    return extension in (".txt", ".csv", ".dat") or re.fullmatch(r"\.\d+", extension) is not None
+
+
+def is_opus_file(path):
+    try:
+        with open(path, "rb") as fp:
+            return fp.read(4) == OpusFile.magic
+    except OSError:
+        return False
+
+
+class OpusFile:
+    # Bruker OPUS block file. A 24 byte header (magic, version, directory offset, directory capacity, number of
+    # blocks) points to a directory of 12 byte entries: data type, channel type and text type bytes, the block
+    # length in 4 byte words and the block offset. Data blocks are float32 arrays, read with np.frombuffer from a
+    # copy-on-write mapping of the file without copying; their data parameter block (data type + 16) holds the
+    # x axis (FXV, LXV, NPT, DXU) and the y scaling CSF. Parameters are 3 letter names followed by a type
+    # (0 int32, 1 float64, otherwise text) and a size in 2 byte words, up to END.
+    magic = b"\x0a\x0a\xfe\xfe"
+    channels = {4: "Sc", 8: "Ig", 12: "Ph", 56: "Pw"}
+    sources = {7: "Sm", 11: "Rf"}
+    parameter_names = {8: "Instrument", 24: "Instrument (Rf)", 32: "Sample", 40: "Acquisition (Rf)", 48: "Acquisition",
+                       64: "FT", 72: "FT (Rf)", 96: "Optics", 104: "Optics (Rf)", 160: "Sample"}
+
+    def __init__(self, path):
+        with open(path, "rb") as fp:
+            self.buffer = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_COPY)
+        if self.buffer[:4] != self.magic:
+            raise ValueError("{} is not an OPUS file".format(path))
+        directory, capacity, count = struct.unpack_from("<iii", self.buffer, 12)
+        self.blocks = {}
+        self.parameter_blocks = {}
+        for k in range(count):
+            data_type, channel_type, text_type, _, length, offset = struct.unpack_from("<BBBBii", self.buffer, directory + 12 * k)
+            if offset <= 0:
+                break
+            entry = (offset, 4 * length)
+            if text_type != 0:
+                continue
+            if data_type in self.sources and channel_type in self.channels:
+                self.blocks[self.channels[channel_type] + self.sources[data_type]] = entry
+            elif data_type == 15:
+                self.blocks["AB"] = entry
+            elif data_type - 16 in self.sources and channel_type in self.channels:
+                self.parameter_blocks[self.channels[channel_type] + self.sources[data_type-16]] = entry
+            elif data_type == 31:
+                self.parameter_blocks["AB"] = entry
+            elif data_type == 0 and channel_type in self.parameter_names:
+                self.parameter_blocks[self.parameter_names[channel_type]] = entry
+
+    def parameters(self, name):
+        # the parameters of a data block (e.g. "AB", "ScSm") or of a named parameter block as a dict
+        offset, length = self.parameter_blocks[name]
+        parameters = {}
+        position = offset
+        while position + 8 <= offset + length:
+            key = self.buffer[position:position+3].decode("latin-1")
+            if key == "END":
+                break
+            kind, size = struct.unpack_from("<HH", self.buffer, position + 4)
+            position += 8
+            if kind == 0:
+                parameters[key] = struct.unpack_from("<i", self.buffer, position)[0]
+            elif kind == 1:
+                parameters[key] = struct.unpack_from("<d", self.buffer, position)[0]
+            else:
+                parameters[key] = self.buffer[position:position + 2 * size].split(b"\0")[0].decode("latin-1")
+            position += 2 * size
+        return parameters
+
+    def x_axis(self, name):
+        # first and last x value, number of points and unit of a data block
+        parameters = self.parameters(name)
+        return parameters["FXV"], parameters["LXV"], parameters["NPT"], parameters.get("DXU", "WN")
+
+    def values(self, name):
+        # the points of a data block in file order, a view of the file unless they need scaling
+        offset, length = self.blocks[name]
+        parameters = self.parameters(name)
+        values = np.frombuffer(self.buffer, dtype="<f4", count=min(parameters["NPT"], length // 4), offset=offset)
+        scale = parameters.get("CSF", 1.0)
+        if scale != 1.0:
+            values = values * scale
+        return values
+
+    def laser(self):
+        # laser wavenumber in cm-1 from the instrument parameters, or None
+        if "Instrument" not in self.parameter_blocks:
+            return None
+        return self.parameters("Instrument").get("LWN")
+
+    def spectrum(self, name=None):
+        # (values, freq in cm-1) of a data block in ascending frequency, by default the first of AB, ScSm
+        if name is None:
+            name = next(block for block in ("AB", "ScSm") if block in self.blocks)
+        values = self.values(name)
+        first, last, points, unit = self.x_axis(name)
+        freq = np.linspace(first, last, len(values))
+        if unit == "MI":
+            freq = 1e4 / freq
+        if len(freq) > 1 and freq[0] > freq[-1]:
+            freq = freq[::-1]
+            values = values[::-1]
+        return values, freq
+
+
+def write_opus(path, spectra, parameters=None):
+    # A minimal OPUS file with a float32 data block and its data parameter block for each (values, freq) of spectra,
+    # keyed by block name ("AB", "ScSm", "ScRf", ...); parameters adds named parameter blocks such as "Acquisition".
+    # Frequencies are written descending as OPUS does. Used for fixtures and benchmarks.
+    codes = {"AB": (15, 0)}
+    for channel, prefix in OpusFile.channels.items():
+        for data_type, source in OpusFile.sources.items():
+            codes[prefix + source] = (data_type, channel)
+    names = {name: channel for channel, name in OpusFile.parameter_names.items()}
+
+    def encode(values):
+        body = b""
+        for key, value in values.items():
+            if isinstance(value, (int, np.integer)):
+                kind, data = 0, struct.pack("<i", int(value))
+            elif isinstance(value, (float, np.floating)):
+                kind, data = 1, struct.pack("<d", float(value))
+            else:
+                kind, data = 2, str(value).encode("latin-1") + b"\0"
+            data += b"\0" * (-len(data) % 4)
+            body += key.encode("latin-1")[:3].ljust(3, b"\0") + b"\0" + struct.pack("<HH", kind, len(data) // 2) + data
+        return body + b"END\0" + struct.pack("<HH", 0, 0)
+
+    blocks = []
+    for name, (values, freq) in spectra.items():
+        data_type, channel = codes[name]
+        values = np.asarray(values, dtype="<f4")[::-1]
+        blocks.append(((data_type, channel), values.tobytes()))
+        blocks.append(((data_type + 16, channel), encode({"DPF": 1, "NPT": len(values), "FXV": float(freq[-1]), "LXV": float(freq[0]), "CSF": 1.0, "DXU": "WN"})))
+    for name, values in (parameters or {}).items():
+        blocks.append(((0, names[name]), encode(values)))
+    directory = 24
+    position = directory + 12 * len(blocks)
+    header = OpusFile.magic + struct.pack("<diii", 920622.0, directory, len(blocks), len(blocks))
+    entries = b""
+    for (data_type, channel), data in blocks:
+        entries += struct.pack("<BBBBii", data_type, channel, 0, 0, len(data) // 4, position)
+        position += len(data)
+    with open(path, "wb") as fp:
+        fp.write(header + entries + b"".join(data for code, data in blocks))
+
+
+def read_single_beam(path, average=True, transform=None):
+    # (freq, single beam) of a text file whose further columns are repeated scans, averaged or the first one taken;
+    # OPUS files give their sample single channel, which is already co-added, or transform their sample interferogram
+    if is_opus_file(path):
+        try:
+            return opus_single_beam(OpusFile(path), "Sm", transform)
+        except (ValueError, KeyError, struct.error):
+            return None
+    for delimiter in (None, ",", " "):
+        try:
+            data = np.loadtxt(path, delimiter=delimiter, ndmin=2)
+            break
+        except ValueError:
+            continue
+    else:
+        return None
+    if data.shape[1] < 2:
+        return None
+    return data[:, 0], data[:, 1:].mean(axis=1) if average else data[:, 1]
+
+
+def opus_single_beam(opus, source="Sm", transform=None):
+    # (freq, single channel) of the sample ("Sm") or reference ("Rf") of an OPUS file, from its single channel block
+    # or else its interferogram block, transformed with the transform_interferograms settings in transform
+    if "Sc" + source in opus.blocks:
+        beam, freq = opus.spectrum("Sc" + source)
+        return freq, beam
+    settings = dict(transform or {})
+    if opus.laser() is not None:
+        settings["laser"] = opus.laser()
+    return transform_interferograms(opus.values("Ig" + source), **settings)
+
+
+APODIZATIONS = ["boxcar", "triangular", "Happ-Genzel", "Blackman-Harris 3-term", "Blackman-Harris 4-term", "Norton-Beer medium"]
+
+
+def apodization(x, name):
+    # apodization function of the relative retardation x = |OPD| / maximum OPD in [0, 1]
+    x = np.clip(x, 0, 1)
+    if name == "boxcar":
+        return np.ones_like(x)
+    elif name == "triangular":
+        return 1 - x
+    elif name == "Happ-Genzel":
+        return 0.54 + 0.46 * np.cos(np.pi * x)
+    elif name == "Blackman-Harris 3-term":
+        return 0.42323 + 0.49755 * np.cos(np.pi * x) + 0.07922 * np.cos(2 * np.pi * x)
+    elif name == "Blackman-Harris 4-term":
+        return 0.35875 + 0.48829 * np.cos(np.pi * x) + 0.14128 * np.cos(2 * np.pi * x) + 0.01168 * np.cos(3 * np.pi * x)
+    elif name == "Norton-Beer medium":
+        return 0.152442 - 0.136176 * (1 - x ** 2) + 0.983734 * (1 - x ** 2) ** 2
+    raise ValueError("unknown apodization {}".format(name))
+
+
+def transform_interferograms(interferograms, laser=15798.0, apodization_name="Blackman-Harris 3-term", zero_fill=2, phase_points=256, coadd=True, chunk=64):
+    # Single beam spectra of interferograms (one scan per row) sampled at every zero crossing of the laser, so that
+    # the spectrum spans 0 to the laser wavenumber. Scans are aligned on their centre burst (scans with the burst in
+    # their second half are read backwards, as from the return stroke of the mirror), then chunk scans at a
+    # time are co-added, or transformed together, by one FFT over the rows. The single sided part is apodized
+    # with apodization_name, the phase_points before the burst enter through the Mertz ramp, and the length is zero
+    # filled to zero_fill times the next power of two. The phase comes from the triangle apodized 2 * phase_points
+    # around the burst, zero filled onto the same grid, and the spectrum is its projection onto that phase.
+    # Returns (freq, spectrum) without the zero frequency point, spectrum with one row per scan unless coadd.
+    scans = np.atleast_2d(np.asarray(interferograms, dtype=float))
+    burst = np.argmax(np.abs(scans - scans.mean(axis=1, keepdims=True)), axis=1)
+    direction = np.where(burst < scans.shape[1] / 2, 1, -1)
+    before = int(np.where(direction > 0, burst, scans.shape[1] - 1 - burst).min())
+    after = int(np.where(direction > 0, scans.shape[1] - burst, burst + 1).min())
+    points = min(phase_points, before, after - 1)
+    size = int(zero_fill) * 2 ** int(np.ceil(np.log2(2 * after)))
+    retardation = np.arange(-points, after)
+    weight = apodization(np.abs(retardation) / after, apodization_name) * np.clip((retardation + points) / (2 * points) if points > 0 else 1.0, 0, 1)
+    triangle = apodization(np.abs(np.arange(-points, points)) / max(points, 1), "triangular")
+
+    def aligned(rows):
+        # the rows from points before to after points past their burst, without their mean
+        rows = np.arange(rows.start, min(rows.stop, len(scans)))
+        window = scans[rows[:, None], burst[rows, None] + direction[rows, None] * retardation]
+        return window - scans[rows].mean(axis=1, keepdims=True)
+
+    def transform(window):
+        # the burst goes to index 0 and the points before it wrap to the end of the zero filled buffer
+        buffer = np.zeros((len(window), size))
+        buffer[:, :after] = window[:, points:] * weight[points:]
+        buffer[:, size-points:] = window[:, :points] * weight[:points]
+        spectrum = np.fft.rfft(buffer, axis=1)
+        if points == 0:
+            return np.abs(spectrum)
+        buffer[:] = 0
+        buffer[:, :points] = window[:, points:2*points] * triangle[points:]
+        buffer[:, size-points:] = window[:, :points] * triangle[:points]
+        phase = np.angle(np.fft.rfft(buffer, axis=1))
+        return spectrum.real * np.cos(phase) + spectrum.imag * np.sin(phase)
+
+    if coadd:
+        total = sum(aligned(slice(start, start + chunk)).sum(axis=0) for start in range(0, len(scans), chunk))
+        spectra = transform(total[None, :] / len(scans))[0]
+    else:
+        spectra = np.concatenate([transform(aligned(slice(start, start + chunk))) for start in range(0, len(scans), chunk)])
+    freq = np.fft.rfftfreq(size, 1 / (2 * laser))
+    return freq[1:], spectra[..., 1:]
+
+
+def read_interferograms(path, source="Sm"):
+    # (scans, laser wavenumber or None) of an OPUS interferogram block, a .npy array with one scan per row, or a text
+    # file with one scan per column; only OPUS files hold reference ("Rf") interferograms
+    if is_opus_file(path):
+        opus = OpusFile(path)
+        return np.atleast_2d(opus.values("Ig" + source)), opus.laser()
+    if source != "Sm":
+        raise KeyError("Ig" + source)
+    if path.lower().endswith(".npy"):
+        return np.atleast_2d(np.load(path)), None
+    for delimiter in (None, ",", " "):
+        try:
+            return np.loadtxt(path, delimiter=delimiter, ndmin=2).T, None
+        except ValueError:
+            continue
+    raise ValueError("Cannot read interferograms from {}".format(path))
+
+
+def ratio_single_beam(freq, sample, reference):
+    # reflectance and freq of sample over reference single beams on the same grid; sample may carry leading axes
+    # (samples or scans), and points where the reference is missing or zero are dropped
+    valid = np.isfinite(reference) & (reference != 0)
+    return np.asarray(sample)[..., valid] / reference[valid], freq[valid]
+
+
+class SingleBeamCache:
+    # Reference single beams shared by every sample of a session: each file version is parsed once, and it is
+    # resampled once per sample grid, so a series on a common grid costs one division per sample.
+    def __init__(self, max_grids=16):
+        self.beams = {}
+        self.grids = {}
+        self.max_grids = max_grids
+
+    def load(self, path, transform=None):
+        stat = os.stat(path)
+        key = (path, stat.st_mtime, stat.st_size, tuple(sorted((transform or {}).items())))
+        if key not in self.beams:
+            data = read_single_beam(path, transform=transform)
+            if data is None:
+                raise ValueError("Cannot read a single beam from {}".format(path))
+            order = np.argsort(data[0])
+            self.beams = {k: v for k, v in self.beams.items() if k[0] != path}
+            self.beams[key] = (data[0][order], data[1][order])
+        return key, self.beams[key]
+
+    def on_grid(self, path, freq, transform=None):
+        # the reference on freq, NaN outside its range; equal grids are used as they are
+        key, (ref_freq, beam) = self.load(path, transform)
+        grid_key = (key, len(freq), hash(np.asarray(freq, dtype=float).tobytes()))
+        if grid_key not in self.grids:
+            if len(ref_freq) == len(freq) and np.array_equal(ref_freq, freq):
+                resampled = beam
+            elif len(ref_freq) == len(freq) and np.array_equal(ref_freq, freq[::-1]):
+                resampled = beam[::-1]
+            else:
+                resampled = np.interp(freq, ref_freq, beam, left=np.nan, right=np.nan)
+            while len(self.grids) >= self.max_grids:
+                self.grids.pop(next(iter(self.grids)))
+            self.grids[grid_key] = resampled
+        return self.grids[grid_key]
+
+
+def decimate_index(freq, reflectance, window, max_points):
+    # indices of the points drawn for one band: the points inside the window plus one neighbour on each side,
+    # reduced to the minimum and maximum of each bin when there are more than max_points
+    start = max(np.searchsorted(freq, window[0]) - 1, 0)
+    stop = min(np.searchsorted(freq, window[1]) + 1, len(freq))
+    if stop - start <= max_points:
+        return np.arange(start, stop)
+    bins = max_points // 2
+    width = (stop - start) // bins
+    blocks = reflectance[start:start + bins * width].reshape(bins, width)
+    first = start + np.arange(bins) * width
+    index = np.sort(np.stack([first + np.argmin(blocks, axis=1), first + np.argmax(blocks, axis=1)], axis=1), axis=1).ravel()
+    return np.append(index, np.arange(start + bins * width, stop))
+
+
+def filter_band(reflectance, method, window, parameter):
+    # Filters along the last axis, so stacks of samples are filtered at once.
+    # "savgol": Savitzky-Golay of order parameter over window points; "lowpass": FFT low-pass keeping the
+    # lowest parameter fraction of the frequencies, on the band minus its end-to-end line so that the ends do not ring;
+    # "despike": points further than parameter robust sigmas (1.4826 MAD) from the running median are replaced by it.
+    reflectance = np.asarray(reflectance, dtype=float)
+    n = reflectance.shape[-1]
+    window = int(window) | 1
+    if method == "savgol":
+        order = int(parameter)
+        window = max(window, order + 2 | 1)
+        if window > n:
+            return reflectance
+        return savgol_filter(reflectance, window, order, axis=-1)
+    elif method == "lowpass":
+        trend = reflectance[..., :1] + (reflectance[..., -1:] - reflectance[..., :1]) * np.linspace(0, 1, n)
+        spectrum = np.fft.rfft(reflectance - trend, axis=-1)
+        spectrum[..., int(np.ceil(min(parameter, 1) * spectrum.shape[-1])):] = 0
+        return np.fft.irfft(spectrum, n, axis=-1) + trend
+    elif method == "despike":
+        size = (1,) * (reflectance.ndim - 1) + (min(window, n),)
+        median = median_filter(reflectance, size=size, mode="nearest")
+        deviation = np.abs(reflectance - median)
+        mad = median_filter(deviation, size=size, mode="nearest")
+        return np.where(deviation > parameter * 1.4826 * mad, median, reflectance)
+    raise ValueError("unknown filter {}".format(method))
+
+
+def overlap_grid(freq_a, reflectance_a, freq_b, reflectance_b, points=500):
+    # both bands resampled onto one grid over their common frequency range, or None if they do not overlap;
+    # the reflectance may carry leading sample axes
+    low = max(freq_a[0], freq_b[0])
+    high = min(freq_a[-1], freq_b[-1])
+    if high <= low:
+        return None
+    grid = np.linspace(low, high, points)
+    resample = lambda freq, reflectance: interp1d(freq, np.asarray(reflectance, dtype=float), axis=-1, assume_sorted=True)(grid)
+    return grid, resample(freq_a, reflectance_a), resample(freq_b, reflectance_b)
+
+
+def overlap_mismatch(base_a, base_b, scale_a, scale_b):
+    # ratio b/a, difference b-a and rms difference of two resampled bands after their (offset, multiplier)
+    a = base_a * scale_a[1] + scale_a[0]
+    b = base_b * scale_b[1] + scale_b[0]
+    difference = b - a
+    return b / a, difference, np.sqrt(np.mean(difference ** 2, axis=-1))
+
+
+def extrapolate_low(freq, reflectance, mode="hagen-rubens", limit=1.0, points=200):
+    # Low-frequency end on a log grid from limit up to freq[0], fitted to the first measured points, which may
+    # carry leading sample axes. "constant" holds their mean; "hagen-rubens" fits R = 1 - A*sqrt(w) of a metal.
+    grid = np.geomspace(limit, freq[0], points + 1)[:-1]
+    reflectance = np.asarray(reflectance, dtype=float)
+    if mode == "constant":
+        return grid, reflectance.mean(axis=-1, keepdims=True) + np.zeros(len(grid))
+    A = np.mean((1 - reflectance) / np.sqrt(freq), axis=-1, keepdims=True)
+    return grid, 1 - A * np.sqrt(grid)
+
+
+def extrapolate_high(freq, reflectance, power=2.0, free_electron=200000.0, limit=1000000.0, points=200):
+    # High-frequency end on a log grid from freq[-1] to limit: R ~ w^-power fitted to the last measured points,
+    # continued by the w^-4 free-electron tail above free_electron
+    grid = np.geomspace(freq[-1], limit, points + 1)[1:]
+    reflectance = np.asarray(reflectance, dtype=float)
+    amplitude = np.mean(reflectance * (freq / freq[-1]) ** power, axis=-1, keepdims=True)
+    onset = max(free_electron, freq[-1])
+    return grid, amplitude * (np.minimum(grid, onset) / freq[-1]) ** -power * (np.maximum(grid, onset) / onset) ** -4
+
+
+def remove_notch(freq, reflectance, low=15785, high=15815):
+    # replace the points in [low, high] by a straight line between their neighbours, for every sample at once
+    index = np.where((low <= freq) & (freq <= high))[0]
+    if len(index) == 0 or index[0] == 0 or index[-1] == len(freq) - 1:
+        return reflectance
+    left, right = index[0] - 1, index[-1] + 1
+    reflectance = np.array(reflectance, dtype=float)
+    weight = (freq[index] - freq[left]) / (freq[right] - freq[left])
+    reflectance[..., index] = reflectance[..., left, None] + (reflectance[..., right, None] - reflectance[..., left, None]) * weight
+    return reflectance
+
+
+def drude_lorentz_epsilon(freq, params, jacobian=False):
+    # eps(w) = eps_inf - wp^2/(w^2 + i*gD*w) + sum_j Wj^2/(wj^2 - w^2 - i*gj*w), frequencies in cm-1, with
+    # params = [eps_inf, wp, gD, w1, W1, g1, w2, W2, g2, ...]. All oscillators are evaluated at once as a
+    # (n_oscillators, n_freq) array; with jacobian the (n_params, n_freq) derivatives d eps/d param are returned too.
+    w = np.asarray(freq, dtype=float)
+    eps_inf, wp, gD = params[:3]
+    w0, W, g = np.reshape(np.asarray(params[3:], dtype=float), (-1, 3)).T[:, :, None]
+    drude = w ** 2 + 1j * gD * w
+    D = w0 ** 2 - w ** 2 - 1j * g * w
+    eps = eps_inf - wp ** 2 / drude + np.sum(W ** 2 / D, axis=0)
+    if not jacobian:
+        return eps
+    J = np.empty((len(params), len(w)), dtype=complex)
+    J[0] = 1
+    J[1] = -2 * wp / drude
+    J[2] = 1j * wp ** 2 * w / drude ** 2
+    J[3::3] = -2 * W ** 2 * w0 / D ** 2
+    J[4::3] = 2 * W / D
+    J[5::3] = 1j * W ** 2 * w / D ** 2
+    return eps, J
+
+
+def drude_lorentz_reflectance(freq, params, jacobian=False):
+    # normal incidence reflectance |(n-1)/(n+1)|^2 with n = sqrt(eps), and optionally d R/d param
+    if not jacobian:
+        n = np.sqrt(drude_lorentz_epsilon(freq, params))
+        return np.abs((n - 1) / (n + 1)) ** 2
+    eps, J = drude_lorentz_epsilon(freq, params, True)
+    n = np.sqrt(eps)
+    r = (n - 1) / (n + 1)
+    # dR/dp = 2 Re(conj(r) dr/dn dn/deps deps/dp) with dr/dn = 2/(n+1)^2 and dn/deps = 1/(2n)
+    return np.abs(r) ** 2, 2 * np.real(np.conj(r) / ((n + 1) ** 2 * n) * J)
+
+
+def drude_lorentz_guess(freq, reflectance, oscillators=3, peaks=True):
+    # eps_inf from the highest frequency point; a Drude term with its screened plasma frequency at the reflectance
+    # minimum when the low end is metallic; with peaks oscillators on the most prominent reflectance peaks, and
+    # the others spread over the data on a log scale
+    root = np.sqrt(np.clip(reflectance[-1], 0, 0.95))
+    eps_inf = max(((1 + root) / (1 - root)) ** 2, 1.0)
+    params = [eps_inf, freq[0], freq[0]]
+    if reflectance[0] > 0.7:
+        edge = freq[np.argmin(reflectance)] * np.sqrt(eps_inf)
+        params[1:] = [edge, 0.05 * edge]
+    centers = []
+    widths = []
+    if peaks:
+        index, properties = find_peaks(reflectance, prominence=0.01, width=1)
+        strongest = np.argsort(properties["prominences"])[::-1][:oscillators]
+        centers = list(freq[index[strongest]])
+        widths = list(0.5 * (freq[np.minimum(properties["right_ips"][strongest].astype(int) + 1, len(freq) - 1)] - freq[properties["left_ips"][strongest].astype(int)]))
+    spread = np.geomspace(freq[0], freq[-1], oscillators - len(centers) + 2)[1:-1]
+    for center, width in sorted(zip(centers + list(spread), widths + list(0.2 * spread))):
+        params += [center, center, max(width, 1e-3 * center)]
+    return np.array(params)
+
+
+def drude_lorentz_names(oscillators):
+    return ["eps_inf", "wp", "gD"] + ["{}{}".format(name, j+1) for j in range(oscillators) for name in ("w", "W", "g")]
+
+
+def fit_drude_lorentz(freq, reflectance, params, max_nfev=200, epsilon=None):
+    # least squares fit of the reflectance with the analytic Jacobian, starting from params, or of the complex
+    # epsilon (e.g. from kramers_kronig_epsilon) relative to its magnitude at each point when given;
+    # returns the fitted parameters and the rms residual
+    freq = np.asarray(freq, dtype=float)
+    # frequencies and widths are kept below 100 times the highest frequency, an oscillator cannot drift away
+    lower = np.zeros(len(params))
+    lower[0] = 1
+    upper = np.full(len(params), 100 * freq.max())
+    upper[0] = np.inf
+    if epsilon is None:
+        reflectance = np.asarray(reflectance, dtype=float)
+        residual = lambda p: drude_lorentz_reflectance(freq, p) - reflectance
+        jacobian = lambda p: drude_lorentz_reflectance(freq, p, True)[1].T
+    else:
+        scale = np.abs(epsilon)
+        split = lambda z: np.concatenate([z.real / scale, z.imag / scale], axis=-1)
+        residual = lambda p: split(drude_lorentz_epsilon(freq, p) - epsilon)
+        jacobian = lambda p: split(drude_lorentz_epsilon(freq, p, True)[1]).T
+    result = least_squares(residual, np.clip(params, lower, upper), jac=jacobian, bounds=(lower, upper), x_scale="jac", max_nfev=max_nfev)
+    return result.x, np.sqrt(np.mean(result.fun ** 2))
+
+
+def fit_drude_lorentz_cold(freq, reflectance, oscillators=3, max_nfev=200, epsilon=None):
+    # the better of the fits started from the peak guess and from the log-spread guess
+    fits = [fit_drude_lorentz(freq, reflectance, drude_lorentz_guess(freq, reflectance, oscillators, peaks), max_nfev, epsilon) for peaks in (True, False)]
+    return min(fits, key=lambda fit: fit[1])
+
+
+def fit_drude_lorentz_chunk(freq, reflectance, params, epsilon=None, max_nfev=200):
+    # fits the samples in order, each one starting from the result of the previous one; an int params is the
+    # number of oscillators of a cold start
+    fitted = []
+    rms = []
+    for k in range(len(reflectance)):
+        if np.ndim(params) == 0:
+            params, error = fit_drude_lorentz_cold(freq, reflectance[k], params, max_nfev, None if epsilon is None else epsilon[k])
+        else:
+            params, error = fit_drude_lorentz(freq, reflectance[k], params, max_nfev, None if epsilon is None else epsilon[k])
+        fitted.append(params)
+        rms.append(error)
+    return np.array(fitted), np.array(rms)
+
+
+def kramers_kronig_epsilon(freq, reflectance, eval_freq, low_mode="hagen-rubens", high_power=2.0, edge=20):
+    # Complex epsilon at eval_freq from the reflectance, which may carry leading sample axes. The phase
+    # theta(w) = -(w/pi) P int (ln R(w') - ln R(w)) / (w'^2 - w^2) dw' is integrated over the data continued by
+    # extrapolate_low and extrapolate_high, fitted to edge points on each side, as one matrix product for all
+    # samples; then n = (1 + r)/(1 - r) with r = sqrt(R) exp(i theta), the r = (n - 1)/(n + 1) of drude_lorentz_reflectance.
+    freq = np.asarray(freq, dtype=float)
+    reflectance = np.asarray(reflectance, dtype=float)
+    low = extrapolate_low(freq[:edge], reflectance[..., :edge], low_mode)
+    high = extrapolate_high(freq[-edge:], reflectance[..., -edge:], high_power)
+    grid = np.concatenate([low[0], freq, high[0]])
+    log_R = np.log(np.clip(np.concatenate([low[1] + np.zeros(reflectance.shape[:-1] + (1,)), reflectance, high[1] + np.zeros(reflectance.shape[:-1] + (1,))], axis=-1), 1e-12, 1))
+    weights = np.gradient(grid)
+    eval_freq = np.asarray(eval_freq, dtype=float)
+    log_R_eval = interp1d(grid, log_R, axis=-1, assume_sorted=True)(eval_freq)
+    theta = np.empty(log_R_eval.shape)
+    for start in range(0, len(eval_freq), 256):
+        w = eval_freq[start:start+256, None]
+        denominator = grid ** 2 - w ** 2
+        # the principal value drops the singular point; the subtracted ln R(w) keeps the rest finite
+        kernel = np.divide(weights, denominator, out=np.zeros(denominator.shape), where=np.abs(denominator) > 1e-9 * w ** 2)
+        theta[..., start:start+256] = -w[:, 0] / np.pi * (log_R @ kernel.T - log_R_eval[..., start:start+256] * kernel.sum(axis=1))
+    r = np.sqrt(np.exp(log_R_eval)) * np.exp(1j * theta)
+    return ((1 + r) / (1 - r)) ** 2
+
+
+def write_fit_table(path, names, params, rms):
+    # one row per sample: name, rms residual and the fitted parameters
+    with open(path, "w") as file:
+        file.write("\t".join(["name", "rms"] + drude_lorentz_names((params.shape[1] - 3) // 3)) + "\n")
+        for name, row, error in zip(names, params, rms):
+            file.write("\t".join([name] + ["{:.10g}".format(value) for value in [error, *row]]) + "\n")
+
+
+def fit_drude_lorentz_block(freq, handles, first, last, params, max_nfev=200):
+    # fit_drude_lorentz_chunk of the rows first to last of a series shared by fit_drude_lorentz_series
+    reflectance, epsilon = (None if handle is None else attach_shared_array(handle) for handle in handles)
+    result = fit_drude_lorentz_chunk(freq, reflectance[first:last], params, None if epsilon is None else epsilon[first:last], max_nfev)
+    del reflectance, epsilon
+    for handle in handles:
+        if handle is not None:
+            detach_shared_array(handle)
+    return result
+
+
+def read_fit_table(path):
+    # names, (samples, parameters) fits and rms residuals of a table written by write_fit_table
+    with open(path) as file:
+        file.readline()
+        rows = [line.rstrip("\n").split("\t") for line in file if line.strip() != ""]
+    return [row[0] for row in rows], np.array([row[2:] for row in rows], dtype=float), np.array([row[1] for row in rows], dtype=float)
+
+
+def fit_grid_index(freq, points=1000):
+    # indices of up to points frequencies spread evenly on a log scale
+    return np.unique(np.clip(np.searchsorted(freq, np.geomspace(freq[0], freq[-1], points)), 0, len(freq) - 1))
+
+
+def fit_drude_lorentz_series(freq, reflectance, params=3, kk=False, points=1000, workers=1, max_nfev=200, kk_settings=None, stride=25):
+    # Drude-Lorentz fits of a (samples, freq) series on up to points log-spaced frequencies, of the reflectance or with
+    # kk of its Kramers-Kronig epsilon, computed with the kk_settings keywords of kramers_kronig_epsilon. Every stride-th
+    # sample is an anchor, fitted in order along the series starting from params (cold started when params is the
+    # number of oscillators), each anchor from the previous one. The samples between anchors start from their anchor
+    # and then from the previous sample, in blocks shared out to workers processes, so the fits do not depend on the
+    # number of workers. Returns the (samples, parameters) fits and their rms residuals.
+    freq = np.asarray(freq, dtype=float)
+    reflectance = np.atleast_2d(np.asarray(reflectance, dtype=float))
+    index = fit_grid_index(freq, points)
+    epsilon = kramers_kronig_epsilon(freq, reflectance, freq[index], **(kk_settings or {})) if kk else None
+    reflectance = reflectance[:, index]
+    starts = np.arange(0, len(reflectance), stride)
+    anchors, anchor_rms = fit_drude_lorentz_chunk(freq[index], reflectance[starts], params, None if epsilon is None else epsilon[starts], max_nfev)
+    blocks = [(start + 1, min(start + stride, len(reflectance)), anchor) for start, anchor in zip(starts, anchors) if start + 1 < len(reflectance)]
+    if workers <= 1 or len(blocks) <= 1:
+        results = [fit_drude_lorentz_chunk(freq[index], reflectance[first:last], anchor, None if epsilon is None else epsilon[first:last], max_nfev)
+                   for first, last, anchor in blocks]
+    else:
+        # the series is placed in shared memory once, the tasks only carry its handle and their rows
+        registry = SharedArrayRegistry()
+        try:
+            handles = (registry.put("reflectance", reflectance), None if epsilon is None else registry.put("epsilon", epsilon))
+            # spawned workers, a fork would copy the threads and Qt state of the window into them
+            with ProcessPoolExecutor(max_workers=min(workers, len(blocks)), mp_context=get_context("spawn")) as pool:
+                results = list(pool.map(fit_drude_lorentz_block, *zip(*[(freq[index], handles, first, last, anchor, max_nfev) for first, last, anchor in blocks]),
+                                        chunksize=-(-len(blocks) // workers)))
+        finally:
+            registry.close()
+    fitted = np.empty((len(reflectance), anchors.shape[1]))
+    rms = np.empty(len(reflectance))
+    fitted[starts], rms[starts] = anchors, anchor_rms
+    block = iter(results)
+    for start in starts:
+        if len(reflectance[start+1:start+stride]) > 0:
+            fitted[start+1:start+stride], rms[start+1:start+stride] = next(block)
+    return fitted, rms
+
+
+def gap_fill_params(left_freq, left_R, right_freq, right_R, oscillators=3, points=400):
+    # Drude-Lorentz parameters fitted to up to points samples of each neighbouring band
+    pick = lambda f, R: (f[np.unique(np.linspace(0, len(f) - 1, min(len(f), points)).astype(int))], R[np.unique(np.linspace(0, len(f) - 1, min(len(f), points)).astype(int))])
+    left = pick(left_freq, left_R)
+    right = pick(right_freq, right_R)
+    freq = np.append(left[0], right[0])
+    reflectance = np.append(left[1], right[1])
+    return fit_drude_lorentz_cold(freq, reflectance, oscillators)[0]
+
+
+def gap_fill(left_freq, left_R, right_freq, right_R, fill_freq, order):
+    # reflectance across a missing band from its cut and scaled neighbours: order 0-2 interpolate through 100 edge
+    # points on each side (linear, quadratic, cubic), order 3 evaluates a Drude-Lorentz fit of the neighbours
+    if order == 3:
+        rows = [gap_fill_params(left_freq, l, right_freq, r) for l, r in zip(np.reshape(left_R, (-1, len(left_freq))), np.reshape(right_R, (-1, len(right_freq))))]
+        return np.reshape([drude_lorentz_reflectance(fill_freq, params) for params in rows], np.shape(left_R)[:-1] + (len(fill_freq),))
+    f = interp1d(np.append(left_freq[-100:], right_freq[:100]), np.concatenate([left_R[..., -100:], right_R[..., :100]], axis=-1), kind=["linear", "quadratic", "cubic"][order], axis=-1)
+    return f(fill_freq)
+
+
+def merge_bands(freq, reflectance, breakpoints, offset, multiplier, auto_fill=(False, False, False), auto_fill_order=(0, 0, 0), remove_HeNe=False, reference=None):
+    # Headless equivalent of the merge_graph/scale_graph/auto_fill chain of Spectrum.
+    # freq holds the five band grids (or empty), reflectance the matching arrays, which may carry leading
+    # sample axes, e.g. (n_samples, n_points). offset and multiplier entries may be scalars or per-sample arrays.
+    # Returns the merged frequency grid and reflectance.
+    freq = [np.asarray(f, dtype=float) for f in freq]
+    present = [len(f) > 0 for f in freq]
+    filled = [False] * 5
+    for code in range(1, 4):
+        filled[code] = bool(auto_fill[code-1]) and not present[code] and present[code-1] and present[code+1]
+    has = [present[i] or filled[i] for i in range(5)]
+
+    def cut(i, f):
+        mask = np.ones(len(f), dtype=bool)
+        if i > 0 and has[i-1]:
+            mask &= f > breakpoints[i-1]
+        if i < 4 and has[i+1]:
+            mask &= f <= breakpoints[i]
+        return mask
+
+    def scale(i, R):
+        return R * np.expand_dims(np.asarray(multiplier[i], dtype=float), -1) + np.expand_dims(np.asarray(offset[i], dtype=float), -1)
+
+    bands = [None] * 5
+    for i in range(5):
+        if present[i]:
+            # float32 storage is promoted only on the kept points
+            R = np.asarray(reflectance[i])
+            if i == 4 and remove_HeNe:
+                R = remove_notch(freq[i], R)
+            mask = cut(i, freq[i])
+            bands[i] = (freq[i][mask], scale(i, np.asarray(R[..., mask], dtype=float)))
+    for code in range(1, 4):
+        if filled[code]:
+            left_freq, left_R = bands[code-1]
+            right_freq, right_R = bands[code+1]
+            fill_freq = np.arange(left_freq[-1], right_freq[0], freq[code-1][-1] - freq[code-1][-2])
+            mask = cut(code, fill_freq)
+            bands[code] = (fill_freq[mask], scale(code, gap_fill(left_freq, left_R, right_freq, right_R, fill_freq[mask], auto_fill_order[code-1])))
+    bands = [b for b in bands if b is not None]
+    merged_freq = np.concatenate([b[0] for b in bands])
+    merged_R = np.concatenate([b[1] for b in bands], axis=-1)
+    if reference is not None:
+        merged_R = merged_R * reference(merged_freq)
+    return merged_freq, merged_R
+
+
+def sweep_param_sets(breakpoints, offset, multiplier, spread, count, mode="montecarlo", active_breakpoints=(True,)*4, active_bands=(True,)*5, seed=None):
+    # Variations of the merging parameters around the given ones. spread holds the relative breakpoint width,
+    # the absolute offset width and the relative multiplier width. "montecarlo" draws count sets, breakpoints
+    # uniformly and scales normally distributed; "grid" steps every active parameter over count values across
+    # its +-width and takes all combinations. Returns (n, 4) breakpoints and (n, 5) offsets and multipliers.
+    breakpoints = np.asarray(breakpoints, dtype=float)
+    offset = np.asarray(offset, dtype=float)
+    multiplier = np.asarray(multiplier, dtype=float)
+    widths = np.concatenate([breakpoints * spread[0], np.full(5, spread[1]), multiplier * spread[2]])
+    active = np.concatenate([active_breakpoints, active_bands, active_bands]) & (widths > 0)
+    centers = np.concatenate([breakpoints, offset, multiplier])
+    if mode == "grid":
+        steps = np.linspace(-1, 1, count) if count > 1 else np.zeros(1)
+        dims = np.flatnonzero(active)
+        if count ** len(dims) > 1000000:
+            raise ValueError("a grid of {} steps over {} parameters is too large, set some spreads to zero or use Monte-Carlo".format(count, len(dims)))
+        values = np.tile(centers, (count ** len(dims), 1))
+        if len(dims) > 0:
+            values[:, dims] += np.stack(np.meshgrid(*[steps] * len(dims), indexing="ij"), axis=-1).reshape(-1, len(dims)) * widths[dims]
+    else:
+        rng = np.random.default_rng(seed)
+        values = np.tile(centers, (count, 1))
+        values[:, :4] += rng.uniform(-1, 1, (count, 4)) * widths[:4] * active[:4]
+        values[:, 4:] += rng.standard_normal((count, 10)) * widths[4:] * active[4:]
+    return values[:, :4], values[:, 4:9], values[:, 9:]
+
+
+def sweep_merge(freq, reflectance, breakpoints, offset, multiplier, grid, auto_fill=(False, False, False), auto_fill_order=(0, 0, 0), remove_HeNe=False, reference=None, workers=None):
+    # Merges every parameter set of sweep_param_sets and resamples the results onto grid, returning (n, len(grid)).
+    # Breakpoints only matter through the points they cut, so sets with the same cuts form one batched
+    # merge_bands call over their offsets and multipliers. The groups run in workers processes (all cores by
+    # default), which view the bands, the grid and the result through SharedArrayRegistry handles; the reference is
+    # evaluated once here on the band and grid frequencies and interpolated from that table in the workers.
+    freq = [np.asarray(f, dtype=float) for f in freq]
+    keys = []
+    for i in range(4):
+        if len(freq[i]) > 0 and len(freq[i+1]) > 0:
+            keys += [np.searchsorted(freq[i], breakpoints[:, i], side="right"), np.searchsorted(freq[i+1], breakpoints[:, i], side="right")]
+        else:
+            # next to an auto-filled or missing band the cut depends on the value itself
+            keys.append(breakpoints[:, i])
+    groups = {}
+    for row, key in enumerate(zip(*keys)):
+        groups.setdefault(key, []).append(row)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(groups) == 1:
+        result = np.empty((len(breakpoints), len(grid)))
+        for rows in groups.values():
+            merged_freq, merged_R = merge_bands(freq, reflectance, breakpoints[rows[0]], offset[rows].T, multiplier[rows].T, auto_fill, auto_fill_order, remove_HeNe, reference)
+            result[rows] = interp1d(merged_freq, merged_R, axis=-1, bounds_error=False, assume_sorted=True)(grid)
+        return result
+    registry = SharedArrayRegistry()
+    try:
+        bands = [(registry.put(("freq", i), freq[i]), registry.put(("reflectance", i), reflectance[i])) if len(freq[i]) > 0 else None for i in range(5)]
+        table = None
+        if reference is not None:
+            table_freq = np.unique(np.concatenate([f for f in freq if len(f) > 0] + [np.asarray(grid, dtype=float)]))
+            table = (registry.put("reference_freq", table_freq), registry.put("reference", reference(table_freq)))
+        shared = (bands, table, registry.put("grid", np.asarray(grid, dtype=float)), registry.put("result", np.empty((len(breakpoints), len(grid)))))
+        tasks = [(shared, rows, breakpoints[rows[0]], offset[rows].T, multiplier[rows].T, auto_fill, auto_fill_order, remove_HeNe) for rows in groups.values()]
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks)), mp_context=get_context("spawn")) as pool:
+            list(pool.map(sweep_group, tasks, chunksize=-(-len(tasks) // min(workers, len(tasks)))))
+        view = attach_shared_array(shared[3])
+        result = np.array(view)
+        del view
+        detach_shared_array(shared[3])
+    finally:
+        registry.close()
+    return result
+
+
+def sweep_group(task):
+    # one batched merge of sweep_merge in a worker process, written into the shared result rows
+    (bands, table, grid, result), rows, breakpoints, offset, multiplier, auto_fill, auto_fill_order, remove_HeNe = task
+    freq = [[] if band is None else attach_shared_array(band[0]) for band in bands]
+    reflectance = [[] if band is None else attach_shared_array(band[1]) for band in bands]
+    reference = None
+    if table is not None:
+        table_freq, table_reference = attach_shared_array(table[0]), attach_shared_array(table[1])
+        reference = lambda f: np.interp(f, table_freq, table_reference)
+    merged_freq, merged_R = merge_bands(freq, reflectance, breakpoints, offset, multiplier, auto_fill, auto_fill_order, remove_HeNe, reference)
+    attach_shared_array(result, writeable=True)[rows] = interp1d(merged_freq, merged_R, axis=-1, bounds_error=False, assume_sorted=True)(attach_shared_array(grid))
+
+
+def sweep_bands(result, level=0.95):
+    # per-frequency mean, standard deviation and central confidence interval of a sweep
+    tail = (1 - level) / 2 * 100
+    lower, upper = np.nanpercentile(result, [tail, 100 - tail], axis=0)
+    return np.nanmean(result, axis=0), np.nanstd(result, axis=0), lower, upper
+
+
+def read_reference_engine():
+    # Au and Ag mirrors from the epsilon tables shipped next to this file
+    engine = ReferenceEngine()
+    folder = os.path.dirname(os.path.abspath(__file__))
+    with open(os.path.join(folder, "Ag_Epsilon_Reflectance_400-35000cm-1.pickle"), "rb") as fp:
+        Ag = pickle.load(fp)["Yang2015PRB"]
+    with open(os.path.join(folder, "Au_Eps_Reflectance_Olmon2012PRB.pickle"), "rb") as fp:
+        Au = pickle.load(fp)
+    engine.add_table("Au", Au.freq, Au.eps1, Au.eps2, Au.R)
+    engine.add_table("Ag", Ag.freq, Ag.ep1, Ag.ep2, Ag.R)
+    return engine
+
+
+def format_spectrum(freq, reflectance):
+    return "".join("{}\t{}\n".format(f, R) for f, R in zip(freq, reflectance))
+
+
+class MergePipeline:
+    # The merge of merge_bands as explicit stages: load -> notch -> scale -> cut -> auto-fill -> merge -> reference -> export.
+    # Every stage output is memoised under a key made of its own parameters and the keys of its inputs, so a
+    # change only recomputes the stages downstream of it, e.g. a VIS multiplier only rescales and recuts VIS.
+    # The cut comes before the auto-fill because the fill is interpolated from the cut neighbours.
+    stages = ["load", "notch", "scale", "cut", "auto_fill", "merge", "reference", "export"]
+
+    def __init__(self, cache_size=2):
+        self.cache_size = cache_size
+        self.cache = {stage: {} for stage in self.stages}
+        self.counts = {stage: [0, 0] for stage in self.stages}
+
+    def memo(self, stage, key, func):
+        # one least recently used cache per stage, shared by the bands and holding cache_size * 5 entries (about
+        # cache_size per band); the keys of array sources come from the caller, which must not reuse them for other data
+        cache = self.cache[stage]
+        if key in cache:
+            self.counts[stage][0] += 1
+            cache[key] = cache.pop(key)
+        else:
+            self.counts[stage][1] += 1
+            cache[key] = func()
+            while len(cache) > self.cache_size * 5:
+                cache.pop(next(iter(cache)))
+        return key, cache[key]
+
+    def clear(self):
+        for stage in self.stages:
+            self.cache[stage].clear()
+
+    def load(self, source):
+        # source is a file path or a (key, reflectance, freq) tuple whose key identifies the arrays
+        if isinstance(source, str):
+            stat = os.stat(source)
+            return self.memo("load", ("file", source, stat.st_mtime, stat.st_size), lambda: read_refFIT_data(source))
+        key, reflectance, freq = source
+        return self.memo("load", ("array", key), lambda: (reflectance, np.asarray(freq, dtype=float)))
+
+    def run(self, sources, breakpoints, offset, multiplier, auto_fill=(False, False, False), auto_fill_order=(0, 0, 0), remove_HeNe=False, reference=None, reference_key=None):
+        # sources holds five entries for load() or None; returns the key and (freq, reflectance) of the referenced merge
+        bands = [None if source is None else self.load(source) for source in sources]
+        present = [band is not None for band in bands]
+        filled = [False] * 5
+        for code in range(1, 4):
+            filled[code] = bool(auto_fill[code-1]) and not present[code] and present[code-1] and present[code+1]
+        has = [present[i] or filled[i] for i in range(5)]
+        bounds = [(breakpoints[i-1] if i > 0 and has[i-1] else None, breakpoints[i] if i < 4 and has[i+1] else None) for i in range(5)]
+
+        def cut(i, freq):
+            mask = np.ones(len(freq), dtype=bool)
+            if bounds[i][0] is not None:
+                mask &= freq > bounds[i][0]
+            if bounds[i][1] is not None:
+                mask &= freq <= bounds[i][1]
+            return mask
+
+        cuts = [None] * 5
+        for i in range(5):
+            if not present[i]:
+                continue
+            key, (reflectance, freq) = bands[i]
+            if i == 4 and remove_HeNe:
+                key, reflectance = self.memo("notch", key, lambda: remove_notch(freq, reflectance))
+            key, scaled = self.memo("scale", (key, offset[i], multiplier[i]), lambda: np.asarray(reflectance, dtype=float) * multiplier[i] + offset[i])
+            cuts[i] = self.memo("cut", (key, bounds[i]), lambda: (freq[cut(i, freq)], scaled[cut(i, freq)]))
+        for code in range(1, 4):
+            if filled[code]:
+                (left_key, (left_freq, left_R)), (right_key, (right_freq, right_R)) = cuts[code-1], cuts[code+1]
+                step = bands[code-1][1][1][-1] - bands[code-1][1][1][-2]
+
+                def fill():
+                    fill_freq = np.arange(left_freq[-1], right_freq[0], step)
+                    fill_freq = fill_freq[cut(code, fill_freq)]
+                    return fill_freq, gap_fill(left_freq, left_R, right_freq, right_R, fill_freq, auto_fill_order[code-1]) * multiplier[code] + offset[code]
+
+                cuts[code] = self.memo("auto_fill", (left_key, right_key, step, auto_fill_order[code-1], bounds[code], offset[code], multiplier[code]), fill)
+        cuts = [item for item in cuts if item is not None]
+        key, (freq, reflectance) = self.memo("merge", tuple(item[0] for item in cuts),
+                                             lambda: (np.concatenate([item[1][0] for item in cuts]), np.concatenate([item[1][1] for item in cuts])))
+        if reference is None:
+            return key, (freq, reflectance)
+        return self.memo("reference", (key, reference_key), lambda: (freq, reflectance * reference(freq)))
+
+    def export(self, sources, **params):
+        # the merged spectrum as the text written by save_mergedSpec
+        key, (freq, reflectance) = self.run(sources, **params)
+        return self.memo("export", key, lambda: format_spectrum(freq, reflectance))[1]
+
+
+class MultiSample:
+    # Samples measured on the same band grids. Every band is stored as one (n_samples, n_points) array so
+    # that merging, scaling, auto-fill and reference correction run once over the whole series.
+    def __init__(self, names, samples, dtype=float):
+        # samples[k][code] is (reflectance, freq) or None; the band set of the first sample is kept and
+        # samples with other bands are skipped. Grids that differ from the first sample are interpolated onto it.
+        # The stacks are stored as dtype, frequencies always as float64.
+        self.names = []
+        self.skipped = []
+        self.freq = [[], [], [], [], []]
+        self.reflectance = [[], [], [], [], []]
+        if len(samples) == 0:
+            return
+        layout = [item is not None for item in samples[0]]
+        stacks = [[], [], [], [], []]
+        for name, sample in zip(names, samples):
+            if [item is not None for item in sample] != layout:
+                self.skipped.append(name)
+                continue
+            self.names.append(name)
+            for code, item in enumerate(sample):
+                if item is None:
+                    continue
+                reflectance, freq = item
+                if len(self.freq[code]) == 0:
+                    self.freq[code] = np.asarray(freq, dtype=float)
+                if len(freq) != len(self.freq[code]) or not np.array_equal(freq, self.freq[code]):
+                    reflectance = np.interp(self.freq[code], freq, reflectance)
+                stacks[code].append(np.asarray(reflectance, dtype=dtype))
+        for code in range(5):
+            if len(stacks[code]) > 0:
+                self.reflectance[code] = np.vstack(stacks[code])
+
+    def merge(self, breakpoints, offset, multiplier, auto_fill=(False, False, False), auto_fill_order=(0, 0, 0), remove_HeNe=False, reference=None):
+        return merge_bands(self.freq, self.reflectance, breakpoints, offset, multiplier, auto_fill, auto_fill_order, remove_HeNe, reference)
+
+
+def fresnel_reflectance(epsilon, angle=0.0, polarization="s", ambient=1.0):
+    # Reflectance of a half-space of complex epsilon (any shape) for light coming from an ambient medium at angle
+    # degrees from the normal, with s, p or unpolarized (their mean) light
+    epsilon = np.asarray(epsilon, dtype=complex)
+    sin_angle = np.sqrt(ambient) * np.sin(np.radians(angle))
+    kz_ambient = np.sqrt(ambient) * np.cos(np.radians(angle))
+    kz = np.sqrt(epsilon - sin_angle ** 2)
+    if polarization == "unpolarized":
+        return (fresnel_reflectance(epsilon, angle, "s", ambient) + fresnel_reflectance(epsilon, angle, "p", ambient)) / 2
+    elif polarization == "s":
+        r = (kz_ambient - kz) / (kz_ambient + kz)
+    elif polarization == "p":
+        r = (epsilon * kz_ambient - ambient * kz) / (epsilon * kz_ambient + ambient * kz)
+    else:
+        raise ValueError("unknown polarization {}".format(polarization))
+    return np.abs(r) ** 2
+
+
+class ReferenceEngine:
+    # Mirror reflectance R(w) computed from the dielectric function of the mirror material for any angle of
+    # incidence and polarization. Materials are tables of epsilon, interpolated in eps1 and eps2, or Drude-Lorentz
+    # parameters as taken by drude_lorentz_epsilon. A table may carry its normal incidence R, which is then kept as
+    # the normal incidence value and scaled by the Fresnel ratio R(angle)/R(0) of the interpolated epsilon, so the
+    # correction is continuous in angle. Results are cached per material, frequency grid and geometry.
+    polarizations = ["s", "p", "unpolarized"]
+
+    def __init__(self, cache_size=16):
+        self.materials = {}
+        self.cache = {}
+        self.cache_size = cache_size
+
+    def add_table(self, name, freq, eps1, eps2, reflectance=None):
+        # Rows without epsilon (e.g. where only R was extrapolated) are left out of the epsilon interpolation.
+        # Below the lowest epsilon row the table is continued by the Drude term 1 - wp^2/(w^2 + i*g*w) matching it
+        # there when it is metallic, above the highest and otherwise it is held constant.
+        order = np.argsort(np.asarray(freq, dtype=float))
+        freq = np.asarray(freq, dtype=float)[order]
+        values = np.asarray(eps1, dtype=float)[order] + 1j * np.asarray(eps2, dtype=float)[order]
+        valid = np.isfinite(values)
+        table = interp1d(freq[valid], values[valid], assume_sorted=True)
+        low = freq[valid][0]
+        a = -1 / (values[valid][0] - 1)
+        drude = [1, low / np.sqrt(a.real), low * a.imag / a.real] if a.real > 0 and a.imag >= 0 else None
+
+        def epsilon(x):
+            x = np.asarray(x, dtype=float)
+            result = table(np.clip(x, low, freq[valid][-1]))
+            below = x < low
+            if drude is not None and np.any(below):
+                result[below] = drude_lorentz_epsilon(x[below], drude)
+            return result
+
+        normal = None if reflectance is None else interp1d(freq, np.asarray(reflectance, dtype=float)[order], assume_sorted=True)
+        self.add_material(name, epsilon, normal)
+
+    def add_drude_lorentz(self, name, params):
+        params = np.array(params, dtype=float)
+        self.add_material(name, lambda freq: drude_lorentz_epsilon(freq, params))
+
+    def add_material(self, name, epsilon, normal=None):
+        # epsilon(freq) returns the complex dielectric function, normal(freq) the normal incidence R if known
+        self.materials[name] = (epsilon, normal)
+        for key in [key for key in self.cache if key[0] == name]:
+            self.cache.pop(key)
+
+    def read_material(self, path):
+        # a text file of freq, eps1, eps2 columns, or a single row of Drude-Lorentz parameters; named after the file
+        name = os.path.splitext(os.path.basename(path))[0]
+        data = np.atleast_2d(np.loadtxt(path, delimiter=None if path.lower().endswith((".txt", ".dat")) else ","))
+        if data.shape[0] == 1:
+            self.add_drude_lorentz(name, data[0])
+        elif data.shape[1] >= 3:
+            self.add_table(name, data[:, 0], data[:, 1], data[:, 2], data[:, 3] if data.shape[1] > 3 else None)
+        else:
+            raise ValueError("{} holds neither an epsilon table nor Drude-Lorentz parameters".format(path))
+        return name
+
+    def reflectance(self, name, freq, angle=0.0, polarization="s"):
+        freq = np.asarray(freq, dtype=float)
+        key = (name, angle, polarization, len(freq), hash(freq.tobytes()))
+        if key in self.cache:
+            self.cache[key] = self.cache.pop(key)
+            return self.cache[key]
+        epsilon, normal = self.materials[name]
+        if normal is None:
+            reflectance = fresnel_reflectance(epsilon(freq), angle, polarization)
+        elif angle == 0:
+            reflectance = normal(freq)
+        else:
+            values = epsilon(freq)
+            reflectance = normal(freq) * fresnel_reflectance(values, angle, polarization) / fresnel_reflectance(values)
+        self.cache[key] = reflectance
+        while len(self.cache) > self.cache_size:
+            self.cache.pop(next(iter(self.cache)))
+        return reflectance
+
+    def function(self, name, angle=0.0, polarization="s"):
+        # R(freq) of one mirror geometry in the form taken by merge_bands as reference
+        return partial(self.reflectance, name, angle=angle, polarization=polarization)
+
+
+def parse_sample_name(name):
+    # (sample, temperature in K or None) of a result name such as "CuO_300K_merged.txt": the sample is the text
+    # before the temperature, or the whole stem when there is none. Only spectrum file extensions are dropped, so
+    # a typed name such as "CuO_4.2K" keeps its decimal temperature
+    stem = os.path.basename(name)
+    if is_spectrum_file(stem):
+        stem = os.path.splitext(stem)[0]
+    match = re.search(r"(?<![\d.])(\d+(?:\.\d+)?)\s*K(?![a-zA-Z])", stem)
+    if match is None:
+        return stem, None
+    return stem[:match.start()].strip(" _-") or stem, float(match.group(1))
+
+
+class CampaignStore:
+    # Merged results of a measurement campaign in one folder. The spectra are appended to two float64 column files
+    # (freq.f8, reflectance.f8) that are read through np.memmap, and an SQLite index (index.sqlite) holds one row
+    # per spectrum with its name, sample, temperature, date, merge parameters and its span in the columns. Queries
+    # only touch the index and a spectrum is a view of the mapped columns, so opening a result parses nothing.
+    columns = ("freq", "reflectance")
+
+    def __init__(self, folder):
+        os.makedirs(folder, exist_ok=True)
+        self.folder = folder
+        self.index = sqlite3.connect(os.path.join(folder, "index.sqlite"))
+        self.index.row_factory = sqlite3.Row
+        self.index.execute("CREATE TABLE IF NOT EXISTS spectra (id INTEGER PRIMARY KEY, name TEXT, sample TEXT, temperature REAL, "
+                           "date TEXT, start INTEGER, points INTEGER, params TEXT)")
+        for column in ("sample", "temperature", "date"):
+            self.index.execute("CREATE INDEX IF NOT EXISTS spectra_{0} ON spectra ({0})".format(column))
+        self.index.commit()
+        self.maps = {}
+
+    def path(self, column):
+        return os.path.join(self.folder, column + ".f8")
+
+    def add(self, items):
+        # appends (name, freq, reflectance, params, metadata) items in one transaction and returns their ids; params
+        # is stored as JSON, metadata may give "sample", "temperature" and "date", else they come from the name and clock.
+        # The columns are first cut back to the end of the last indexed spectrum, dropping data of an interrupted add.
+        end = self.index.execute("SELECT COALESCE(MAX(start + points), 0) FROM spectra").fetchone()[0]
+        files = [open(self.path(column), "ab") for column in self.columns]
+        ids = []
+        try:
+            for fp in files:
+                # only cut when needed, a column still mapped elsewhere cannot be truncated on Windows
+                if os.fstat(fp.fileno()).st_size > 8 * end:
+                    fp.truncate(8 * end)
+            for name, freq, reflectance, params, metadata in items:
+                if len(freq) != len(reflectance):
+                    raise ValueError("{} has {} frequencies and {} reflectance points".format(name, len(freq), len(reflectance)))
+                sample, temperature = parse_sample_name(name)
+                metadata = dict(metadata or {})
+                for fp, values in zip(files, (freq, reflectance)):
+                    fp.write(np.asarray(values, dtype="<f8").tobytes())
+                cursor = self.index.execute("INSERT INTO spectra (name, sample, temperature, date, start, points, params) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                            (name, metadata.get("sample", sample), metadata.get("temperature", temperature),
+                                             metadata.get("date", time.strftime("%Y-%m-%d %H:%M:%S")), end, len(freq), json.dumps(params)))
+                ids.append(cursor.lastrowid)
+                end += len(freq)
+        except BaseException:
+            # nothing of a failed add is indexed, its column data is cut by the next add
+            self.index.rollback()
+            raise
+        else:
+            self.index.commit()
+        finally:
+            for fp in files:
+                fp.close()
+        return ids
+
+    def import_folder(self, folder):
+        # stores every readable spectrum file of folder, parsed once, with the file time as date; files whose name
+        # and time are already indexed are skipped, so importing a folder again only adds new or changed files
+        dates = {f: time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(os.path.getmtime(os.path.join(folder, f)))) for f in os.listdir(folder) if is_spectrum_file(f)}
+        indexed = set(tuple(row) for row in self.index.execute("SELECT name, date FROM spectra"))
+        files = [f for f in sort_nicely(list(dates)) if (f, dates[f]) not in indexed]
+        with ThreadPoolExecutor(max_workers=max(1, min(8, len(files)))) as pool:
+            data = list(pool.map(lambda f: read_refFIT_data(os.path.join(folder, f)), files))
+        return self.add((f, item[1], item[0], None, {"date": dates[f]}) for f, item in zip(files, data) if item is not None)
+
+    def query(self, sample=None, temperature=None, date=None, name=None):
+        # index rows ordered by sample, temperature and date; sample and name are SQL LIKE patterns, temperature and
+        # date a value or an inclusive (low, high) range with None for an open end
+        conditions = []
+        values = []
+        for column, value in (("sample", sample), ("name", name)):
+            if value:
+                conditions.append("{} LIKE ?".format(column))
+                values.append(value)
+        for column, value in (("temperature", temperature), ("date", date)):
+            if value is None:
+                continue
+            low, high = value if isinstance(value, (tuple, list)) else (value, value)
+            if low is not None:
+                conditions.append("{} >= ?".format(column))
+                values.append(low)
+            if high is not None:
+                conditions.append("{} <= ?".format(column))
+                values.append(high)
+        where = " WHERE " + " AND ".join(conditions) if conditions else ""
+        return self.index.execute("SELECT * FROM spectra" + where + " ORDER BY sample, temperature, date, id", values).fetchall()
+
+    def column(self, name, end):
+        # the column mapped up to at least end values, remapped after the file has grown
+        array = self.maps.get(name)
+        if array is None or len(array) < end:
+            array = np.memmap(self.path(name), dtype="<f8", mode="r")
+            self.maps[name] = array
+        return array
+
+    def spectrum(self, row):
+        # (reflectance, freq) of an index row as views of the mapped columns
+        end = row["start"] + row["points"]
+        return tuple(self.column(name, end)[row["start"]:end] for name in ("reflectance", "freq"))
+
+    def params(self, row):
+        return json.loads(row["params"])
+
+    def close(self):
+        self.maps.clear()
+        self.index.close()
+
+
+class SharedArrayRegistry:
+    # Arrays placed once in shared memory so that worker processes can view them without pickling.
+    # Workers only receive the small (name, shape, dtype) handle returned by put() and call attach_shared_array.
+    def __init__(self):
+        self.blocks = {}
+
+    def put(self, key, array):
+        array = np.ascontiguousarray(array)
+        if key in self.blocks:
+            self.release(key)
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        view = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+        view[...] = array
+        del view
+        self.blocks[key] = (block, (block.name, array.shape, array.dtype.str))
+        return self.blocks[key][1]
+
+    def handle(self, key):
+        return self.blocks[key][1]
+
+    def release(self, key):
+        block, handle = self.blocks.pop(key)
+        block.close()
+        block.unlink()
+
+    def close(self):
+        for key in list(self.blocks):
+            self.release(key)
+
+
+# shared memory blocks attached by this process, by name
+attached_blocks = {}
+
+
+def attach_shared_array(handle, writeable=False):
+    # view of an array placed by SharedArrayRegistry.put, read-only unless it is a result written by the workers;
+    # the block is attached once per process
+    name, shape, dtype = handle
+    if name not in attached_blocks:
+        try:
+            attached_blocks[name] = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # Python < 3.13 has no track argument
+            attached_blocks[name] = shared_memory.SharedMemory(name=name)
+    array = np.ndarray(shape, dtype=dtype, buffer=attached_blocks[name].buf)
+    array.flags.writeable = writeable
+    return array
+
+
+def detach_shared_array(handle):
+    # views of the block must have been dropped, otherwise the block stays attached until the process exits
+    block = attached_blocks.pop(handle[0], None)
+    if block is not None:
+        try:
+            block.close()
+        except BufferError:
+            attached_blocks[handle[0]] = block
+
+
+class StageProfiler:
+    # Times instrumented methods and records them as Chrome trace events (chrome://tracing, Perfetto).
+    # When disabled the wrappers only check a flag, so instrumentation can stay installed.
+    def __init__(self, callback=None, max_events=200000):
+        self.enabled = False
+        self.callback = callback
+        self.events = deque(maxlen=max_events)
+        self.origin = time.perf_counter()
+        self.depth = 0
+        self.active = {}
+        self.totals = {}
+
+    def set_enabled(self, enabled):
+        self.enabled = enabled
+
+    def instrument(self, obj, names):
+        for name in names:
+            setattr(obj, name, self.timed(name, getattr(obj, name)))
+
+    def timed(self, name, func):
+        def wrapper(*args, **kwargs):
+            if not self.enabled:
+                return func(*args, **kwargs)
+            self.depth += 1
+            self.active[name] = self.active.get(name, 0) + 1
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                end = time.perf_counter()
+                self.depth -= 1
+                self.active[name] -= 1
+                self.events.append({"name": name, "ph": "X", "ts": (start - self.origin) * 1e6, "dur": (end - start) * 1e6, "pid": os.getpid(), "tid": 0})
+                # recursive calls of the same stage (e.g. clamped sliders) are only counted once
+                if self.active[name] == 0:
+                    self.totals[name] = self.totals.get(name, 0) + end - start
+                if self.depth == 0:
+                    totals = self.totals
+                    self.totals = {}
+                    if self.callback is not None:
+                        self.callback(name, totals)
+        return wrapper
+
+    def save_trace(self, path):
+        with open(path, "w") as fp:
+            json.dump({"traceEvents": list(self.events), "displayTimeUnit": "ms"}, fp)
+
 class QDoubleSlider(QSlider):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
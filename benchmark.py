@@ -0,0 +1,132 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+import numpy as np
+
+# the GUI module is driven without a display
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+from PyQt5.QtWidgets import QApplication
+import GUI
+
+"""
+================
+Title: MergeSpec benchmarks
+Usage: python benchmark.py --sizes 10000 100000 1000000 5000000 --output bench.json
+Times the loading (text and OPUS), merging, auto-fill and export hot paths of the Spectrum widget on
+synthetic five-band spectra and reports throughput and peak memory as JSON.
+=================
+"""
+
+# frequency span of the synthetic THz, FIR, MIR, NIR and VIS bands (cm-1), chosen so that the
+# default breakpoints fall inside the slider ranges and the VIS band covers the HeNe line
+BAND_SPANS = [(5, 90), (50, 700), (400, 8000), (4000, 12000), (9000, 25000)]
+
+
+def make_bands(size, seed=0):
+    rng = np.random.RandomState(seed)
+    bands = []
+    for lo, hi in BAND_SPANS:
+        freq = np.linspace(lo, hi, size // len(BAND_SPANS))
+        reflectance = 0.6 + 0.3 * np.sin(freq / 700.0) * np.exp(-freq / 30000.0) + 0.005 * rng.randn(len(freq))
+        bands.append((reflectance, freq))
+    return bands
+
+
+def measure(func, repeat, memory):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    peak = None
+    if memory:
+        tracemalloc.start()
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return min(times), peak
+
+
+def run(spectrum, size, repeat, memory, folder):
+    bands = make_bands(size)
+    paths = []
+    for code, (reflectance, freq) in enumerate(bands):
+        path = os.path.join(folder, "band{}_{}.txt".format(code, size))
+        np.savetxt(path, np.transpose([freq, reflectance]), delimiter="\t")
+        paths.append(path)
+    opus_path = os.path.join(folder, "band2_{}.0".format(size))
+    GUI.write_opus(opus_path, {"AB": bands[2]})
+
+    for code in range(5):
+        reflectance, spectrum.freq[code] = spectrum.read_refFIT_data(paths[code])
+        spectrum.reflectance[code] = spectrum.store(reflectance)
+        spectrum.is_auto_fill[code] = []
+    spectrum.renew_graph()
+    breakpoint2 = spectrum.breakPoint2_sb.value()
+
+    stages = {
+        "read_refFIT_data": (lambda: spectrum.read_refFIT_data(paths[2]), len(bands[2][1])),
+        "read_refFIT_data_opus": (lambda: spectrum.read_refFIT_data(opus_path), len(bands[2][1])),
+        "merge_graph": (lambda: spectrum.merge_graph("2", breakpoint2, spectrum.breakPoint1_sb.value(), spectrum.breakPoint3_sb.value()), len(bands[1][1]) + len(bands[2][1])),
+        "scale_graph": (lambda: spectrum.scale_graph(2, 0.01, 1.01), len(bands[2][1])),
+        "remove_HeNe": (spectrum.remove_HeNe, len(bands[4][1])),
+        "save_mergedSpec": (lambda: spectrum.write_mergedSpec(os.path.join(folder, "merged_{}.txt".format(size))), size),
+    }
+    spectrum.VIS_removeHeNe_cb.blockSignals(True)
+    spectrum.VIS_removeHeNe_cb.setChecked(True)
+    spectrum.VIS_removeHeNe_cb.blockSignals(False)
+
+    results = {}
+    for name, (func, points) in stages.items():
+        seconds, peak = measure(func, repeat, memory)
+        results[name] = {"points": points, "seconds": seconds, "points_per_second": points / seconds, "peak_bytes": peak}
+
+    # the NIR band is dropped and rebuilt from the MIR and VIS edges
+    spectrum.reflectance[3] = []
+    spectrum.freq[3] = []
+    spectrum.renew_graph()
+    spectrum.auto_fill(3, True, 0)
+    seconds, peak = measure(lambda: spectrum.remake_auto_fill_data(3), repeat, memory)
+    points = len(spectrum.freq[3])
+    results["remake_auto_fill_data"] = {"points": points, "seconds": seconds, "points_per_second": points / seconds, "peak_bytes": peak}
+    spectrum.auto_fill(3, False, 0)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the MergeSpec hot paths on synthetic spectra.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000, 5000000], help="total number of points over the five bands")
+    parser.add_argument("--repeat", type=int, default=3, help="number of timed runs per stage, the fastest is reported")
+    parser.add_argument("--no-memory", action="store_true", help="skip the extra traced run used for peak memory")
+    parser.add_argument("--storage", choices=["float64", "float32"], default="float64", help="storage precision of the band arrays")
+    parser.add_argument("--output", default=None, help="write the JSON report to this file instead of stdout")
+    args = parser.parse_args()
+
+    app = QApplication.instance() or QApplication(sys.argv)
+    spectrum = GUI.Spectrum()
+    spectrum.precision_cb.setCurrentIndex(["float64", "float32"].index(args.storage))
+    # the canvas only shrinks from the large initial figure size once it is laid out on screen
+    spectrum.resize(1500, 900)
+    spectrum.show()
+    app.processEvents()
+    report = {"numpy": np.__version__, "python": sys.version.split()[0], "repeat": args.repeat, "storage": args.storage, "results": {}}
+    with tempfile.TemporaryDirectory() as folder:
+        for size in args.sizes:
+            report["results"][str(size)] = run(spectrum, size, args.repeat, not args.no_memory, folder)
+    text = json.dumps(report, indent=2)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, "w") as fp:
+            fp.write(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+# the fitting engine lives in the GUI module, which is imported without a display
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from GUI import fit_drude_lorentz_series, read_fit_table, read_refFIT_data, sort_nicely, is_spectrum_file, write_fit_table
+
+"""
+================
+Title: MergeSpec series fit
+Usage: python fit_series.py merged_folder --oscillators 4 --workers 8 --output fit.txt
+Fits a Drude-Lorentz model to every merged spectrum (two-column text files, e.g. from "Merge series") of a folder
+in natural name order, each sample starting from the fit of the previous one (every 25th sample from the previous
+such anchor, so the result does not depend on --workers), and writes one row of parameters per sample. With --kk the
+Kramers-Kronig epsilon is fitted instead of the reflectance; --start resumes from the table of a previous run.
+=================
+"""
+
+
+def read_series(folder):
+    # names and spectra of the folder; samples on a different grid than the first are interpolated onto it
+    # files that cannot be read are skipped
+    names = []
+    freq = None
+    reflectance = []
+    for name in sort_nicely([f for f in os.listdir(folder) if is_spectrum_file(f)]):
+        data = read_refFIT_data(os.path.join(folder, name))
+        if data is None:
+            continue
+        if freq is None:
+            freq = data[1]
+        names.append(os.path.splitext(name)[0])
+        reflectance.append(data[0] if np.array_equal(data[1], freq) else np.interp(freq, data[1], data[0]))
+    return names, freq, np.array(reflectance)
+
+
+def read_start(path, name):
+    # starting parameters from a table written by a previous run: the row of the sample name, else the last row
+    names, params, rms = read_fit_table(path)
+    return params[names.index(name)] if name in names else params[-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fit a Drude-Lorentz model to a folder of merged spectra.")
+    parser.add_argument("folder")
+    parser.add_argument("--oscillators", type=int, default=4, help="number of Lorentz oscillators besides the Drude term")
+    parser.add_argument("--points", type=int, default=1000, help="number of log-spaced frequencies the fit uses")
+    parser.add_argument("--kk", action="store_true", help="fit the Kramers-Kronig epsilon instead of the reflectance")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="number of processes fitting the blocks between anchor samples")
+    parser.add_argument("--start", default=None, help="fit table of a previous run to start from, by default the first sample is cold started")
+    parser.add_argument("--output", default="series_fit.txt")
+    args = parser.parse_args()
+
+    names, freq, reflectance = read_series(args.folder)
+    if len(names) == 0:
+        sys.exit("No spectra found in {}".format(args.folder))
+    params = read_start(args.start, names[0]) if args.start is not None else args.oscillators
+    start = time.perf_counter()
+    params, rms = fit_drude_lorentz_series(freq, reflectance, params, args.kk, args.points, args.workers)
+    write_fit_table(args.output, names, params, rms)
+    print("{} samples fitted in {:.2f} s, worst rms {:.4g}, written to {}".format(len(names), time.perf_counter() - start, np.max(rms), args.output))
+
+
+if __name__ == '__main__':
+    main()
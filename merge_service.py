@@ -0,0 +1,267 @@
+import os
+import sys
+import json
+import base64
+import pickle
+import argparse
+import threading
+import urllib.request
+import numpy as np
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ProcessPoolExecutor
+
+# the merge engine lives in the GUI module, which is imported without a display
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+from GUI import merge_bands, overlap_grid, overlap_mismatch, read_refFIT_data, ReferenceEngine, SharedArrayRegistry, attach_shared_array, detach_shared_array
+
+"""
+================
+Title: MergeSpec merge service
+Usage: python merge_service.py --port 8765 --workers 4
+Serves the merge engine on a local HTTP port so that other tools can merge spectra without the GUI.
+
+POST /merge with a JSON body
+    {"params": {"breakpoints": [4 values], "offset": [5 values], "multiplier": [5 values],
+                "auto_fill": [3 bools], "auto_fill_order": [3 ints], "remove_HeNe": bool,
+                "reference": "Au" | "Ag" | null, "reference_angle": degrees, "reference_polarization": "s" | "p" | "unpolarized"},
+     "samples": [{"name": "...", "bands": [5 entries of {"path": "..."} or {"freq": array, "reflectance": array} or null]}],
+     "encoding": "json" | "base64"}
+where an array is a list of numbers or {"base64": "...", "dtype": "<f8"}.
+The response is {"results": [{"name": "...", "freq": array, "reflectance": array, "overlap_rms": [4 values or null]}]},
+where overlap_rms is the rms mismatch of each scaled band pair over its overlap, for quality gates in batch runs.
+GET /health reports the pool size.
+=================
+"""
+
+# per-process state kept warm between requests: reference mirrors and parsed band files
+references = ReferenceEngine()
+band_cache = {}
+max_cached_files = 64
+
+
+def read_reference_tables():
+    # (freq, eps1, eps2, R) tables in ascending frequency order
+    with open(os.path.join(HERE, "Ag_Epsilon_Reflectance_400-35000cm-1.pickle"), "rb") as fp:
+        Ag = pickle.load(fp)["Yang2015PRB"]
+    with open(os.path.join(HERE, "Au_Eps_Reflectance_Olmon2012PRB.pickle"), "rb") as fp:
+        Au = pickle.load(fp)
+    tables = {}
+    for name, table in (("Ag", Ag), ("Au", Au)):
+        order = np.argsort(np.asarray(table.freq))
+        eps1, eps2 = (table.eps1, table.eps2) if name == "Au" else (table.ep1, table.ep2)
+        tables[name] = tuple(np.asarray(column, dtype=float)[order] for column in (table.freq, eps1, eps2, table.R))
+    return tables
+
+
+def load_references(handles=None):
+    # worker initializer; with handles the tables are viewed from shared memory instead of unpickled per process
+    if handles is None:
+        tables = read_reference_tables()
+    else:
+        tables = {name: tuple(attach_shared_array(handle) for handle in columns) for name, columns in handles.items()}
+    for name, (freq, eps1, eps2, R) in tables.items():
+        references.add_table(name, freq, eps1, eps2, R)
+
+
+def decode_array(value):
+    if isinstance(value, dict):
+        return np.frombuffer(base64.b64decode(value["base64"]), dtype=value.get("dtype", "<f8")).astype(float)
+    return np.asarray(value, dtype=float)
+
+
+def encode_array(array, encoding):
+    if encoding == "base64":
+        return {"base64": base64.b64encode(np.ascontiguousarray(array, dtype="<f8").tobytes()).decode("ascii"), "dtype": "<f8"}
+    return np.asarray(array).tolist()
+
+
+def read_band(path):
+    stat = os.stat(path)
+    key = (path, stat.st_mtime, stat.st_size)
+    if key not in band_cache:
+        item = read_refFIT_data(path)
+        if item is None:
+            raise ValueError("cannot read {}".format(path))
+        if len(band_cache) >= max_cached_files:
+            band_cache.pop(next(iter(band_cache)))
+        band_cache[key] = item
+    return band_cache[key]
+
+
+def resolve_bands(bands):
+    if len(bands) != 5:
+        raise ValueError("every sample needs 5 band entries (THz, FIR, MIR, NIR, VIS)")
+    resolved = []
+    for band in bands:
+        if band is None:
+            resolved.append(None)
+        elif "path" in band:
+            resolved.append(read_band(band["path"]))
+        elif "shared" in band:
+            resolved.append((attach_shared_array(band["shared"]["reflectance"]), attach_shared_array(band["shared"]["freq"])))
+        else:
+            resolved.append((band["reflectance"], band["freq"]))
+    return resolved
+
+
+def merge_samples(params, samples):
+    # Worker task. Samples with the same bands on the same grids are stacked and merged in one call.
+    if params.get("reference") is not None and params["reference"] not in references.materials:
+        raise ValueError("unknown reference {}".format(params["reference"]))
+    reference = None
+    if params.get("reference") is not None:
+        reference = references.function(params["reference"], params.get("reference_angle", 0.0), params.get("reference_polarization", "s"))
+    resolved = [resolve_bands(sample["bands"]) for sample in samples]
+    groups = []
+    for k, bands in enumerate(resolved):
+        for group in groups:
+            first = resolved[group[0]]
+            if all((a is None and b is None) or (a is not None and b is not None and np.array_equal(a[1], b[1])) for a, b in zip(first, bands)):
+                group.append(k)
+                break
+        else:
+            groups.append([k])
+    results = [None] * len(samples)
+    for group in groups:
+        first = resolved[group[0]]
+        freq = [[] if item is None else item[1] for item in first]
+        reflectance = [[] if first[code] is None else np.vstack([resolved[k][code][0] for k in group]) for code in range(5)]
+        merged_freq, merged_R = merge_bands(freq, reflectance, params["breakpoints"], params["offset"], params["multiplier"],
+                                            params.get("auto_fill", (False, False, False)), params.get("auto_fill_order", (0, 0, 0)),
+                                            params.get("remove_HeNe", False), reference)
+        rms = np.full((len(group), 4), np.nan)
+        for i in range(4):
+            resampled = overlap_grid(freq[i], reflectance[i], freq[i+1], reflectance[i+1]) if len(freq[i]) > 0 and len(freq[i+1]) > 0 else None
+            if resampled is not None:
+                rms[:, i] = overlap_mismatch(resampled[1], resampled[2], (params["offset"][i], params["multiplier"][i]), (params["offset"][i+1], params["multiplier"][i+1]))[2]
+        for row, k in enumerate(group):
+            results[k] = (merged_freq, merged_R[row], [None if np.isnan(value) else float(value) for value in rms[row]])
+    del resolved, first, freq, reflectance
+    for sample in samples:
+        for band in sample["bands"]:
+            if band is not None and "shared" in band:
+                detach_shared_array(band["shared"]["freq"])
+                detach_shared_array(band["shared"]["reflectance"])
+    return results
+
+
+class MergeServer(ThreadingHTTPServer):
+    def __init__(self, address, workers):
+        super().__init__(address, MergeRequestHandler)
+        self.workers = workers
+        # reference tables and inline band arrays are handed to the workers through shared memory
+        self.registry = SharedArrayRegistry()
+        handles = {}
+        for name, columns in read_reference_tables().items():
+            handles[name] = tuple(self.registry.put("{}_{}".format(name, column), array) for column, array in zip(("freq", "eps1", "eps2", "R"), columns))
+        self.pool = ProcessPoolExecutor(max_workers=workers, initializer=load_references, initargs=(handles,))
+        self.counter = 0
+        self.lock = threading.Lock()
+
+    def merge(self, request):
+        params = request["params"]
+        if len(params["breakpoints"]) != 4 or len(params["offset"]) != 5 or len(params["multiplier"]) != 5:
+            raise ValueError("params need 4 breakpoints and 5 offsets and multipliers")
+        samples = request["samples"]
+        with self.lock:
+            self.counter += 1
+            prefix = "request{}".format(self.counter)
+        keys = []
+        try:
+            for k, sample in enumerate(samples):
+                bands = []
+                for code, band in enumerate(sample["bands"]):
+                    if band is None or "path" in band:
+                        bands.append(band)
+                        continue
+                    shared = {}
+                    for field in ("freq", "reflectance"):
+                        key = "{}_{}_{}_{}".format(prefix, k, code, field)
+                        shared[field] = self.registry.put(key, decode_array(band[field]))
+                        keys.append(key)
+                    bands.append({"shared": shared})
+                sample["bands"] = bands
+            # one batch per worker
+            size = max(1, -(-len(samples) // self.workers))
+            futures = [self.pool.submit(merge_samples, params, samples[i:i+size]) for i in range(0, len(samples), size)]
+            merged = [item for future in futures for item in future.result()]
+        finally:
+            for key in keys:
+                self.registry.release(key)
+        encoding = request.get("encoding", "json")
+        return [{"name": sample.get("name", str(k)), "freq": encode_array(freq, encoding), "reflectance": encode_array(R, encoding), "overlap_rms": rms}
+                for k, (sample, (freq, R, rms)) in enumerate(zip(samples, merged))]
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown()
+        self.registry.close()
+
+
+class MergeRequestHandler(BaseHTTPRequestHandler):
+    def send_json(self, code, data):
+        body = json.dumps(data).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self.send_json(200, {"status": "ok", "workers": self.server.workers})
+        else:
+            self.send_json(404, {"error": "unknown path {}".format(self.path)})
+
+    def do_POST(self):
+        if self.path != "/merge":
+            self.send_json(404, {"error": "unknown path {}".format(self.path)})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            results = self.server.merge(request)
+        except Exception as e:
+            self.send_json(400, {"error": "{}: {}".format(type(e).__name__, e)})
+            return
+        self.send_json(200, {"results": results})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def request_merge(samples, params, url="http://127.0.0.1:8765", encoding="base64", diagnostics=False):
+    # client helper; samples as in POST /merge, numpy arrays are sent base64 encoded.
+    # With diagnostics the overlap rms list is returned as a fourth item.
+    payload = [{"name": sample.get("name", str(k)),
+                "bands": [band if band is None or "path" in band else {"freq": encode_array(band["freq"], encoding), "reflectance": encode_array(band["reflectance"], encoding)} for band in sample["bands"]]}
+               for k, sample in enumerate(samples)]
+    body = json.dumps({"params": params, "samples": payload, "encoding": encoding}).encode()
+    request = urllib.request.Request(url + "/merge", data=body, headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request) as response:
+        results = json.loads(response.read())["results"]
+    if diagnostics:
+        return [(result["name"], decode_array(result["freq"]), decode_array(result["reflectance"]), result["overlap_rms"]) for result in results]
+    return [(result["name"], decode_array(result["freq"]), decode_array(result["reflectance"])) for result in results]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the MergeSpec merge engine on a local port.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+    server = MergeServer((args.host, args.port), args.workers)
+    print("MergeSpec service on http://{}:{} with {} workers".format(args.host, args.port, args.workers))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
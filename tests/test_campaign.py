@@ -0,0 +1,59 @@
+import os
+import sys
+import numpy as np
+
+# the store lives in the GUI module, which is imported without a display
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from GUI import CampaignStore, parse_sample_name
+
+
+def spectra():
+    freq = np.linspace(20, 20000, 500)
+    return [("CuO_{}K_merged.txt".format(t), freq, 0.5 + 0.001 * t + 0.1 * np.sin(freq / 1000), {"breakpoints": [600, 7000]})
+            for t in (10, 4.2, 300)]
+
+
+def test_parse_sample_name():
+    assert parse_sample_name("CuO_300K_merged.txt") == ("CuO", 300.0)
+    assert parse_sample_name("CuO_4.2K") == ("CuO", 4.2)
+    assert parse_sample_name("reference.dat") == ("reference", None)
+
+
+def test_round_trip(tmp_path):
+    folder = str(tmp_path / "campaign")
+    store = CampaignStore(folder)
+    items = spectra()
+    ids = store.add((name, freq, reflectance, params, None) for name, freq, reflectance, params in items)
+    assert len(ids) == 3
+    store.add([("Au_mirror.txt", items[0][1], np.ones(500), None, {"sample": "Au", "date": "2026-01-01 00:00:00"})])
+    store.close()
+    # everything is read back from the files of the folder
+    store = CampaignStore(folder)
+    rows = store.query(sample="CuO")
+    assert [row["temperature"] for row in rows] == [4.2, 10.0, 300.0]
+    for row in rows:
+        name, freq, reflectance, params = next(item for item in items if item[0] == row["name"])
+        stored_reflectance, stored_freq = store.spectrum(row)
+        np.testing.assert_array_equal(stored_freq, freq)
+        np.testing.assert_array_equal(stored_reflectance, reflectance)
+        assert store.params(row) == params
+    assert [row["name"] for row in store.query(temperature=(None, 20))] == ["CuO_4.2K_merged.txt", "CuO_10K_merged.txt"]
+    mirror, = store.query(date=("2026-01-01", "2026-01-02"))
+    assert mirror["sample"] == "Au"
+    assert store.params(mirror) is None
+    np.testing.assert_array_equal(store.spectrum(mirror)[0], np.ones(500))
+    store.close()
+
+
+def test_import_folder_skips_known_files(tmp_path):
+    data = tmp_path / "data"
+    data.mkdir()
+    for name, freq, reflectance, params in spectra():
+        np.savetxt(str(data / name), np.column_stack([freq, reflectance]))
+    store = CampaignStore(str(tmp_path / "campaign"))
+    assert len(store.import_folder(str(data))) == 3
+    assert store.import_folder(str(data)) == []
+    assert len(store.query()) == 3
+    store.close()
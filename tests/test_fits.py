@@ -0,0 +1,32 @@
+import os
+import sys
+import numpy as np
+
+# the fitters live in the GUI module, which is imported without a display
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from GUI import drude_lorentz_reflectance, fit_drude_lorentz_series
+
+
+def drifting_series(count):
+    # a Drude term and three oscillators whose plasma frequency and damping drift along the series
+    freq = np.geomspace(20, 20000, 2000)
+    base = np.array([3.0, 8000, 300, 400, 2000, 60, 1500, 3000, 300, 6000, 5000, 1500])
+    series = []
+    for k in range(count):
+        params = base.copy()
+        params[1] *= 1 + 0.3 * k / count
+        params[3] *= 1 - 0.1 * k / count
+        series.append(drude_lorentz_reflectance(freq, params))
+    return freq, np.array(series), base
+
+
+def test_series_fit_does_not_depend_on_the_worker_count():
+    freq, series, base = drifting_series(24)
+    serial, serial_rms = fit_drude_lorentz_series(freq, series, base, points=200, workers=1, stride=5)
+    parallel, parallel_rms = fit_drude_lorentz_series(freq, series, base, points=200, workers=3, stride=5)
+    assert serial.shape == (24, len(base))
+    np.testing.assert_array_equal(parallel, serial)
+    np.testing.assert_array_equal(parallel_rms, serial_rms)
+    assert serial_rms.max() < 1e-3
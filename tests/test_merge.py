@@ -0,0 +1,47 @@
+import os
+import sys
+import numpy as np
+
+# the merge functions live in the GUI module, which is imported without a display
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from GUI import MergePipeline, merge_bands, sweep_merge, sweep_param_sets
+
+
+def synthetic_bands():
+    # FIR, MIR and VIS with the NIR band missing, so that it can be auto-filled
+    freq = [[], np.linspace(50, 700, 2000), np.linspace(500, 8000, 6000), [], np.linspace(6000, 20000, 8000)]
+    reflectance = [[] if len(f) == 0 else 0.9 - 0.00001 * f + 0.01 * np.sin(f / 50) for f in freq]
+    reflectance[4][(freq[4] > 15790) & (freq[4] < 15810)] += 0.3
+    return freq, reflectance
+
+
+def mirror(freq):
+    return 0.98 - 0.000001 * freq
+
+
+def test_pipeline_matches_merge_bands():
+    freq, reflectance = synthetic_bands()
+    pipeline = MergePipeline()
+    sources = [None if len(f) == 0 else ((i, 0), R, f) for i, (f, R) in enumerate(zip(freq, reflectance))]
+    for order in range(3):
+        params = dict(breakpoints=(40, 600, 7000, 7000), offset=(0, 0.01, 0, 0, -0.02), multiplier=(1, 1, 1.1, 1, 0.95),
+                      auto_fill=(False, False, True), auto_fill_order=(0, 0, order), remove_HeNe=True, reference=mirror)
+        merged_freq, merged_R = merge_bands(freq, reflectance, **params)
+        key, (pipeline_freq, pipeline_R) = pipeline.run(sources, reference_key="mirror", **params)
+        np.testing.assert_array_equal(pipeline_freq, merged_freq)
+        np.testing.assert_allclose(pipeline_R, merged_R, rtol=1e-12)
+    # the loaded bands are only read once
+    assert pipeline.counts["load"][1] == 3
+
+
+def test_sweep_does_not_depend_on_the_worker_count():
+    freq, reflectance = synthetic_bands()
+    breakpoints, offset, multiplier = sweep_param_sets((40, 600, 7000, 7000), (0,) * 5, (1,) * 5, (0.05, 0.01, 0.02), 24, seed=1,
+                                                       active_bands=(False, True, True, False, True), active_breakpoints=(False, True, True, False))
+    grid = np.linspace(60, 19000, 1500)
+    serial = sweep_merge(freq, reflectance, breakpoints, offset, multiplier, grid, (False, False, True), (0, 0, 1), True, mirror, workers=1)
+    parallel = sweep_merge(freq, reflectance, breakpoints, offset, multiplier, grid, (False, False, True), (0, 0, 1), True, mirror, workers=2)
+    assert serial.shape == (24, len(grid))
+    np.testing.assert_allclose(parallel, serial, rtol=1e-12)
@@ -0,0 +1,55 @@
+import os
+import sys
+import numpy as np
+
+# the readers live in the GUI module, which is imported without a display
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from GUI import OpusFile, is_opus_file, read_refFIT_data, read_single_beam, write_opus
+
+
+def synthetic_band():
+    freq = np.linspace(500, 8000, 4001)
+    sample = (1 + 0.5 * np.sin(freq / 700)).astype(np.float32)
+    reference = (2 + np.cos(freq / 900)).astype(np.float32)
+    return freq, sample, reference
+
+
+def test_absorbance_block_round_trip(tmp_path):
+    freq, sample, reference = synthetic_band()
+    path = str(tmp_path / "sample.0")
+    write_opus(path, {"AB": (sample, freq)})
+    assert is_opus_file(path)
+    reflectance, read_freq = read_refFIT_data(path)
+    # written descending as OPUS does, read back ascending
+    assert np.all(np.diff(read_freq) > 0)
+    np.testing.assert_allclose(read_freq, freq)
+    np.testing.assert_array_equal(reflectance, sample)
+
+
+def test_single_channel_blocks(tmp_path):
+    freq, sample, reference = synthetic_band()
+    path = str(tmp_path / "sample.1")
+    write_opus(path, {"ScSm": (sample, freq), "ScRf": (reference, freq)}, {"Instrument": {"LWN": 15798.0}})
+    opus = OpusFile(path)
+    assert set(opus.blocks) == {"ScSm", "ScRf"}
+    assert opus.laser() == 15798.0
+    assert opus.x_axis("ScSm")[2] == len(freq)
+    values, read_freq = opus.spectrum("ScRf")
+    np.testing.assert_allclose(read_freq, freq)
+    np.testing.assert_array_equal(values, reference)
+    beam_freq, beam = read_single_beam(path)
+    np.testing.assert_array_equal(beam, sample)
+    # without an AB block the reflectance is the ratio of the sample and reference channels in the file
+    reflectance, read_freq = read_refFIT_data(path)
+    np.testing.assert_allclose(read_freq, freq)
+    np.testing.assert_allclose(reflectance, sample / reference, rtol=1e-6)
+
+
+def test_not_an_opus_file(tmp_path):
+    path = str(tmp_path / "broken.0")
+    with open(path, "wb") as fp:
+        fp.write(b"not an opus file")
+    assert not is_opus_file(path)
+    assert read_refFIT_data(path) is None
@@ -0,0 +1,29 @@
+import os
+import sys
+import numpy as np
+
+# the reference engine lives in the GUI module, which is imported without a display
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from GUI import fresnel_reflectance
+
+
+def test_normal_incidence():
+    n = np.array([1.5, 2.4, 4.0])
+    expected = ((n - 1) / (n + 1)) ** 2
+    for polarization in ("s", "p", "unpolarized"):
+        np.testing.assert_allclose(fresnel_reflectance(n ** 2, 0.0, polarization), expected)
+    # an absorbing half-space, |(N - 1) / (N + 1)|^2 with the complex index N
+    index = np.sqrt(complex(-20, 5))
+    np.testing.assert_allclose(fresnel_reflectance(index ** 2), abs((index - 1) / (index + 1)) ** 2)
+
+
+def test_brewster_angle():
+    for n, ambient in ((1.5, 1.0), (3.4, 1.0), (1.5, 1.33 ** 2)):
+        brewster = np.degrees(np.arctan(n / np.sqrt(ambient)))
+        assert fresnel_reflectance(n ** 2, brewster, "p", ambient) < 1e-20
+        assert fresnel_reflectance(n ** 2, brewster, "s", ambient) > 0.01
+        # p light is reflected on either side of the Brewster angle
+        assert fresnel_reflectance(n ** 2, brewster - 5, "p", ambient) > 1e-5
+        assert fresnel_reflectance(n ** 2, brewster + 5, "p", ambient) > 1e-5
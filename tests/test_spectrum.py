@@ -0,0 +1,46 @@
+import os
+import sys
+import numpy as np
+
+# the window is built offscreen, without a display
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyQt5.QtWidgets import QApplication
+from GUI import Spectrum
+
+app = QApplication.instance() or QApplication([])
+
+
+def vis_with_HeNe_line():
+    freq = np.linspace(10000, 20000, 5000)
+    reflectance = 0.5 + 0 * freq
+    reflectance[(freq > 15790) & (freq < 15810)] = 0.9
+    return freq, reflectance
+
+
+def test_HeNe_removal_survives_storage_dtype_switch():
+    spectrum = Spectrum()
+    freq, reflectance = vis_with_HeNe_line()
+    spectrum.update_band(4, "vis", reflectance, freq)
+    spectrum.VIS_removeHeNe_cb.setChecked(True)
+    before = spectrum.merged_spectrum()[1]
+    spectrum.set_storage_dtype(1)
+    assert spectrum.reflectance[4].dtype == np.float32
+    # the band shown and the merged spectrum both come without the HeNe line
+    np.testing.assert_allclose(spectrum.reflectance[4], 0.5, rtol=1e-6)
+    after = spectrum.merged_spectrum()[1]
+    np.testing.assert_allclose(after, before, rtol=1e-6)
+    spectrum.set_storage_dtype(0)
+    np.testing.assert_allclose(spectrum.reflectance[4], 0.5)
+    np.testing.assert_allclose(spectrum.merged_spectrum()[1], before, rtol=1e-6)
+
+
+def test_reloaded_band_is_merged_afresh():
+    spectrum = Spectrum()
+    freq, reflectance = vis_with_HeNe_line()
+    spectrum.update_band(4, "vis", reflectance, freq)
+    first = spectrum.merged_spectrum()[1]
+    # new data in the same band must not be served from the pipeline cache of the old data
+    spectrum.update_band(4, "vis", reflectance * 0.5, freq)
+    np.testing.assert_allclose(spectrum.merged_spectrum()[1], first * 0.5)